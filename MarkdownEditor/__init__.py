@@ -1 +1,3 @@
 from .core import MarkdownEdit
+from .instrumentation import Instrumentation
+from .diagnostics import Diagnostics
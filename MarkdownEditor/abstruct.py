@@ -94,7 +94,7 @@ class AbstructCursor(QObject):
         # 光标闪烁标志位
         # 光标闪烁标志位翻转
         self.__showCursorShader = True
-        self.showCursorShaderTimer = QTimer()
+        self.showCursorShaderTimer = QTimer(self)  # <-- 和光标一起销毁
         self.showCursorShaderTimer.timeout.connect(
             lambda: (self.setIsShowCursorShader(not self.__showCursorShader)))
         self.showCursorShaderTimer.setSingleShot(False)
@@ -145,25 +145,16 @@ class AbstructCursor(QObject):
             elif pos == self.POSITION_START:
                 pos = 0
 
-        # 当前容纳不下
-        if pos >= 0:  # 向前
-            for ast in self.rootAst().children[self.rootAst().index(self.ast()):]:
-                t = len(ast.toMarkdown())
-                if pos >= t:
-                    pos -= t
-                else:
-                    self._ast, self._pos = ast, pos
-                    break
-            else:
-                self._ast, self._pos = self.rootAst().astOf(-1), len(ast.toMarkdown()) - 1  # 末端
-        else:  # 向后
-            for ast in self.rootAst().children[:self.rootAst().index(self.ast())][::-1]:
-                pos += len(ast.toMarkdown())
-                if pos >= 0:
-                    self._ast, self._pos = ast, pos
-                    break
-            else:
-                self._ast, self._pos = self.rootAst().astOf(0), 0  # 顶端
+        # 当前容纳不下, 通过 root 的 block index 定位
+        root = self.rootAst()
+        offset = root.offsetOf(self.ast()) + pos
+        if offset < 0:
+            self._ast, self._pos = root.astOf(0), 0  # 顶端
+        elif offset >= root.length():
+            ast = root.astOf(-1)
+            self._ast, self._pos = ast, len(ast.toMarkdown()) - 1  # 末端
+        else:
+            self._ast, self._pos = root.astAt(offset)
 
     def setAST(self, ast, pos=None):
         """ set position """
@@ -340,6 +331,14 @@ class AbstructTextParagraph():
 
     """" operation """
 
+    def layout(self) -> int:
+        """ 排版, 返回高度 """
+        raise NotImplementedError
+
+    def rasterize(self) -> QPixmap:
+        """ 绘制排版的结果 """
+        raise NotImplementedError
+
     def render(self) -> QPixmap:
         raise NotImplementedError
 
@@ -1,14 +1,19 @@
+import itertools
 import typing as t
 
 from PyQt5.QtCore import QMargins, QRect
 from PyQt5.QtCore import QPointF
-from PyQt5.QtGui import QPainter, QColor, QPixmap
+from PyQt5.QtGui import QPainter, QColor, QPixmap, QFont, QPicture
 
 # from .cursor import MarkdownCursor
 from .abstruct import AbstructCachePaint
 from .component import TextParagraph
+from .diagnostics import getLogger
+from .instrumentation import span
 from .markdown_ast import MarkdownASTBase
 
+logger = getLogger(__name__)
+
 
 def paintMemory(func):
     def wapper(*args, **kwargs):
@@ -23,8 +28,11 @@ def paintMemory(func):
 
 
 class CachePaint(AbstructCachePaint):
+    __layoutVersions = itertools.count(1)  # <-- 所有 CachePaint 共用, 版本不会重复
+
     def __init__(self, parent):
         super(CachePaint, self).__init__(parent)
+        self.__layoutVersion = 0
         # 垂直距离
         # self._parent: AbstractMarkDownDocument = parent
         self._verticalSpace: int = 10
@@ -47,71 +55,98 @@ class CachePaint(AbstructCachePaint):
         self._cacheTextParagraphs: t.Dict[MarkdownASTBase, t.List[TextParagraph]] = {}
         # cache ast geometry drawing
         self._cachePaintingGeometry: t.Dict[MarkdownASTBase, QRect] = {}
+        # the height of ast after layout
+        self._cacheHeight: t.Dict[MarkdownASTBase, int] = {}
 
     def renderContent(self, func, ast: MarkdownASTBase, data=None):
         self._paragraphs[-1].pullRenderCache(func=func, data=data, painter=self.painter(), ast=ast)
 
-    def render(self, resetCache=True) -> t.Dict[MarkdownASTBase, QPixmap]:
-        """ 渲染 """
-
-        def _finish_a_ast_render():
-            if len(ast_part_pixmaps) > 0:  # merge mutil pixmap
-                pixmap = QPixmap(ast_part_pixmaps[0].width(), sum(pm.height() for pm in ast_part_pixmaps))
-                if pixmap.height() != 0:
-                    pixmap.fill(QColor(0, 0, 0, 0))
-                    painter, y = QPainter(pixmap), 0
-                    for pm in ast_part_pixmaps:
-                        painter.drawPixmap(0, y, pm)
-                        y += pm.height()
-                    pixmaps.append(pixmap)
-                    painter.end()
-                pbs, y = [], 0
-                for mp, part_CursorPluginBases in zip(ast_part_pixmaps, ast_part_CursorPluginBases):
-                    offest = QPointF(0, y)
-                    pbs += [(ast, b + offest) for ast, b in part_CursorPluginBases]
-                    y += mp.height()
-
-            if len(ast_part_pixmaps) != 0:
-                self._cachePxiamp[now_ast] = pixmap  # a pixmap for a ast
-                self._cacheCursorPluginBases[now_ast] = pbs
-                self._cacheTextParagraphs[now_ast] = ast_part_TextParagraphs
-
-        pixmaps = []
-        ast_part_pixmaps = []
-        ast_part_CursorPluginBases = []
-        ast_part_TextParagraphs = []
-        now_ast = None
+    def layout(self, resetCache=True) -> None:
+        """ 排版, 只计算 cursor bases 和高度, 不绘制像素 """
         if resetCache:
             self._cachePxiamp.clear()
             self._cacheCursorPluginBases.clear()
             self._cacheTextParagraphs.clear()
             self._cachePaintingGeometry.clear()
+            self._cacheHeight.clear()
+        self.__layoutVersion = next(self.__layoutVersions)
 
-        the_len = len(self._paragraphs)
-
-        for idx, p in enumerate(self._paragraphs):
+        for p in self._paragraphs:
             p.setInPragraphReutrnSpace(self._inPragraphReutrnSpace)
             p.setOutPragraphReutrnSpace(self._outPragraphReutrnSpace)
             p.setPageMargins(self._margins)
             p.setViewWdith(self._viewWdith)
-            # render
-            pximap_part = p.render()
-            if p.ast() is not now_ast:  # <-- The ast now painteed transform
-                _finish_a_ast_render()
-
-                ast_part_pixmaps = []  # reset
-                ast_part_CursorPluginBases = []
-                ast_part_TextParagraphs = []
-
+            height = p.layout()
+            ast = p.ast()
+            if ast not in self._cacheTextParagraphs:  # <-- The ast now painteed transform
+                self._cacheTextParagraphs[ast] = []
+                self._cacheCursorPluginBases[ast] = []
+                self._cacheHeight[ast] = 0
+                self._cachePxiamp.pop(ast, None)
             # register
-            ast_part_pixmaps.append(pximap_part)
-            ast_part_CursorPluginBases.append(p.cursorBases())
-            ast_part_TextParagraphs.append(p)
+            offest = QPointF(0, self._cacheHeight[ast])
+            self._cacheCursorPluginBases[ast] += [(a, b + offest) for a, b in p.cursorBases()]
+            self._cacheTextParagraphs[ast].append(p)
+            self._cacheHeight[ast] += height
+
+    def layoutVersion(self) -> int:
+        """ it is changed by each layout (the cursor bases are changed), it is unique in the process """
+        return self.__layoutVersion
+
+    def rasterize(self, ast: MarkdownASTBase) -> QPixmap:
+        """ 绘制排版后的 ast, 多个段落合并为一个 pixmap """
+        if ast in self._cachePxiamp:
+            return self._cachePxiamp[ast]
+        paragraphs = self._cacheTextParagraphs[ast]
+        with span("raster", ast=ast, paragraphs=len(paragraphs)):
+            images = [p.rasterize() for p in paragraphs]  # <-- 段落的 pixmap 有缓存
+            pixmap = QPixmap(max(p.width() for p in paragraphs), self._cacheHeight[ast])
+            if pixmap.height() != 0:  # merge mutil pixmap
+                with span("merge", ast=ast, paragraphs=len(paragraphs)):
+                    pixmap.fill(QColor(0, 0, 0, 0))
+                    painter, y = QPainter(pixmap), 0
+                    for p, image in zip(paragraphs, images):
+                        painter.drawPixmap(0, y, image)
+                        y += p.height()
+                    painter.end()
+        self._cachePxiamp[ast] = pixmap  # a pixmap for a ast
+        return pixmap
 
-            # update
-            now_ast = p.ast()
-        _finish_a_ast_render()
-        return
+    def render(self, resetCache=True) -> t.Dict[MarkdownASTBase, QPixmap]:
+        """ 排版并绘制 """
+        with span("render", asts=len(self._cacheTextParagraphs)):
+            self.layout(resetCache=resetCache)
+            for ast in self._cacheTextParagraphs:
+                self.rasterize(ast)
+        return self._cachePxiamp
+
+    def layoutAst(self, ast: MarkdownASTBase, width: int, margins: QMargins, style, cursor=None) -> int:
+        """ layout a root block without painting, the cursor bases and text paragraphs are cached, return the height """
+        with span("layout", ast=ast, width=width):
+            return self.__layoutAst(ast=ast, width=width, margins=margins, style=style, cursor=cursor)
+
+    def __layoutAst(self, ast: MarkdownASTBase, width: int, margins: QMargins, style, cursor=None) -> int:
+        picture = QPicture()
+        painter = QPainter(picture)
+        painter.setFont(style.hintFont(font=QFont(), ast='root'))
+        # 排版缓存
+        self.reset()
+        self.setPainter(painter)
+        self.setPaperWidth(width)
+        self.setMargins(margins)
+        self.newParagraph()  # 重置段落
+
+        # 渲染登记
+        ast.render(ht=self, style=style, cursor=cursor)
+        painter.end()
+        del picture, painter
+        self.layout(resetCache=True)
+        return self._cacheHeight.get(ast, 0)
+
+    def renderAst(self, ast: MarkdownASTBase, width: int, margins: QMargins, style, cursor=None) -> QPixmap:
+        """ render a root block to a pixmap, the cursor bases and text paragraphs are cached """
+        self.layoutAst(ast=ast, width=width, margins=margins, style=style, cursor=cursor)
+        return self.rasterize(ast)
 
     def reset(self):
         self._paragraphs = []
@@ -129,7 +164,7 @@ class CachePaint(AbstructCachePaint):
             def __exit__(cls, exc_type, exc_val, exc_tb):
                 self._paragraphs.pop(-1)
                 if exc_type is not None:
-                    print(exc_type)
+                    logger.debug("the sub paragraph is dropped: %s", exc_type.__name__)
                     raise exc_type
                 return False
 
@@ -173,8 +208,10 @@ class CachePaint(AbstructCachePaint):
             return self._cachePxiamp[ast]
         return self._cachePxiamp
 
-    def height(self) -> int:
-        return sum(pm.height() for pm in self._cachePxiamp.values())
+    def height(self, ast=None) -> int:
+        if ast:
+            return self._cacheHeight[ast]
+        return sum(self._cacheHeight.values())
 
     def cursorPluginBases(self, ast,
                           pos: t.Optional[int] = None,
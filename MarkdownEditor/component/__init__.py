@@ -3,4 +3,6 @@ from .text_paragraph import TextParagraph
 from .content_item import ContentItem,ListItem
 from .load_proress import LoadProgressBar
 from .container import Container
+from .block_layout import BlockLayout
+from .selection_geometry import SelectionGeometry
 from .scrollbar import ScrollDelegate
\ No newline at end of file
@@ -0,0 +1,202 @@
+import typing as t
+
+from PyQt5.QtCore import QObject, QPoint, QPointF, QRect
+from PyQt5.QtGui import QPainter
+from PyQt5.QtWidgets import QScrollArea
+
+from .container import cursorBaseOf
+from .content_block import ContentBlock
+from .height_index import HeightIndex
+from ..abstruct import AbstractMarkdownEdit
+from ..document import MarkDownDocument
+from ..image_loader import ImageLoader
+from ..instrumentation import span
+from ..latex import LatexRenderer
+from ..markdown_ast import MarkdownASTBase
+
+
+class BlockLayout(QObject):
+    """
+    the layout model of virtual render mode, it has the same interface as Container.
+    the blocks near the viewport are rendered into pixmaps, and the view blits them in paintEvent.
+    """
+    Up = 123
+    Down = 456
+    Self = 789
+
+    def __init__(self, parent: AbstractMarkdownEdit):
+        super(BlockLayout, self).__init__(parent)
+        self.__area: AbstractMarkdownEdit or QScrollArea = parent
+        self.__contentItems: t.Dict[MarkdownASTBase, ContentBlock] = {}
+        self.__nowShowAst: t.List[MarkdownASTBase] = []
+        self.__collapsedAsts: t.Set[MarkdownASTBase] = set()  # 折叠的标题
+        self.__collapsingAsts: t.Set[MarkdownASTBase] = set()  # 被折叠的内容
+        self.__heightIndex = HeightIndex()  # 所有 block 的高度
+        self.__isLayouting = False
+
+    def area(self) -> t.Union[AbstractMarkdownEdit or QScrollArea]:
+        return self.__area
+
+    def document(self) -> MarkDownDocument:
+        return self.area().document()
+
+    def contentItemCache(self, ast: MarkdownASTBase = None) -> t.Dict[MarkdownASTBase, ContentBlock] or ContentBlock:
+        if ast:
+            return self.__contentItems.get(ast, None)
+        return self.__contentItems
+
+    def getContentItem(self, ast: MarkdownASTBase, position: int = Self) -> t.Optional[ContentBlock]:
+        """ get a content block, it will be created if it dose not exist """
+        if position == self.Down:
+            ast = ast.downAst()
+        elif position == self.Up:
+            ast = ast.upAst()
+        if ast is None: return None
+
+        block = self.__contentItems.get(ast, None)
+        if block is None:
+            block = ContentBlock(layout=self, ast=ast)
+            block.setIsCollapsing(ast in self.__collapsingAsts)
+            self.__contentItems[ast] = block
+        return block
+
+    def removeContentItem(self, ast: MarkdownASTBase):
+        with span("hide", ast=ast):
+            self.__contentItems.pop(ast)
+            LatexRenderer.instance().cancel(owner=ast)  # <-- 不再显示, 不需要等待 latex 和图片
+            ImageLoader.instance().cancel(owner=ast)
+            if ast in self.__nowShowAst:
+                self.__nowShowAst.remove(ast)
+
+    def autoUpdateMarkdownItem(self, maxUpdateNum=10, updatesEnabled=True):
+        """ 删除多余的 block, 并更新显示布局 """
+        need_del_items = set(self.__contentItems.keys()).difference(self.document().ast().children)
+        for ast in need_del_items:
+            self.removeContentItem(ast)
+        self.__collapsedAsts.intersection_update(self.document().ast().children)
+        self.__collapsingAsts.intersection_update(self.document().ast().children)
+        self.updateShowLayout()
+        self.area().viewport().update()
+
+    def heightIndex(self) -> HeightIndex:
+        return self.__heightIndex
+
+    def preprocess(self, block: ContentBlock, y: int):
+        block.setWidth(self.area().viewport().width())
+        if not block.isCollapsing() and not block.isLaidOut():
+            block.layout_()  # <-- 只排版, 绘制在 paint 中进行
+        block.move(0, y)
+
+    def __measure(self, idx: int) -> int:
+        ast = self.document().ast().children[idx]
+        if ast in self.__contentItems:
+            block = self.__contentItems[ast]
+            self.preprocess(block, y=block.y())
+        else:
+            with span("show", ast=ast):  # <-- 新显示的 block
+                block = self.getContentItem(ast)
+                self.preprocess(block, y=block.y())
+        return block.height()
+
+    def updateShowLayout(self):
+        """ 更新显示布局, 只有 viewport 附近的 block 会被渲染, 其余 block 的高度由 heightIndex 估计 """
+        if self.__isLayouting: return
+        with span("layout.view"):
+            self.__updateShowLayout()
+
+    def __updateShowLayout(self):
+        self.__isLayouting = True
+        area = self.area()
+        bar = area.verticalScrollBar()
+        index = self.__heightIndex
+        root = self.document().ast()
+        index.setRoot(root)
+        vh = area.viewport().height()
+
+        # 1. 渲染 viewport 附近的 block, 并修正高度
+        first, last, top = index.layout(top=bar.value(), viewHeight=vh, measure=self.__measure)
+        nowShowAst = root.children[first:last]
+        y = index.y(first)
+        for ast in nowShowAst:
+            block = self.__contentItems[ast]
+            block.move(0, y)
+            y += block.height()
+
+        # 2. hide the others
+        for ast in set(self.__contentItems.keys()).difference(nowShowAst):
+            self.removeContentItem(ast)
+        self.__nowShowAst = nowShowAst
+
+        # 3. scroll range, 保持 viewport 顶部的 block 不动
+        bar.setPageStep(vh)
+        bar.setRange(0, max(index.total() - vh, 0))
+        bar.setValue(top)
+        self.__isLayouting = False
+
+    def paint(self, painter: QPainter, rect: QRect):
+        """ paint the blocks in rect (the coordinate of view) """
+        if any(not self.__contentItems[ast].isLaidOut() and not self.__contentItems[ast].isCollapsing()
+               for ast in self.__nowShowAst):
+            self.updateShowLayout()  # <-- 重新排版后高度可能改变
+        for ast in self.__nowShowAst:
+            block = self.__contentItems[ast]
+            if block.geometry().intersects(rect) or block.collapseButtonRect().intersects(rect):
+                block.paint(painter)
+
+    def height(self) -> int:
+        return self.__heightIndex.total()
+
+    def itemAt(self, pos: QPoint) -> t.Optional[ContentBlock]:
+        """ the content block in pos """
+        if len(self.__heightIndex) == 0: return None
+        ast = self.document().ast().children[self.__heightIndex.indexAt(pos.y())]
+        block = self.__contentItems.get(ast, None)
+        if block is not None and block.height() != 0 and block.geometry().contains(pos):
+            return block
+        return None
+
+    def astIn(self, pos: QPoint) -> MarkdownASTBase:
+        block = self.itemAt(pos)
+        return None if block is None else block.ast()
+
+    def cursorBaseIn(self, pos: t.Union[QPointF, QPoint]) -> t.Optional[t.Tuple[MarkdownASTBase, int]]:
+        if isinstance(pos, QPointF): pos = pos.toPoint()
+        block = self.itemAt(pos)
+        if block is None: return None, None
+        return cursorBaseOf(block, pos)
+
+    def collapseButtonAt(self, pos: t.Union[QPointF, QPoint]) -> t.Optional[ContentBlock]:
+        """ the block whose collapse button is in pos """
+        if isinstance(pos, QPointF): pos = pos.toPoint()
+        for ast in self.__nowShowAst:
+            block = self.__contentItems[ast]
+            if not block.isCollapsing() and block.collapseButtonRect().contains(pos):
+                return block
+        return None
+
+    def setCollapsed(self, ast: MarkdownASTBase, collapse: bool):
+        """ collapse the header """
+        if collapse:
+            self.__collapsedAsts.add(ast)
+        else:
+            self.__collapsedAsts.discard(ast)
+
+    def isCollapsed(self, ast: MarkdownASTBase) -> bool:
+        return ast in self.__collapsedAsts
+
+    def setIsCollapsing(self, ast: MarkdownASTBase, _is: bool):
+        """ collapse the content of ast """
+        if _is:
+            self.__collapsingAsts.add(ast)
+        else:
+            self.__collapsingAsts.discard(ast)
+        if ast in self.__contentItems:
+            self.__contentItems[ast].setIsCollapsing(_is)
+        # 被折叠的 block 高度为 0, 展开后重新估计
+        index = self.__heightIndex
+        if index.root() is ast.parent:
+            idx = ast.parent.index(ast)
+            if _is:
+                index.setHeight(idx, 0)
+            else:
+                index.setHeight(idx, index.estimate(ast), measured=False)
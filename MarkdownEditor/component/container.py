@@ -1,16 +1,36 @@
-import time
 import typing as t
 
 from PyQt5.QtCore import QRect, QTimer, pyqtSignal, QPoint, QPointF
 from PyQt5.QtWidgets import QWidget, QScrollArea
 
 from .content_item import ContentItem
+from .height_index import HeightIndex
 from ..abstruct import AbstractMarkdownEdit
 from ..cache_paint import CachePaint
 from ..document import MarkDownDocument
+from ..image_loader import ImageLoader
+from ..instrumentation import span
+from ..latex import LatexRenderer
 from ..markdown_ast import MarkdownASTBase
 
 
+def cursorBaseOf(item, pos: QPoint) -> t.Tuple[t.Optional[MarkdownASTBase], t.Optional[int]]:
+    """ the cursor base of the item (ContentItem or ContentBlock) which is the nearest to pos """
+    # filter the cursor of 'y < pos'
+    in_pos = pos - item.pos()
+    cursorBases = [(i, p) for i, p in enumerate(item.cursorBases()) if p.y() <= in_pos.y()]
+    # filter the cursor of 'y > pos'
+    cursorBases = [(i, p) for i, p in cursorBases if cursorBases[-1][1].y() == p.y()]
+    # find left < x < right
+    left = next(((i, p) for i, p in cursorBases if p.x() + 5 >= pos.x()), None)
+    if left:
+        return item.ast(), left[0]
+    elif len(cursorBases):
+        return item.ast(), cursorBases[-1][0]
+    else:
+        return None, None
+
+
 class Container(QWidget):
     itemCreated = pyqtSignal(ContentItem)
     itemCreatingStarted = pyqtSignal()
@@ -52,6 +72,8 @@ class Container(QWidget):
 
     def removeContentItem(self, ast):
         contentItem = self.__contentItems.pop(ast)
+        LatexRenderer.instance().cancel(owner=ast)  # <-- 不再显示, 不需要等待 latex 和图片
+        ImageLoader.instance().cancel(owner=ast)
         contentItem.reset()
         contentItem.hide()
         self.__contentItemPoll.add(contentItem)
@@ -72,7 +94,6 @@ class Container(QWidget):
         :param asts: 确定重绘的范围,None表示全部
         :return:
         """
-        # st = time.time()
         self.setUpdatesEnabled(False)  # <--禁止重绘,防止闪烁
         self.area().setUpdatesEnabled(False)
         # 使用缓存来绘制
@@ -108,7 +129,6 @@ class Container(QWidget):
             item.hide()
 
         self.updateShowLayout()
-        # st = time.time()
         self.__updateItemer.start(10)
         self.setUpdatesEnabled(True)  # <--重绘,防止闪烁
         self.area().setUpdatesEnabled(True)  # <--重绘,防止闪烁
@@ -122,93 +142,44 @@ class Container(QWidget):
         if item.y() != y:
             item.move(0, y)
 
+    def __measure(self, idx: int) -> int:
+        item = self.getContentItem(self.document().ast().children[idx])
+        self.preprocess(item, y=item.y())
+        return item.height()
+
     def updateShowLayout(self):
-        """ 更新显示布局 """
+        """ 更新显示布局, 只有 viewport 附近的 item 会被渲染, 其余 item 的高度由 heightIndex 估计 """
         if not self.isVisible() or self.isHidden(): return
+        with span("layout.view"):
+            self.__updateShowLayout()
+
+    def __updateShowLayout(self):
         area: QScrollArea = self.area()
-        # 1. when it have not item be show
+        bar = area.verticalScrollBar()
+        index = self.__heightIndex
+        root = self.document().ast()
+        index.setRoot(root)
         self.setUpdatesEnabled(False)  # <--禁止重绘,防止闪烁
 
-        # 2. determine which content item need to show
-        if len(self.__nowShowAst) == 0:
-            item = self.getContentItem(self.document().ast().children[0])
-            self.preprocess(item, y=0)
-            self.__nowShowAst.append(item.ast())
-            h = self.height() - item.height()
-            while h >= 0 and self.getContentItem(item.ast(), position=self.Down):
-                downItem = self.getContentItem(item.ast(), position=self.Down)
-                self.preprocess(downItem, y=item.geometry().bottom())
-                self.__nowShowAst.append(downItem.ast())
-                item = downItem
-                h = h - item.height()
-
-        else:
-            c_item = self.getContentItem(ast=self.__nowShowAst[0])
-            self.preprocess(c_item, y=c_item.geometry().y())
-            nowShowAst = [c_item.ast()]
-
-            # up
-            item = c_item
-            thresh_y = c_item.geometry().y() - area.verticalScrollBar().value()
-            while thresh_y >= -300 and self.getContentItem(item.ast(), position=self.Up):
-                upItem = self.getContentItem(item.ast(), position=self.Up)
-                self.preprocess(upItem, y=item.geometry().y())
-                upItem.move(0, max(0, item.y() - upItem.height()))
-                nowShowAst.insert(0, upItem.ast())
-                item = upItem
-                thresh_y = thresh_y - item.height()
-            st = time.time()
-
-            # down
-            item = c_item
-            thresh_y = area.verticalScrollBar().value() + area.height() - c_item.geometry().bottom()
-            while thresh_y >= -300 and self.getContentItem(item.ast(), position=self.Down):
-                downItem = self.getContentItem(item.ast(), position=self.Down)
-                self.preprocess(downItem, y=item.geometry().bottom())
-                nowShowAst.append(downItem.ast())
-                item = downItem
-                thresh_y = thresh_y - item.height()
-            # hide
-            need_hide_ast = set(self.__nowShowAst).difference(set(nowShowAst))
-            for ast in need_hide_ast:
-                self.removeContentItem(ast)
-                # self.__contentItems[ast].hide()
-
-            # 重排保证一致
-            # 是排序第一个的ast
-            if self.document().ast().children[0] in nowShowAst:
-                if self.__contentItems[nowShowAst[0]].y() != 0:
-                    # 如果移动,可能导致viewport中没有item
-                    # 需要调节 verticalScrollBar
-                    offset = self.__contentItems[nowShowAst[0]].y()
-                    area.verticalScrollBar().setValue(area.verticalScrollBar().value()-offset)
-                    self.__contentItems[nowShowAst[0]].move(0, 0)
-                    for ast in nowShowAst[1:]:
-                        item = self.__contentItems[ast]
-                        item.move(0, item.upItem().geometry().bottom())
-
-            # hide over up item
-            for ast in nowShowAst.copy():
-                if self.__contentItems[ast].geometry().bottom() < area.verticalScrollBar().value() - 300:
-                    self.removeContentItem(ast)
-                    # self.__contentItems[ast].hide()
-                    nowShowAst.pop(0)
-                    # break
-                else:
-                    break
-            self.__nowShowAst = nowShowAst
-            # print("update11", time.time() - st)
-
-        last_show_item = self.__contentItems[self.__nowShowAst[-1]]
-        b = last_show_item.geometry().bottom()
-        guess = max(self.__bottom, b + 20)  # <--不是最后一个
-        self.__bottom = b if last_show_item.ast() is self.document().ast().children[-1] else guess
-        self.setFixedHeight(max(self.__bottom, 0))
-        self.setUpdatesEnabled(True)  # <--禁止重绘,防止闪烁
-        # print("当前绘制, 显示数量:", len(self.__nowShowAst), last_show_item.geometry())
-        # print("当前绘制, 绘制数量:", len(self.__contentItems), last_show_item.ast() is self.document().ast().children[-1])
-        # print("当前绘制, 缓存数量:", len(self.__contentItemPoll), self.__bottom)
-        # print("当前绘制, height:", self.height(), self.area().height(), area.verticalScrollBar().value())
+        # 1. 渲染 viewport 附近的 item, 并修正高度
+        first, last, top = index.layout(top=bar.value(), viewHeight=area.viewport().height(), measure=self.__measure)
+        nowShowAst = root.children[first:last]
+        y = index.y(first)
+        for ast in nowShowAst:
+            item = self.__contentItems[ast]
+            if item.y() != y:
+                item.move(0, y)
+            y += item.height()
+
+        # 2. hide
+        for ast in set(self.__contentItems.keys()).difference(nowShowAst):
+            self.removeContentItem(ast)
+        self.__nowShowAst = nowShowAst
+
+        # 3. 高度是精确的, 保持 viewport 顶部的 item 不动
+        self.setFixedHeight(index.total())
+        bar.setValue(top)
+        self.setUpdatesEnabled(True)
 
     def __init__(self, parent: AbstractMarkdownEdit):
         self.__area: AbstractMarkdownEdit or QScrollArea = parent
@@ -216,7 +187,7 @@ class Container(QWidget):
         self.__yCache: t.Dict[MarkdownASTBase, QRect] = {}
         self.__nowShowAst: t.List[MarkdownASTBase] = []
         self.__creating = False
-        self.__bottom = 0  # 底部坐标
+        self.__heightIndex = HeightIndex()  # 所有 item 的高度
         self.__contentItemPoll: t.Set[ContentItem] = set()
 
         super(Container, self).__init__(parent)
@@ -239,8 +210,19 @@ class Container(QWidget):
     def document(self) -> MarkDownDocument:
         return self.area().document()
 
-    def astIn(self, pos: QPoint) -> MarkdownASTBase:
+    def itemAt(self, pos: QPoint) -> t.Optional[ContentItem]:
+        """ the content item in pos, the lower item wins where two items overlap """
         item = self.childAt(pos)
+        if not isinstance(item, ContentItem):
+            return None
+        # 相邻的 item 会重叠一个像素, 复用的 item 不能依赖 z-order
+        downItem = item.downItem()
+        if isinstance(downItem, ContentItem) and downItem.isVisible() and downItem.geometry().contains(pos):
+            return downItem
+        return item
+
+    def astIn(self, pos: QPoint) -> MarkdownASTBase:
+        item = self.itemAt(pos)
         if not isinstance(item, ContentItem):
             return None
         return item.ast()
@@ -248,18 +230,19 @@ class Container(QWidget):
     def cursorBaseIn(self, pos: t.Union[QPointF, QPoint]) -> t.Optional[t.Tuple[MarkdownASTBase, int]]:
         """ overload """
         if isinstance(pos, QPointF): pos = pos.toPoint()
-        item: ContentItem = self.childAt(pos)
+        item: ContentItem = self.itemAt(pos)
         if not isinstance(item, ContentItem): return None, None
-        # filter the cursor of 'y < pos'
-        in_pos = pos - item.pos()
-        cursorBases = [(i, p) for i, p in enumerate(item.cursorBases()) if p.y() <= in_pos.y()]
-        # filter the cursor of 'y > pos'
-        cursorBases = [(i, p) for i, p in cursorBases if cursorBases[-1][1].y() == p.y()]
-        # find left < x < right
-        left = next(((i, p) for i, p in cursorBases if p.x() + 5 >= pos.x()), None)
-        if left:
-            return item.ast(), left[0]
-        elif len(cursorBases):
-            return item.ast(), cursorBases[-1][0]
-        else:
-            return None, None
+        return cursorBaseOf(item, pos)
+
+    def setIsCollapsing(self, ast: MarkdownASTBase, _is: bool):
+        """ collapse the content of ast """
+        item = self.__contentItems.get(ast, None)
+        if item: item.setIsCollapsing(_is)
+        # 被折叠的 item 高度为 0, 展开后重新估计
+        index = self.__heightIndex
+        if index.root() is ast.parent:
+            idx = ast.parent.index(ast)
+            if _is:
+                index.setHeight(idx, 0)
+            else:
+                index.setHeight(idx, index.estimate(ast), measured=False)
@@ -0,0 +1,152 @@
+import typing as t
+
+from PyQt5.QtCore import QMargins, QPoint, QRect, QRectF
+from PyQt5.QtGui import QPainter, QPixmap
+from qfluentwidgets import FluentIcon as FIF
+from qfluentwidgets import isDarkTheme
+
+from ..cache_paint import CachePaint
+from ..cursor import MarkdownCursor
+from ..instrumentation import span
+from ..markdown_ast import MarkdownASTBase
+from ..style import MarkdownStyle
+
+
+class ContentBlock():
+    """
+    the content of a root block in virtual render mode.
+    it is not a QWidget: the pixmap is painted by the view, and the collapse button is drawn and hit-tested by the view.
+    """
+
+    def __init__(self, layout, ast: MarkdownASTBase):
+        self.__layout = layout
+        self.__ast = ast
+        self.__y = 0
+        self.__width = 0
+        self.__renderWidth = 0
+        self.__height: t.Optional[int] = None  # the height after layout
+        self.__isCollapsing = False
+        self._cachePaint: CachePaint = CachePaint(self)
+        self._pixmapCache: t.Optional[QPixmap] = None
+
+    def ast(self) -> MarkdownASTBase:
+        return self.__ast
+
+    def view(self):
+        return self.__layout.area()
+
+    def cursor(self) -> MarkdownCursor:
+        return self.view().cursor()
+
+    def markdownStyle(self) -> MarkdownStyle:
+        return self.view().markdownStyle()
+
+    def pageMargins(self) -> QMargins:
+        margins = self.view()._margins
+        return QMargins(margins.left(), 0, margins.right(), 0)
+
+    def reset(self):
+        """ the block is laid out and rendered again """
+        self.__height = None
+        self._pixmapCache = None
+
+    def isLaidOut(self) -> bool:
+        return self.__height is not None and self.__renderWidth == self.__width
+
+    def isRendered(self) -> bool:
+        return self._pixmapCache is not None and self.isLaidOut()
+
+    def layout_(self) -> int:
+        """ layout the block without painting, the cursor bases and height are available after it """
+        self.__renderWidth = self.__width
+        self._pixmapCache = None
+        self.__height = self._cachePaint.layoutAst(ast=self.ast(), width=self.__width, margins=self.pageMargins(),
+                                                   style=self.markdownStyle(), cursor=self.cursor())
+        return self.__height
+
+    def render_(self) -> QPixmap:
+        if not self.isLaidOut():
+            self.layout_()
+        self._pixmapCache = self._cachePaint.rasterize(self.ast())
+        return self._pixmapCache
+
+    def pixmap(self) -> QPixmap:
+        if not self.isRendered():
+            self.render_()
+        return self._pixmapCache
+
+    def setWidth(self, width: int):
+        self.__width = width
+
+    def width(self) -> int:
+        return self.__width
+
+    def height(self) -> int:
+        if self.__isCollapsing or self.__height is None:
+            return 0
+        return self.__height
+
+    def move(self, x: int, y: int):
+        self.__y = y
+
+    def y(self) -> int:
+        return self.__y
+
+    def pos(self) -> QPoint:
+        return QPoint(0, self.__y)
+
+    def geometry(self) -> QRect:
+        return QRect(0, self.__y, self.__width, self.height())
+
+    def renderWidth(self) -> int:
+        """ 绘制是使用的 width"""
+        return self.__renderWidth
+
+    def setIsCollapsing(self, _is: bool):
+        self.__isCollapsing = _is
+
+    def isCollapsing(self) -> bool:
+        return self.__isCollapsing
+
+    def isCollapseSubItem(self) -> bool:
+        """ 是否折叠 """
+        return self.__layout.isCollapsed(self.ast())
+
+    def layoutVersion(self) -> int:
+        return self._cachePaint.layoutVersion()
+
+    def cursorBases(self, returnAst=False) -> t.List[QPoint] or t.List[t.Tuple[MarkdownASTBase, QPoint]]:
+        return self._cachePaint.cursorPluginBases(self.ast(), returnAst=returnAst)
+
+    def lineHeight(self, pos: int):
+        if self.__height is None:
+            self.layout_()
+        return self._cachePaint.lineHeight(ast=self.ast(), pos=pos)
+
+    def indentation(self, pos: int):
+        return self._cachePaint.indentation(ast=self.ast(), pos=pos)
+
+    def collapseButtonRect(self) -> QRect:
+        """ the geometry of collapse button in view, it is empty if the ast dose not show collapse button """
+        if not self.ast().isShowCollapseButton() or self.__height is None:
+            return QRect()
+        lh = self._cachePaint.lineHeight(ast=self.ast(), pos=0)
+        size = int(lh * 0.618)
+        return QRect(self.pageMargins().left() - size, self.__y + (lh - size) // 2, size, size)
+
+    def paint(self, painter: QPainter, isPressed: bool = False):
+        """ paint the pixmap and collapse button in the coordinate of view """
+        if self.__isCollapsing: return
+        with span("paint.block", ast=self.__ast):
+            painter.drawPixmap(0, self.__y, self.pixmap())  # <-- 没有绘制的 block 在这里绘制
+        rect = self.collapseButtonRect()
+        if rect.isEmpty(): return
+        # 与 CollapseButton 的绘制一致
+        scale = (0.382 if isPressed else 0.618) / 1.5
+        w, h = int(rect.width() * scale), int(rect.height() * scale)
+        icon = FIF.CARE_RIGHT_SOLID if self.isCollapseSubItem() else FIF.CARE_DOWN_SOLID
+        painter.save()
+        painter.setRenderHints(QPainter.Antialiasing)
+        icon.render(painter, QRectF(rect.x() + (rect.width() - w) / 2, rect.y() + (rect.height() - h) / 2, w, h),
+                    fill="#9c9c9c" if isDarkTheme() else "#5e5e5e")
+        painter.restore()
@@ -1,4 +1,3 @@
-import time
 import typing as t
 
 from PyQt5.QtCore import QMargins, pyqtSignal, QPoint
@@ -8,9 +7,13 @@ from PyQt5.QtWidgets import QWidget, QScrollArea, QListWidgetItem
 from .collapse_button import CollapseButton
 from ..cache_paint import CachePaint
 from ..cursor import MarkdownCursor
+from ..diagnostics import getLogger
+from ..instrumentation import span
 from ..markdown_ast import MarkdownASTBase
 from ..style import MarkdownStyle
 
+logger = getLogger(__name__)
+
 
 class ListItem(QListWidgetItem):
     def __init__(self, ast: MarkdownASTBase):
@@ -135,25 +138,9 @@ class ContentItem(AbstractContentItem):
         self.__isCollapsing = _is
 
     def render_(self):
-        st = time.time()
-        temp = QPixmap(10, 10)
-        painter = QPainter(temp)
-        painter.setFont(self.markdownStyle().hintFont(font=QFont(), ast='root'))
         self.__renderWidth = self.width()
-        # 绘制缓存
-        self._cachePaint.reset()
-        self._cachePaint.setPainter(painter)
-        self._cachePaint.setPaperWidth(self.width())
-        self._cachePaint.setMargins(self.pageMargins())
-        self._cachePaint.newParagraph()  # 重置段落
-
-        # 渲染登记
-        self.ast().render(ht=self._cachePaint, style=self.markdownStyle(), cursor=self.cursor())
-        painter.end()
-        del temp, painter
-        # 局部更新 不刷新缓存
-        self._cachePaint.render(resetCache=True)
-        pixmap = self._cachePaint.cachePxiamp(ast=self.ast())
+        pixmap = self._cachePaint.renderAst(ast=self.ast(), width=self.width(), margins=self.pageMargins(),
+                                            style=self.markdownStyle(), cursor=self.cursor())
         self._pixmapCache = pixmap
         # 计算需要的 verticalScroll
         self.setFixedHeight(pixmap.height())
@@ -178,28 +165,30 @@ class ContentItem(AbstractContentItem):
         if self.isCollapsing():
             return
         super(ContentItem, self).paintEvent(event)
-        if not isinstance(self._pixmapCache, QPixmap) or self.viewpot().width() != self.width():
-            self.setFixedWidth(self.viewpot().width())
-            self.render_()
-
-
-        try:
-            painter = QPainter(self)
-            painter.drawPixmap(0, 0, self._pixmapCache)
-            painter.end()
-        except:
-            print(self._pixmapCache)
+        with span("paint.block", ast=self.ast()):
+            if not isinstance(self._pixmapCache, QPixmap) or self.viewpot().width() != self.width():
+                self.setFixedWidth(self.viewpot().width())
+                self.render_()
+
+            try:
+                painter = QPainter(self)
+                painter.drawPixmap(0, 0, self._pixmapCache)
+                painter.end()
+            except:
+                logger.exception("can not draw the pixmap cache: %r", self._pixmapCache)
 
     def show(self) -> None:
-        super(ContentItem, self).show()
-        if self._pixmapCache is None:
-            self.render_()
-        else:
-            self.setFixedHeight(self._pixmapCache.height())
+        with span("show", ast=self.ast()):
+            super(ContentItem, self).show()
+            if self._pixmapCache is None:
+                self.render_()
+            else:
+                self.setFixedHeight(self._pixmapCache.height())
 
     def hide(self) -> None:
-        super(ContentItem, self).hide()
-        self.setFixedHeight(0)
+        with span("hide", ast=self.ast()):
+            super(ContentItem, self).hide()
+            self.setFixedHeight(0)
 
     def height(self) -> int:
         return 0 if self.isHidden() else super(ContentItem, self).height()
@@ -211,6 +200,9 @@ class ContentItem(AbstractContentItem):
     def isCollapsing(self) -> bool:
         return self.__isCollapsing
 
+    def layoutVersion(self) -> int:
+        return self._cachePaint.layoutVersion()
+
     def cursorBases(self, returnAst=False) -> t.List[QPoint] or t.List[t.Tuple[MarkdownASTBase, QPoint]]:
         return self._cachePaint.cursorPluginBases(self.ast(), returnAst=returnAst)
 
@@ -0,0 +1,105 @@
+import typing as t
+
+from ..fenwick import FenwickTree
+from ..markdown_ast import MarkdownASTBase, MarkdownAstRoot
+
+
+class HeightIndex():
+    """
+    the heights of root blocks in a fenwick tree, so the y of a block and the block in y are found in O(log n).
+    the block which is not rendered has an estimated height (the average height of its type), and it is corrected
+    by setHeight after rendering.
+    """
+    defaultHeight = 40
+    margin = 300  # 视口上下额外渲染的高度
+
+    def __init__(self):
+        self.__root: t.Optional[MarkdownAstRoot] = None
+        self.__heights = FenwickTree()
+        self.__measured: t.List[bool] = []
+        self.__typeHeights: t.Dict[str, t.List[int]] = {}  # type -> [sum, count]
+
+    def root(self) -> t.Optional[MarkdownAstRoot]:
+        return self.__root
+
+    def setRoot(self, root: MarkdownAstRoot):
+        """ track the children of root """
+        if self.__root is root: return
+        if self.__root is not None:
+            self.__root.disconnectChildrenChanged(self.__onChildrenChanged)
+        self.__root = root
+        root.connectChildrenChanged(self.__onChildrenChanged)
+        self.__heights.build(self.estimate(ast) for ast in root.children)
+        self.__measured = [False] * len(root.children)
+
+    def __onChildrenChanged(self, start: int, end: int, count: int):
+        children = self.__root.children
+        if end - start == count:
+            for idx in range(start, start + count):
+                self.__heights.setValue(idx, self.estimate(children[idx]))
+                self.__measured[idx] = False
+        else:
+            heights = self.__heights.values()
+            heights[start:end] = [self.estimate(ast) for ast in children[start:start + count]]
+            self.__heights.build(heights)
+            self.__measured[start:end] = [False] * count
+
+    def estimate(self, ast: MarkdownASTBase) -> int:
+        """ the estimated height of the ast which is not rendered """
+        s, n = self.__typeHeights.get(ast.type, (0, 0))
+        return s // n if n else self.defaultHeight
+
+    def invalidate(self):
+        """ all the heights need to be measured again, for example: the width is changed """
+        self.__measured = [False] * len(self.__measured)
+
+    def isMeasured(self, idx: int) -> bool:
+        return self.__measured[idx]
+
+    def setHeight(self, idx: int, height: int, measured: bool = True):
+        """ set the height of the block, a measured height is counted into the estimation of its type """
+        if measured and height > 0:
+            sn = self.__typeHeights.setdefault(self.__root.children[idx].type, [0, 0])
+            sn[0] += height
+            sn[1] += 1
+        self.__heights.setValue(idx, height)
+        self.__measured[idx] = measured
+
+    def height(self, idx: int) -> int:
+        return self.__heights.value(idx)
+
+    def y(self, idx: int) -> int:
+        """ the top of the block """
+        return self.__heights.prefixSum(idx)
+
+    def indexAt(self, y: int) -> int:
+        """ the index of block which contains y, the blocks with zero height are skipped """
+        return max(0, min(self.__heights.search(y), len(self.__heights) - 1))
+
+    def total(self) -> int:
+        return self.__heights.total()
+
+    def __len__(self) -> int:
+        return len(self.__heights)
+
+    def layout(self, top: int, viewHeight: int, measure: t.Callable[[int], int]) -> t.Tuple[int, int, int]:
+        """
+        measure the blocks near the viewport, the block in the top of viewport stays in the same place.
+        return (first, last, top), the blocks in [first, last) need to be shown
+        """
+        if len(self) == 0: return 0, 0, 0
+        anchor = self.indexAt(top)
+        offset = top - self.y(anchor)
+        first = last = self.indexAt(max(top - self.margin, 0))
+        y = self.y(first)
+        while last < len(self) and y <= top + viewHeight + self.margin:
+            height = measure(last)
+            if height != self.height(last):
+                if last < anchor:
+                    top += height - self.height(last)
+                self.setHeight(last, height)
+            elif not self.__measured[last]:
+                self.setHeight(last, height)
+            y += height
+            last += 1
+        return first, last, self.y(anchor) + min(offset, self.height(anchor))
@@ -0,0 +1,123 @@
+import bisect
+import typing as t
+
+from PyQt5.QtCore import QRectF
+
+from ..markdown_ast import MarkdownASTBase
+
+
+class BlockLines():
+    """ the cursor bases of a laid out block grouped by line (the same y), in the coordinate of block """
+    __slots__ = ("version", "width", "length", "ys", "indexes", "xs", "left", "right", "range")
+
+    def __init__(self, version: int, width: int, bases: list):
+        self.version = version
+        self.width = width
+        self.length = len(bases)
+        lines: t.Dict[float, t.List[int]] = {}
+        for i, p in enumerate(bases):
+            lines.setdefault(p.y(), []).append(i)
+        self.ys: t.List[float] = list(lines.keys())
+        self.indexes: t.List[t.List[int]] = list(lines.values())  # <-- 升序
+        self.xs: t.List[float] = [p.x() for p in bases]
+        self.range = [(idx[0], idx[-1]) for idx in self.indexes]
+        # 整行被选中时的左右端点
+        self.left = [self.leftOf(idx) for idx in self.indexes]
+        self.right = [self.rightOf(idx) for idx in self.indexes]
+
+    def leftOf(self, indexes: t.Sequence[int]) -> int:
+        """ the first index of the min x """
+        return min(indexes, key=self.xs.__getitem__)
+
+    def rightOf(self, indexes: t.Sequence[int]) -> int:
+        """ the first index of the max x """
+        return max(indexes, key=self.xs.__getitem__)
+
+    def select(self, start: int, end: int) -> t.List[t.Tuple[float, int, int]]:
+        """ (y, left index, right index) of the lines which have a selected base, [start, end] is selected """
+        result = []
+        for line, (lo, hi) in enumerate(self.range):
+            if hi < start or lo > end: continue
+            if start <= lo and hi <= end:
+                result.append((self.ys[line], self.left[line], self.right[line]))
+            else:  # <-- 选区的两端, 只扫描这一行
+                indexes = self.indexes[line]
+                indexes = indexes[bisect.bisect_left(indexes, start):bisect.bisect_right(indexes, end)]
+                if indexes:
+                    result.append((self.ys[line], self.leftOf(indexes), self.rightOf(indexes)))
+        return result
+
+
+class SelectionGeometry():
+    """
+    the rects of the selected lines in the shown blocks (the coordinate of content), what MarkdownEdit paints.
+    the lines of a block are cached by (layout version, width) of the block, the rects of a block are cached by the
+    selection in the block and its position, so the rects of the blocks between the ends of selection are reused and
+    only the block under the end is computed again while the end of selection is dragged
+    """
+
+    def __init__(self, view):
+        self.__view = view
+        self.__lines: t.Dict[MarkdownASTBase, BlockLines] = {}
+        self.__rects: t.Dict[MarkdownASTBase, t.Tuple[tuple, t.List[QRectF]]] = {}
+
+    def view(self):
+        return self.__view
+
+    def rects(self) -> t.List[QRectF]:
+        view = self.view()
+        start_ast, start_pos, end_ast, end_pos = view.cursor().selectedASTs()
+        if start_ast is end_ast and start_pos == end_pos:  # <-- 没有选区
+            return []
+        root = view.document().ast()
+        first, last = root.index(start_ast), root.index(end_ast)
+        items = view._container.contentItemCache()
+        # 不再显示的 block
+        for ast in [ast for ast in self.__lines if ast not in items]:
+            self.__lines.pop(ast)
+            self.__rects.pop(ast, None)
+
+        # 只有显示的 block 需要绘制选区, 不遍历选中的所有 block
+        shown = []
+        for ast, item in items.items():
+            try:
+                idx = root.index(ast)
+            except ValueError:
+                continue  # <-- 已经删除的 block
+            if first <= idx <= last:
+                shown.append((idx, ast, item))
+
+        rects = []
+        for idx, ast, item in sorted(shown, key=lambda x: x[0]):
+            lines = self.__linesOf(ast, item)
+            _si = start_pos if ast is start_ast else 0
+            _ei = end_pos if ast is end_ast else lines.length
+            if _ei - _si < 1: continue
+            if min(_ei, lines.length - 1) - _si < 1: continue  # <-- 只选中了一个 cursor base
+            pos = item.pos()
+            key = (lines.version, _si, _ei, pos.x(), pos.y(), view._margins.left())
+            cache = self.__rects.get(ast, None)
+            if cache is None or cache[0] != key:
+                cache = (key, self.__blockRects(item, lines, _si, min(_ei, lines.length - 1), pos))
+                self.__rects[ast] = cache
+            rects += cache[1]
+        return rects
+
+    def __linesOf(self, ast: MarkdownASTBase, item) -> BlockLines:
+        lines = self.__lines.get(ast, None)
+        version = item.layoutVersion()
+        if lines is None or lines.version != version or lines.width != item.width():
+            lines = BlockLines(version, item.width(), item.cursorBases())
+            self.__lines[ast] = lines
+        return lines
+
+    def __blockRects(self, item, lines: BlockLines, start: int, end: int, pos) -> t.List[QRectF]:
+        selected = lines.select(start, end)
+        top = min(y for y, _, _ in selected)
+        left_margin = self.view()._margins.left()
+        rects = []
+        for y, left_i, right_i in selected:
+            lineHeight = item.lineHeight(pos=left_i)
+            left_x = lines.xs[left_i] + pos.x() if y == top else item.indentation(pos=left_i) + left_margin
+            rects.append(QRectF(left_x, y + pos.y(), lines.xs[right_i] + pos.x() - left_x, lineHeight))
+        return rects
@@ -1,16 +1,15 @@
 import typing as t
 
 from PyQt5.QtCore import Qt, QRectF, QPointF
-from PyQt5.QtGui import QPainter, QFontMetrics, QPixmap, QColor
+from PyQt5.QtGui import QPainter, QPixmap, QColor, QPicture, QPen, QGlyphRun
 
 from ..abstruct import AbstructTextParagraph
+from ..font_metrics import FontMetricsCache
 # from .cursor import MarkdownCursor
 from ..markdown_ast import MarkdownASTBase, MarkdownAstRoot
 
 
 class TextParagraph(AbstructTextParagraph):
-    __renderCache: QPixmap
-
     renderFunctions = {}  # 渲染方法
 
     @classmethod
@@ -23,20 +22,36 @@ class TextParagraph(AbstructTextParagraph):
 
         return wapper
 
-    def render(self) -> QPixmap:
-        """ 新的 y 位置"""
+    def __init__(self):
+        super(TextParagraph, self).__init__()
+        self.__picture: QPicture = None  # 排版时记录的绘制指令
+        self.__height = 0
+        self.__lineRects: t.List[QRectF] = []
+        self.__subParagraphs: t.List[t.Tuple[QPointF, "TextParagraph"]] = []
+        self.__glyphRuns: t.List[t.Tuple[QPen, t.List[QGlyphRun]]] = []  # 文本不经过 QPicture, 回放 glyph run 很慢
+        self.__pixmaps: t.List[t.Tuple[QPointF, QPixmap]] = []  # 位图也不经过 QPicture, 记录时会被序列化
+        self.__backgroundRect: QRectF = None
+        self.__renderCache: QPixmap = None
+
+    def layout(self) -> int:
+        """
+        排版: 计算 cursor bases, 行高和高度, 不绘制像素.
+        绘制指令被记录到 QPicture 中, 由 rasterize 回放
+        """
         # 没有缓存
-        if len(self._cache) == 0: return QPixmap(0, 0)
+        if len(self._cache) == 0: return 0
         # 没有新的内容直接输出缓存
         if not self.needRerender():
-            return self.__renderCache
+            return self.__height
 
         # 0. 预处理
         self.initPaintPoint(0)
-        # 创建一个透明的 QPixmap，尺寸为 400x300
-        pixmap = QPixmap(self.viewWdith(), 1000)
-        pixmap.fill(QColor(0, 0, 0, 0))  # 使用完全透明的颜色
-        painter = QPainter(pixmap)
+        picture = QPicture()
+        painter = QPainter(picture)
+        self.__subParagraphs = []
+        self.__glyphRuns = []
+        self.__pixmaps = []
+        self.__renderCache = None
 
         # 确定 ast (root 的 子项)
         self.setAST(self._cache[0][2])
@@ -45,9 +60,9 @@ class TextParagraph(AbstructTextParagraph):
         # 清空 cursor bases
         self.clearAllcursorBases()
         # 计算一行的高度
-        self.setLineHeight(max(QFontMetrics(font).height() for method, data, ast, font, brush, pen in self._cache))
+        self.setLineHeight(max(FontMetricsCache.height(font) for method, data, ast, font, brush, pen in self._cache))
 
-        # 1.render
+        # 1. layout
         # 1. memorize the cursor of different ast, to cal rect of ast
         if self.backgroundEnable():
             self.initPaintPoint(self.backgroundMargins().top())
@@ -59,59 +74,108 @@ class TextParagraph(AbstructTextParagraph):
             painter.setFont(font)
             painter.setBrush(brush)
             method(self, data=data, ast=ast, painter=painter)
+        painter.end()
 
-        # 3. 对齐
-        # 3.1 默认左对齐
+        # 2. line boxes
+        lines: t.Dict[float, QRectF] = {}
+        for _, b in self.cursorBases():
+            rect = lines.setdefault(b.y(), QRectF(b, b))
+            rect.setLeft(min(rect.left(), b.x()))
+            rect.setRight(max(rect.right(), b.x()))
+        self.__lineRects = [QRectF(r.left(), r.top(), r.width(), self.lineHeight()) for r in lines.values()]
+
+        # 3. 背景
+        self.__backgroundRect = None
+        if self.backgroundEnable():
+            self.__backgroundRect = QRectF(
+                self.pageMargins().left() + self.indentation(), 0,
+                self.viewWdith() - self.pageMargins().left() - self.indentation() - self.pageMargins().right(),
+                self.paintPoint().y() + self.backgroundMargins().bottom())
+            self.setPaintPoint(self.__backgroundRect.bottomLeft())
+
+        # 4. 保存排版结果, 然后重置 NeedRerender
+        self.__picture = picture
+        self.__height = QRectF(0, 0, self.viewWdith(), self.paintPoint().y()).toRect().height()
+        self.setNeedRerender(False)
+        return self.__height
+
+    def rasterize(self) -> QPixmap:
+        """ 绘制: 回放 layout 记录的绘制指令, 然后对齐和绘制背景 """
+        self.layout()
+        if len(self._cache) == 0: return QPixmap(0, 0)
+        if self.__renderCache is not None:
+            return self.__renderCache
+        pixmap = QPixmap(int(self.viewWdith()), self.__height)
+        if self.__height == 0:
+            self.__renderCache = pixmap
+            return pixmap
+        pixmap.fill(QColor(0, 0, 0, 0))  # 使用完全透明的颜色
+        painter = QPainter(pixmap)
+        painter.drawPicture(0, 0, self.__picture)
+        for pen, glyphRuns in self.__glyphRuns:
+            painter.setPen(pen)
+            for glyphRun in glyphRuns:
+                painter.drawGlyphRun(QPointF(0, 0), glyphRun)
+        for pos, image in self.__pixmaps:
+            painter.drawPixmap(pos, image)
+        for pos, paragraph in self.__subParagraphs:
+            painter.drawPixmap(pos, paragraph.rasterize())
+
+        # 1. 对齐
+        # 1.1 默认左对齐
         if self.align() != self.AlignLeft:
-            bs = self.cursorBases()
-            ys = {b.y() for _, b in bs}
             pageMargins = self.pageMargins()
             eraseWidth = self.viewWdith() - pageMargins.left() - pageMargins.right()
-            for y in ys:
-                it = [b for _, b in bs if b.y() == y]
-                _max_p = max(it, key=lambda x: x.x(), default=None)
-                _min_p = min(it, key=lambda x: x.x(), default=None)
-                if _min_p is None or _max_p is None: continue
+            for line in self.__lineRects:
                 # 偏移量
-                offset = QPointF(self.viewWdith() - self.margins().right() - _max_p.x(), 0)
+                offset = QPointF(self.viewWdith() - self.margins().right() - line.right(), 0)
                 if self.align() == self.AlignCenter: offset = offset / 2
                 # 先擦除再转移
-                # continue
-                rect = QRectF(QPointF(pageMargins.left(), y), QPointF(_max_p.x(), y + self.lineHeight()))
+                rect = QRectF(QPointF(pageMargins.left(), line.top()), line.bottomRight())
                 transfome = pixmap.copy(rect.toRect())
 
                 painter.setCompositionMode(QPainter.CompositionMode_Clear)
                 painter.eraseRect(QRectF(pageMargins.left(), rect.top(), eraseWidth, self.lineHeight()))
                 painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
-                painter.drawPixmap(QPointF(0, y) + offset, transfome)
+                painter.drawPixmap(QPointF(0, line.top()) + offset, transfome)
 
-        # 4. 绘制背景
-        # 4.1 先把之前的内容截取
-        # 4.2 绘制背景后再重绘回去
-        if self.backgroundEnable():
-            # _pixmap = pixmap.copy(QRectF(0, 0, self.viewWdith(), self.paintPoint().y()).toRect())
-            # pixmap.fill(QColor(0, 0, 0, 0))
+        # 2. 绘制背景
+        if self.__backgroundRect is not None:
             painter.setCompositionMode(QPainter.CompositionMode_DestinationOver)
             painter.setPen(Qt.NoPen)
             painter.setBrush(self.backgroundColor())
-            rect = QRectF(self.pageMargins().left() + self.indentation(), 0,
-                          self.viewWdith() - self.pageMargins().left() - self.indentation() - self.pageMargins().right(),
-                          self.paintPoint().y() + self.backgroundMargins().bottom())
-            painter.drawRoundedRect(rect, self.backgroundRaidus(), self.backgroundRaidus())
-            # painter.drawPixmap(0, 0, _pixmap)
-            self.setPaintPoint(rect.bottomLeft())
-
-        # 4. 结束绘制
-        # 4.1 截取出有效内容
-        # 4.2 保存为缓存,然后重置 NeedRerender
+            painter.drawRoundedRect(self.__backgroundRect, self.backgroundRaidus(), self.backgroundRaidus())
         painter.end()
-        self.setNeedRerender(False)
-        rect = QRectF(0, 0, self.viewWdith(), self.paintPoint().y()).toRect()
-        if rect.height() != 0:
-            self.__renderCache = pixmap.copy(QRectF(0, 0, self.viewWdith(), self.paintPoint().y()).toRect())
-        else:
-            self.__renderCache = QPixmap(pixmap.width(), 0)
-        return self.__renderCache
+        self.__renderCache = pixmap
+        return pixmap
+
+    def render(self) -> QPixmap:
+        """ layout + rasterize """
+        self.layout()
+        return self.rasterize()
+
+    def height(self) -> int:
+        """ the height after layout """
+        return self.layout()
+
+    def width(self) -> int:
+        return 0 if len(self._cache) == 0 else int(self.viewWdith())
+
+    def lineRects(self) -> t.List[QRectF]:
+        """ the boxes of lines after layout, they are the same in the coordinate of paragraph """
+        return self.__lineRects
+
+    def addGlyphRuns(self, glyphRuns: t.List[QGlyphRun], pen: QPen) -> None:
+        """ the glyph runs are drawn over the recorded picture when the paragraph is rasterized """
+        if len(glyphRuns): self.__glyphRuns.append((pen, glyphRuns))
+
+    def addPixmap(self, pos: QPointF, pixmap: QPixmap) -> None:
+        """ the pixmap is drawn in pos when the paragraph is rasterized, for example: the formula """
+        self.__pixmaps.append((QPointF(pos), pixmap))
+
+    def addSubParagraph(self, pos: QPointF, paragraph: "TextParagraph") -> None:
+        """ the sub paragraph is rasterized in pos when the paragraph is rasterized """
+        self.__subParagraphs.append((QPointF(pos), paragraph))
 
     """ cache """
 
@@ -2,7 +2,7 @@ import os
 import typing as t
 
 from PyQt5.QtCore import Qt, QPointF, QRect, QMargins, QRectF, QSizeF, QPoint, QTimer
-from PyQt5.QtGui import QFontMetrics, QColor, QCursor
+from PyQt5.QtGui import QColor, QCursor, QRegion
 from PyQt5.QtGui import QPainter, QPaintEvent, QMouseEvent, QKeyEvent, QInputMethodEvent, QKeySequence
 from PyQt5.QtWidgets import QAction, QApplication, QScrollArea
 from qfluentwidgets import Action
@@ -13,14 +13,20 @@ from qfluentwidgets import ThemeColor
 from . import render_function
 from .abstruct import AbstractMarkdownEdit
 from .cache_paint import CachePaint
-from .component import ContentItem, Container, ScrollDelegate
-from .component import PreEdit, LoadProgressBar
+from .component import ContentItem, Container, ScrollDelegate, BlockLayout
+from .component import PreEdit, LoadProgressBar, SelectionGeometry
 from .cursor import MarkdownCursor
+from .diagnostics import getLogger
 from .document import MarkDownDocument
+from .font_metrics import FontMetricsCache
+from .image_loader import ImageLoader
+from .instrumentation import span
+from .latex import LatexRenderer
 from .markdown_ast import MarkdownASTBase
 from .style import MarkdownStyle
 
 render_function = render_function
+logger = getLogger(__name__)
 MOVE_MODE = {Qt.Key_Up: MarkdownCursor.MOVE_UP,
              Qt.Key_Down: MarkdownCursor.MOVE_DOWN,
              Qt.Key_Left: MarkdownCursor.MOVE_FELT,
@@ -55,12 +61,21 @@ def comstumMouseMoveEvent(view: 'MarkdownEdit'):
 
 
 class MarkdownEdit(QScrollArea, AbstractMarkdownEdit):
+    # render mode
+    WidgetRenderMode = 0  # a ContentItem widget for each block in viewport
+    VirtualRenderMode = 1  # the view paints the pixmaps of blocks, no widget for blocks
+
     def _adjustScroll(self):
-        return
+        if self.__renderMode == self.VirtualRenderMode:
+            self._container.updateShowLayout()
+            self.viewport().update()
 
-    def __init__(self):
+    def __init__(self, renderMode: int = VirtualRenderMode):
         self.__mouseLeftButton = False
         self.__mouseRightButton = False
+        self.__renderMode = renderMode
+        self.__caretRect = QRect()  # <-- 上次绘制的光标 (content 坐标)
+        self.__selectionRects: t.List[QRectF] = []  # <-- 上次绘制的选区
 
         super().__init__()
         # 允许输入法
@@ -76,7 +91,8 @@ class MarkdownEdit(QScrollArea, AbstractMarkdownEdit):
         self._cachePaint = CachePaint(self)
         # cursor
         self._cursor = MarkdownCursor(self)
-        self._cursor.showCursorShaderTimer.timeout.connect(self.viewport().update)
+        self._cursor.showCursorShaderTimer.timeout.connect(self._updateCaret)
+        self._selectionGeometry = SelectionGeometry(self)
         # pre edit and cursor in this
         self._preEdit = PreEdit(self)
         # timer
@@ -84,13 +100,19 @@ class MarkdownEdit(QScrollArea, AbstractMarkdownEdit):
 
         # widget
         self.loadProgressBar = LoadProgressBar(self)
-        self.loadProgressBar.show()
-        self._container = Container(self)
+        self.loadProgressBar.setRange(0, 100)
+        self.loadProgressBar.hide(needAni=False)
+        if renderMode == self.VirtualRenderMode:
+            self._container = BlockLayout(self)
+        else:
+            self._container = Container(self)
+            self._container.itemCreated.connect(self.onItemCreatedEvent)
         self.__contentItems: t.Dict[MarkdownASTBase, ContentItem] = self._container.contentItemCache()
 
         self.viewport().setStyleSheet("background-color:transparent;")
         self.setWidgetResizable(True)
-        self.setWidget(self._container)
+        if renderMode == self.WidgetRenderMode:
+            self.setWidget(self._container)
 
         # menu
         self.setContextMenuPolicy(Qt.CustomContextMenu)
@@ -107,15 +129,29 @@ class MarkdownEdit(QScrollArea, AbstractMarkdownEdit):
         # connect
         # self.verticalScrollBar().valueChanged.connect(self.onScrollValueChangedEvent)
         # self.verticalScrollBar().valueChanged.connect(self.update)
-        self._container.itemCreated.connect(self.onItemCreatedEvent)
-        self._container.itemCreatingStarted.connect(self.loadProgressBar.show)
-        self._container.itemCreatingFinished.connect(self.loadProgressBar.hide)
+        self.__document.loadStarted.connect(self.loadProgressBar.show)
+        self.__document.loadProgress.connect(self.loadProgressBar.setValue)
+        self.__document.loadFinished.connect(self.loadProgressBar.hide)
+        self.__document.blocksAppended.connect(self.onBlocksAppendedEvent)
+        self.__document.loadFinished.connect(self.prewarmImages)
+        LatexRenderer.instance().svgReady.connect(self.onResourceReadyEvent)
+        ImageLoader.instance().imageReady.connect(self.onResourceReadyEvent)
         self._mouseMoveSelectSectionTimer.timeout.connect(lambda: comstumMouseMoveEvent(self))
 
         # init
         self.setSytle()
         self.setMarkdown("")
 
+    def renderMode(self) -> int:
+        return self.__renderMode
+
+    def scrollContentsBy(self, dx: int, dy: int) -> None:
+        if self.__renderMode == self.VirtualRenderMode:
+            self._container.updateShowLayout()
+            self.viewport().update()
+        else:
+            super(MarkdownEdit, self).scrollContentsBy(dx, dy)
+
     def setSytle(self, style: str = None) -> None:
         path = os.path.join(os.path.dirname(__file__), "_rc", "github.css") if style is None else style
         with open(path, 'r', encoding="utf8") as f:
@@ -125,30 +161,55 @@ class MarkdownEdit(QScrollArea, AbstractMarkdownEdit):
         self._margins = QMargins(*margins)
 
     def setMarkdown(self, text: str) -> None:
+        closed = self.__document.ast()
         self.__document.setMarkdown(text)
+        if closed is not None:
+            render_function.ImageRender.dropDocument(closed)  # <-- 旧文档的 svg 和图片
+        self.prewarmImages()
         self.cursor().setSelectMode(mode=MarkdownCursor.SELECT_MODE_SINGLE)
         self.cursor().setAST(self.document().ast().children[0])
         self.cursor().setPos(0)
         self.verticalScrollBar().setValue(0)
         self._container.autoUpdateMarkdownItem(maxUpdateNum=1000)
 
+    def prewarmImages(self) -> None:
+        """ make the thumbnails of the images in document in background """
+        paths, asts = [], list(self.document().ast().children)
+        while asts:
+            ast = asts.pop()
+            if ast.type == "image":
+                paths.append(ast.url.replace('%5C', '\\'))
+            asts += getattr(ast, "children", None) or []
+        if len(paths) == 0: return
+        width = self.viewport().width() - self._margins.left() - self._margins.right()
+        ImageLoader.instance().prewarm(paths, width=width, dpr=self.devicePixelRatioF())
+
     def _show_menu(self, pos) -> None:
         self.__menu = RoundMenu(self)
         self.__menu.addAction(Action(FIF.COPY, self.tr("复制"), triggered=self.copyToClipboard))
         self.__menu.addAction(Action(FIF.PASTE, self.tr("粘贴"), triggered=self.pasteFromClipboard))
         sub_menu = RoundMenu("添加")
-        sub_menu.addAction(Action(FIF.COPY, self.tr("图片"), triggered=lambda: print("图片")))
-        sub_menu.addAction(Action(FIF.COPY, self.tr("公式"), triggered=lambda: print("公式")))
-        sub_menu.addAction(Action(FIF.COPY, self.tr("连接"), triggered=lambda: print("连接")))
-        sub_menu.addAction(Action(FIF.COPY, self.tr("连接"), triggered=lambda: print("表格")))
+        sub_menu.addAction(Action(FIF.COPY, self.tr("图片"), triggered=lambda: logger.debug("menu: insert %s", "图片")))
+        sub_menu.addAction(Action(FIF.COPY, self.tr("公式"), triggered=lambda: logger.debug("menu: insert %s", "公式")))
+        sub_menu.addAction(Action(FIF.COPY, self.tr("连接"), triggered=lambda: logger.debug("menu: insert %s", "连接")))
+        sub_menu.addAction(Action(FIF.COPY, self.tr("连接"), triggered=lambda: logger.debug("menu: insert %s", "表格")))
         sub_menu.setIcon(FIF.ADD)
         self.__menu.addMenu(sub_menu)
         self.__menu.exec_(self.mapToGlobal(pos))
 
     def _moveViewToCurosr(self) -> None:
         """ change the value of verticalScrollBar to show cursor """
-        y = self.cursorBases(ast=self.cursor().ast(), pos=self.cursor().pos()).y()
-        lineHeight = self.__contentItems[self.cursor().ast()].lineHeight(pos=self.cursor().pos())
+        cursor = self.cursor()
+        item = self._container.contentItemCache(ast=cursor.ast())
+        if item is None and self.__renderMode == self.VirtualRenderMode:
+            # block 不在排版的窗口中, 先滚动到 heightIndex 估计的位置, 让它被排版
+            idx = self.document().ast().index(cursor.ast())
+            self.verticalScrollBar().setValue(int(self._container.heightIndex().y(idx)))
+            self._container.updateShowLayout()
+            item = self._container.contentItemCache(ast=cursor.ast())
+        if item is None or cursor.pos() >= len(item.cursorBases()): return  # <-- 没有创建或被折叠的 block
+        y = (item.pos() + item.cursorBases()[cursor.pos()]).y()
+        lineHeight = item.lineHeight(pos=cursor.pos())
         if y < self.verticalScrollBar().value():
             self.verticalScrollBar().setValue(int(y))
         elif y + lineHeight > self.verticalScrollBar().value() + self.viewport().height():
@@ -157,11 +218,11 @@ class MarkdownEdit(QScrollArea, AbstractMarkdownEdit):
     def _updateCusorSelectSection(self, pos):
         """ if cursor leftbutton presss, update cusor select"""
         cursor = self.cursor()
-        self.__contentItems[cursor.ast()].reset()
+        old_ast = cursor.ast()
         if cursor.selectMode() != cursor.SELECT_MODE_MUTIL: cursor.setSelectMode(cursor.SELECT_MODE_MUTIL)
         cursor.move(flag=MarkdownCursor.MOVE_MOUSE, pos=pos)
         cursor.setIsShowCursorShader(True)
-        self.__contentItems[self.cursor().ast()].reset()
+        self._updateCursorArea(old_ast, cursor.ast())
 
     def pasteFromClipboard(self) -> None:
         """ paste form clipboard """
@@ -174,13 +235,11 @@ class MarkdownEdit(QScrollArea, AbstractMarkdownEdit):
         # 设置剪贴板文本
         clipboard = QApplication.clipboard()
         start_ast, start_pos, end_ast, end_pos = self.cursor().selectedASTs()
-        start_idx = self.document().ast().index(start_ast)
-        end_idx = self.document().ast().index(end_ast)
+        root = self.document().ast()
+        start, end = root.offsetOf(start_ast) + start_pos, root.offsetOf(end_ast) + end_pos
         # get copy text
-        copy_text = ""
-        for ast in self.document().ast().children[start_idx:end_idx + 1]:
-            copy_text += ast.toMarkdown()
-        copy_text = copy_text[start_pos:end_pos - len(ast.toMarkdown())]
+        copy_text = "".join(ast.toMarkdown() for ast in root.children[root.index(start_ast):root.index(end_ast) + 1])
+        copy_text = copy_text[start_pos:start_pos + end - start]
         clipboard.setText(copy_text)
         self.update()
 
@@ -192,39 +251,30 @@ class MarkdownEdit(QScrollArea, AbstractMarkdownEdit):
 
     def paintEvent(self, event: QPaintEvent) -> None:
         # super(MarkdownEdit, self).paintEvent(event)
+        with span("paint", height=event.rect().height()):
+            self.__paint(event)
 
+    def __paint(self, event: QPaintEvent) -> None:
         # 1. 从缓存中获取图片绘制
         # 1. 不要viewport内的跳过
         painter = QPainter(self.viewport())
         painter.translate(-0, -self.verticalScrollBar().value())
 
+        # 2. paint blocks (virtual render mode)
+        if self.__renderMode == self.VirtualRenderMode:
+            self._container.paint(painter, rect=event.rect().translated(0, self.verticalScrollBar().value()))
+
         # 3. paint select content
-        painter.save()
-        start_ast, start_pos, end_ast, end_pos = self.cursor().selectedASTs()
-        if not (start_ast is end_ast and start_pos == end_pos):  # 不在原地
+        self.__selectionRects = self.selectionRects()
+        if self.__selectionRects:
+            painter.save()
             color = ThemeColor.PRIMARY.color()
             color.setAlpha(125)
             painter.setPen(Qt.NoPen)
             painter.setBrush(color)
-            for ast_index in range(self.document().ast().children.index(start_ast),
-                                   self.document().ast().children.index(end_ast) + 1):
-                ast = self.document().ast().children[ast_index]
-                if self._container.contentItemCache(ast) is None: continue  # <--不再视图内,可以不显示
-                bs = [(i, p) for i, p in enumerate(self.cursorBases(ast=ast))]
-                _si = start_pos if ast is start_ast else 0
-                _ei = end_pos if ast is end_ast else len(bs)
-                if _ei - _si < 1: continue
-                r, bs = 5, bs[_si:_ei + 1]
-                ys = {p.y() for p in self.cursorBases(ast=ast)[_si:_ei + 1]}
-                if len(bs) <= 1: continue
-                for y in ys:
-                    left_i, left_p = min((i for i in bs if i[1].y() == y), key=lambda x: x[1].x())
-                    right_i, right_p = max((i for i in bs if i[1].y() == y), key=lambda x: x[1].x())
-                    lineHeight = self.__contentItems[ast].lineHeight(pos=left_i)
-                    indentation = self.__contentItems[ast].indentation(pos=left_i)
-                    left_x = left_p.x() if y == min(ys) else indentation + self._margins.left()
-                    painter.drawRoundedRect(QRectF(left_x, left_p.y(), right_p.x() - left_x, lineHeight), r, r)
-        painter.restore()
+            for rect in self.__selectionRects:
+                painter.drawRoundedRect(rect, 5, 5)
+            painter.restore()
 
         # 4. paint predit
         if self._preEdit.preeditText() != "":
@@ -233,7 +283,7 @@ class MarkdownEdit(QScrollArea, AbstractMarkdownEdit):
             pulginBasePos = self.cursorBases(ast=self.cursor().ast(), pos=self.cursor().pos())
             font = self.__style.hintFont(font=painter.font(), ast="root")
             font.setPixelSize(int(lineHeight * 0.8))
-            fm = QFontMetrics(font)
+            fm = FontMetricsCache.metrics(font)
             painter.setFont(font)
             # draw preedit rect
             painter.save()
@@ -250,6 +300,11 @@ class MarkdownEdit(QScrollArea, AbstractMarkdownEdit):
             painter.restore()
 
         # 5.paint cursor
+        caret = self.caretRect()
+        if event.rect().translated(0, self.verticalScrollBar().value()).contains(caret):
+            self.__caretRect = caret
+        else:
+            self.__caretRect = self.__caretRect.united(caret)  # <-- 旧的光标可能还在屏幕上
         if self.cursor().isShowCursorShader() and self._container.contentItemCache(self.cursor().ast()):
             lineHeight = self._container.contentItemCache(self.cursor().ast()).lineHeight(pos=self.cursor().pos())
             pulginBasePos = self.cursorBases(ast=self.cursor().ast(), pos=self.cursor().pos())
@@ -263,21 +318,79 @@ class MarkdownEdit(QScrollArea, AbstractMarkdownEdit):
                 pulginBasePos = pulginBasePos + QPointF(w, 0)
                 painter.drawLine(pulginBasePos, QPointF(pulginBasePos.x(), pulginBasePos.y() + lineHeight))
 
+    def selectionRects(self) -> t.List[QRectF]:
+        """ the rects of selected lines in the shown blocks (the coordinate of content) """
+        return self._selectionGeometry.rects()
+
+    def caretRect(self) -> QRect:
+        """ the rect of caret (the coordinate of content), it is empty if the block of cursor is not shown """
+        item = self._container.contentItemCache(self.cursor().ast())
+        if item is None:
+            return QRect()
+        lineHeight = item.lineHeight(pos=self.cursor().pos())
+        base = self.cursorBases(ast=self.cursor().ast(), pos=self.cursor().pos())
+        if self._preEdit.preeditText() != "":
+            font = self.__style.hintFont(font=self.viewport().font(), ast="root")
+            font.setPixelSize(int(lineHeight * 0.8))
+            base = base + QPointF(FontMetricsCache.metrics(font).width(
+                self._preEdit.preeditText()[:self._preEdit.cursorPos()]), 0)
+        return QRectF(base.x() - 1, base.y() - 1, 3, lineHeight + 2).toAlignedRect()
+
+    def _updateCaret(self) -> None:
+        """ repaint the old and new rect of caret (blink), not the whole viewport """
+        rect = self.__caretRect.united(self.caretRect())
+        if not rect.isEmpty():
+            self.viewport().update(rect.translated(0, -self.verticalScrollBar().value()))
+
+    def _updateCursorArea(self, *asts: MarkdownASTBase) -> None:
+        """
+        reset the blocks of asts (they are rendered with the cursor) and repaint them, the caret and the changed lines
+        of selection. the whole viewport is repainted if the height of a block is changed (or may be changed)
+        """
+        items = [item for item in map(self._container.contentItemCache, set(asts)) if item is not None]
+        geometries = [item.geometry() for item in items]
+        for item in items:
+            item.reset()
+        region = QRegion()
+        if self.__renderMode == self.VirtualRenderMode:
+            self._container.updateShowLayout()
+            if any(item.geometry() != geometry for item, geometry in zip(items, geometries)):
+                self.viewport().update()  # <-- 下方的 block 移动了
+                return
+            for geometry in geometries:
+                region += geometry
+        elif items:
+            self.viewport().update()  # <-- ContentItem 在 paintEvent 中才重新排版, 高度未知
+            return
+        region += self.__caretRect.united(self.caretRect())
+        # 只更新变化的行
+        rects = self.selectionRects()
+        for rect in [rect for rect in rects if rect not in self.__selectionRects] + \
+                    [rect for rect in self.__selectionRects if rect not in rects]:
+            region += rect.toAlignedRect().adjusted(-1, -1, 1, 1)
+        if not region.isEmpty():
+            self.viewport().update(region.translated(0, -self.verticalScrollBar().value()))
+
     def mousePressEvent(self, e: QMouseEvent) -> None:
         # 左键点击移动 光标
         view_pos = e.pos() + QPointF(0, self.verticalScrollBar().value())
         cursor = self.cursor()
-        if e.button() == Qt.LeftButton:
+        if e.button() == Qt.LeftButton and self.__renderMode == self.VirtualRenderMode \
+                and self._container.collapseButtonAt(view_pos):
+            # 折叠按钮由 view 绘制和响应
+            block = self._container.collapseButtonAt(view_pos)
+            self._container.setCollapsed(block.ast(), not block.isCollapseSubItem())
+            self.onCollapseRequestedEvent(block)
+        elif e.button() == Qt.LeftButton:
             ast, pos = self._container.cursorBaseIn(pos=view_pos)
             if pos is not None:  # <--有内容
-                if self._container.contentItemCache(self.cursor().ast()):
-                    self._container.contentItemCache(self.cursor().ast()).reset()
+                old_ast = self.cursor().ast()
                 item = self.__contentItems[ast]
                 end_ast, p = item.cursorBases(returnAst=True)[pos]
                 if not end_ast.customInteraction(cursor=self.cursor()):  # 自定义行为,执行完成后判断是否执行自动操作
                     cursor.move(flag=MarkdownCursor.MOVE_MOUSE, pos=view_pos)
                     cursor.setSelectMode(mode=cursor.SELECT_MODE_SINGLE)
-                self.__contentItems[self.cursor().ast()].reset()
+                self._updateCursorArea(old_ast, ast, self.cursor().ast())  # <-- 自定义行为可能修改了点击的 block
 
         self.__mouseLeftButton = e.buttons() == Qt.LeftButton
         self.__mouseRightButton = e.buttons() == Qt.RightButton
@@ -289,7 +402,9 @@ class MarkdownEdit(QScrollArea, AbstractMarkdownEdit):
             self._updateCusorSelectSection(pos=view_pos)
         elif e.buttons() == Qt.NoButton:  # <---没有点击
             ast, pos = self._container.cursorBaseIn(pos=view_pos)
-            if pos is not None:
+            if self.__renderMode == self.VirtualRenderMode and self._container.collapseButtonAt(view_pos):
+                self.setCursor(Qt.ArrowCursor)
+            elif pos is not None:
                 item = self.__contentItems[ast]
                 end_ast, p = item.cursorBases(returnAst=True)[pos]
                 self.setCursor(end_ast.hintCursorShape(cursor=self.cursor()))
@@ -327,14 +442,25 @@ class MarkdownEdit(QScrollArea, AbstractMarkdownEdit):
         """ on collpose requested event """
         root = self.document().ast()
         for ast in root.children[root.index(item.ast()) + 1:]:
-            if ast.isShowCollapseButton(): return
-            self.__contentItems[ast].setIsCollapsing(item.isCollapseSubItem())
+            if ast.isShowCollapseButton(): break
+            self._container.setIsCollapsing(ast, item.isCollapseSubItem())
         self._adjustScroll()
 
+    def onBlocksAppendedEvent(self, num: int) -> None:
+        """ the blocks are published by the loader, show them if they are in viewport """
+        self._container.autoUpdateMarkdownItem()
+
+    def onResourceReadyEvent(self, key: str, owners: t.List[MarkdownASTBase]) -> None:
+        """ the svg of latex or the image is ready, re-render the blocks which show its placeholder """
+        items = [self._container.contentItemCache(ast) for ast in owners]
+        items = [item for item in items if item is not None]
+        if len(items) == 0: return
+        for item in items:
+            item.reset()
+        self._container.autoUpdateMarkdownItem()
+
     def onItemCreatedEvent(self, item: ContentItem):
         item.collapseRequested.connect(self.onCollapseRequestedEvent)
-        self.loadProgressBar.setMaximum(len(self.document().ast().children))
-        self.loadProgressBar.setValue(len(self.__contentItems))
 
     def resizeEvent(self, e) -> None:
         super(MarkdownEdit, self).resizeEvent(e)
@@ -362,11 +488,10 @@ class MarkdownEdit(QScrollArea, AbstractMarkdownEdit):
             old_ast = self.cursor().ast()
             cursor.move(MOVE_MODE[e.key()])
             cursor.setIsShowCursorShader(True)
-            if self._container.contentItemCache(old_ast):
-                self._container.contentItemCache(old_ast).reset()
-            if self._container.contentItemCache(self.cursor().ast()):
-                self._container.contentItemCache(self.cursor().ast()).reset()
-            self.viewport().update()
+            # 只更新光标, 选区和光标所在的 block
+            self._updateCursorArea(old_ast, self.cursor().ast())
+            self._moveViewToCurosr()
+            return
         elif e.key() == Qt.Key_Backspace:  # 删除
             if cursor.selectMode() == cursor.SELECT_MODE_SINGLE:
                 self.cursor().pop(_len=1)
@@ -396,7 +521,7 @@ class MarkdownEdit(QScrollArea, AbstractMarkdownEdit):
             # 添加
             if char:
                 self.cursor().add(char)
-            print(char, e.key())
+            logger.debug("key pressed: text=%r key=%#x", char, e.key())
         # update ast render
         # if input some new content, the ast will update near the ast of cursor
         self._container.autoUpdateMarkdownItem(updatesEnabled=False)
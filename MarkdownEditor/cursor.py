@@ -30,17 +30,12 @@ class MarkdownCursor(AbstructCursor):
     def pop(self, _len):
         """ 删除 """
         if _len == 0: return
-        # 倒叙查找之前的idx
+        # 通过 root 的 block index 查找开始的位置
         # 可能不够删除
-        children = self.rootAst().children[:self.rootAst().index(self.ast())][::-1]
-        can_pop_len, next_ast = self.pos(), self.ast()
-        for c in children:
-            if _len <= can_pop_len: break
-            can_pop_len, next_ast = can_pop_len + len(c.toMarkdown()), c
-        # 计算开始 pos
-        start_idx = can_pop_len - _len
+        root = self.rootAst()
+        start_ast, start_pos = root.astAt(max(root.offsetOf(self.ast()) + self.pos() - _len, 0))
         # remove
-        self.__swap(start_ast=next_ast, start_pos=start_idx, end_ast=self.ast(), end_pos=self.pos())
+        self.__swap(start_ast=start_ast, start_pos=start_pos, end_ast=self.ast(), end_pos=self.pos())
 
     def _return(self):
         """换行"""
@@ -55,51 +50,6 @@ class MarkdownCursor(AbstructCursor):
         else:
             self.add("\n")
 
-    def __swap_content_in_stard_and_end(self, s: int, e: int, markdown) -> t.Tuple[t.List[MarkdownASTBase], int]:
-        """ 返回 markdown 分析处的ast , 以及插入的位置"""
-        # 1.添加
-        isup = s != 0
-        isdown = e != len(self.rootAst().children)
-
-        # 联通上下两个段落重新分析
-        root: MarkdownAstRoot = self.rootAst()
-        anys = MarkdownAstRoot()
-        text_list = ([root.children[s - 1].toMarkdown()] if isup else []) + \
-                    [markdown] + \
-                    ([root.children[e].toMarkdown()] if isdown else [])
-        anys.setText("".join(text_list))
-        # 重置
-        root.swap(old=(s - (1 if isup else 0),
-                       e + (1 if isdown else 0)),
-                  new=anys.children)
-        # 在markdown处理返回结果
-        # 分析出的ast
-        # 位于的位置
-        asts = anys.children
-        if not isup:  # 没有向上
-            insert_index = 0
-        else:
-            # 大于表示有新增内容
-            if len(asts[0].toMarkdown()) > len(text_list[0]):
-                insert_index = len(text_list[0])
-            # 内容抱持不变
-            elif asts[0].toMarkdown() == text_list[0]:
-                insert_index, asts = 0, asts[1:]
-            else:  # 小于表示swap的content 导致内容减少
-                prosible_text = ""
-                for i, ast in enumerate(asts):
-                    _prosible_text = prosible_text + ast.toMarkdown()  # 判断是否包含了text_list的部分
-                    if len(_prosible_text) > len(text_list[0]):
-                        asts, insert_index = asts[i:], len(text_list[0]) - len(prosible_text)
-                        break
-                    prosible_text = _prosible_text
-                else:
-                    raise Exception(f"没想到为什么会减少\n{asts[0].toMarkdown()}\n----\n{text_list[0]}")
-        if isdown and asts[-1].toMarkdown() == text_list[-1]:
-            asts.pop(-1)
-
-        return asts, insert_index
-
     def move(self, flag, pos: QPointF = None):
         if flag == self.MOVE_FELT:
             self.setPos(self.pos() - 1)
@@ -159,7 +109,7 @@ class MarkdownCursor(AbstructCursor):
         # 1.计算需要更新的markdown
         start_idx, end_idx = self.rootAst().index(start_ast), self.rootAst().index(end_ast)
         new_markdown = start_ast.toMarkdown()[:start_pos] + text + end_ast.toMarkdown()[end_pos:]
-        asts, insertidx = self.__swap_content_in_stard_and_end(s=start_idx, e=end_idx + 1, markdown=new_markdown)
+        asts, insertidx = self.rootAst().reparse(start=start_idx, end=end_idx + 1, markdown=new_markdown)
         if isMoveCursor:
             # 可能减少block,也可能增加block
             # 所以需要重新定位
@@ -0,0 +1,96 @@
+"""
+the diagnostics of the package, they are the loggers of the standard logging under "MarkdownEditor"
+
+the messages use the %-style arguments of logging, so a message is formatted only if its level is enabled.
+an argument which is expensive to build (the summary of ast, the rules of css) is wrapped by `lazy`,
+it is built only when the message is formatted:
+
+    logger = getLogger(__name__)
+    logger.debug("document loaded, blocks=%d\\n%s", len(root.children), lazy(root.summary))
+
+the package adds a NullHandler only, nothing is output until the application configures logging or calls
+Diagnostics.enable():
+
+    Diagnostics.enable(logging.DEBUG)              # text to stderr
+    Diagnostics.enable(logging.DEBUG, json=True)   # one json object per line
+"""
+import json as _json
+import logging
+import sys
+import typing as t
+
+LOGGER_NAME = "MarkdownEditor"
+
+logging.getLogger(LOGGER_NAME).addHandler(logging.NullHandler())
+
+
+def getLogger(name: str) -> logging.Logger:
+    """ the logger of a module of package, name is __name__ of the module """
+    if name != LOGGER_NAME and not name.startswith(LOGGER_NAME + "."):
+        name = f"{LOGGER_NAME}.{name}"
+    return logging.getLogger(name)
+
+
+class lazy():
+    """ an argument of message which is built (func(*args, **kwargs)) only when the message is formatted """
+    __slots__ = ("func", "args", "kwargs")
+
+    def __init__(self, func: t.Callable, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self) -> str:
+        return str(self.func(*self.args, **self.kwargs))
+
+    def __repr__(self) -> str:
+        return repr(self.func(*self.args, **self.kwargs))
+
+
+class JsonFormatter(logging.Formatter):
+    """ a record is a json object: time, level, logger, message and the fields of `extra={"fields": {...}}` """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {"time": round(record.created, 6), "level": record.levelname, "logger": record.name,
+                "message": record.getMessage()}
+        fields = getattr(record, "fields", None)
+        if isinstance(fields, dict):
+            data.update(fields)
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return _json.dumps(data, ensure_ascii=False, default=str)
+
+
+class Diagnostics():
+    """ switch the output of the loggers of package, it is disabled (WARNING, without handler) by default """
+    FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+    __handler: logging.Handler = None
+
+    @classmethod
+    def logger(cls) -> logging.Logger:
+        return logging.getLogger(LOGGER_NAME)
+
+    @classmethod
+    def enable(cls, level: int = logging.DEBUG, stream: t.TextIO = None, json: bool = False) -> logging.Handler:
+        """ output the messages of level (or higher) to stream (stderr) """
+        cls.disable()
+        handler = logging.StreamHandler(stream or sys.stderr)
+        handler.setFormatter(JsonFormatter() if json else logging.Formatter(cls.FORMAT))
+        cls.__handler = handler
+        logger = cls.logger()
+        logger.addHandler(handler)
+        logger.setLevel(level)
+        return handler
+
+    @classmethod
+    def disable(cls):
+        """ remove the handler of enable, the level is reset to the level of the root logger """
+        logger = cls.logger()
+        if cls.__handler is not None:
+            logger.removeHandler(cls.__handler)
+            cls.__handler = None
+        logger.setLevel(logging.NOTSET)
+
+    @classmethod
+    def isEnabledFor(cls, level: int) -> bool:
+        return cls.logger().isEnabledFor(level)
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+import typing as t
+
+
+class DiskCache():
+    """
+    a content-addressed cache of files, the name of file is the hash of its key: <directory>/ab/abcdef....<suffix>
+    - the file is written to a temporary file and renamed, so a reader never sees a half-written file
+    - the atime of file is touched on reading, the least recently used files are removed when the size exceeds maxBytes
+    - several processes can share a directory, a file which is removed by the other process is just a miss
+    """
+    maxBytes = 64 << 20
+    trimInterval = 64  # 每写入 n 个文件检查一次大小
+    tempTimeout = 3600  # 崩溃遗留的临时文件
+
+    def __init__(self, directory: str, suffix: str = "", maxBytes: int = None):
+        self.directory = directory
+        self.suffix = suffix
+        if maxBytes is not None:
+            self.maxBytes = maxBytes
+        self.__puts = 0
+
+    @staticmethod
+    def key(*parts: t.Any) -> str:
+        """ the hash of parts, the parts must be json serializable """
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + self.suffix)
+
+    def get(self, key: str) -> t.Optional[bytes]:
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path, (time.time(), os.stat(path).st_mtime))  # <-- 文件系统可能是 noatime
+        except OSError:
+            return None
+        return data
+
+    def put(self, key: str, data: bytes):
+        """ write the file atomically, the errors of disk are ignored (the cache is optional) """
+        path = self.path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(temp, path)
+            except BaseException:
+                os.remove(temp)
+                raise
+        except OSError:
+            return
+        self.__puts += 1
+        if self.__puts % self.trimInterval == 1:  # <-- 第一次写入时也检查
+            self.trim()
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def files(self) -> t.List[t.Tuple[str, os.stat_result]]:
+        """ (path, stat) of all files """
+        files = []
+        if not os.path.isdir(self.directory): return files
+        for sub in os.scandir(self.directory):
+            if not sub.is_dir(): continue
+            for entry in os.scandir(sub.path):
+                try:
+                    files.append((entry.path, entry.stat()))
+                except OSError:
+                    pass
+        return files
+
+    def size(self) -> int:
+        """ the bytes of all files """
+        return sum(stat.st_size for _, stat in self.files())
+
+    def trim(self):
+        """ remove the least recently used files until the size is less than maxBytes """
+        now = time.time()
+        files = []
+        for path, stat in self.files():
+            if path.endswith(".tmp"):
+                if now - stat.st_mtime > self.tempTimeout:
+                    self.__remove(path)
+                continue
+            files.append((path, stat))
+        size = sum(stat.st_size for _, stat in files)
+        if size <= self.maxBytes: return
+        files.sort(key=lambda item: item[1].st_atime)
+        for path, stat in files:
+            if size <= self.maxBytes: break
+            self.__remove(path)
+            size -= stat.st_size
+
+    def clear(self):
+        for path, _ in self.files():
+            self.__remove(path)
+
+    @staticmethod
+    def __remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass  # <-- 已被其他进程删除
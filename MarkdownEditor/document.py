@@ -1,19 +1,98 @@
+from PyQt5.QtCore import pyqtSignal
+
 from .abstruct import AbstractMarkDownDocument
-from .markdown_ast import MarkdownAstRoot,MarkdownASTBase
-from PyQt5.QtWidgets import QApplication
+from .diagnostics import getLogger, lazy
+from .loader import MarkdownLoader, splitMarkdown
+from .markdown_ast import MarkdownAstRoot, MarkdownASTBase
+
+logger = getLogger(__name__)
+
 
 class MarkDownDocument(AbstractMarkDownDocument):
+    loadStarted = pyqtSignal()
+    loadProgress = pyqtSignal(int)  # 0 - 100
+    blocksAppended = pyqtSignal(int)  # the number of appended blocks
+    loadFinished = pyqtSignal()
+
+    # the first chunk is parsed in gui thread, the others are parsed in a worker thread
+    firstChunkSize = 4 * 1024
+    chunkSize = 64 * 1024
+
     def __init__(self):
         super(MarkDownDocument, self).__init__()
-        self.__markdownAst: MarkdownAstRoot
+        self.__markdownAst: MarkdownAstRoot = None
+        self.__loader: MarkdownLoader = None
+        self.__loadedSize = 0
 
     def setMarkdown(self, markdown: str, **kwargs) -> None:
+        self.stopLoading()
         self._text = markdown
+        chunks = splitMarkdown(markdown, chunkSize=self.chunkSize, firstChunkSize=self.firstChunkSize)
         self.__markdownAst = MarkdownAstRoot()
-        self.__markdownAst.setText(markdown)
-        print(self.__markdownAst.summary())
+        self.__markdownAst.setText(chunks[0])
+        self.__loadedSize = len(chunks[0])
+        if len(chunks) == 1:
+            self.__logLoaded()
+            return
+
+        # 剩余部分在后台解析
+        self.__loader = MarkdownLoader(root=self.__markdownAst, chunks=chunks[1:], parent=self)
+        self.__loader.chunkReady.connect(self.__onChunkReady)
+        self.__loader.finished.connect(self.__onLoaderFinished)
+        self.loadStarted.emit()
+        self.loadProgress.emit(self.progress())
+        self.__loader.start()
+
+    def stopLoading(self) -> None:
+        """ stop the loader, the blocks which are not published are dropped """
+        if self.__loader is None: return
+        loader, self.__loader = self.__loader, None
+        loader.chunkReady.disconnect(self.__onChunkReady)
+        loader.finished.disconnect(self.__onLoaderFinished)
+        loader.requestInterruption()
+        loader.wait()
+        loader.deleteLater()
+        self.loadFinished.emit()
+
+    def waitForLoaded(self) -> None:
+        """ block until all blocks are published """
+        if self.__loader is None: return
+        self.__loader.wait()
+        self.__onLoaderFinished()
+
+    def isLoading(self) -> bool:
+        return self.__loader is not None
+
+    def progress(self) -> int:
+        """ the progress of loading, 0 - 100 """
+        return 100 if len(self._text) == 0 else int(self.__loadedSize * 100 / len(self._text))
+
+    def __onChunkReady(self) -> None:
+        if self.__loader is None: return
+        n = 0
+        for asts, size in self.__loader.takeChunks():
+            self.__markdownAst.append(asts)
+            self.__loadedSize += size
+            n += len(asts)
+        if n == 0: return
+        self.loadProgress.emit(self.progress())
+        self.blocksAppended.emit(n)
+
+    def __onLoaderFinished(self) -> None:
+        if self.__loader is None: return
+        self.__onChunkReady()
+        self.__loader.deleteLater()
+        self.__loader = None
+        self.__logLoaded()
+        self.loadFinished.emit()
+
+    def __logLoaded(self) -> None:
+        # <-- summary 只在 debug 输出时生成
+        logger.debug("document loaded: chars=%d blocks=%d\n%s", len(self._text), len(self.__markdownAst.children),
+                     lazy(self.__markdownAst.summary))
 
     def toMarkdown(self) -> str:
+        self.waitForLoaded()
         return self.__markdownAst.toMarkdown()
 
     def ast(self) -> MarkdownAstRoot:
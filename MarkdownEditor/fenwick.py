@@ -0,0 +1,93 @@
+import typing as t
+
+
+class FenwickTree():
+    """ binary indexed tree, prefix sum / point update / search in O(log n) """
+
+    def __init__(self, values: t.Iterable[float] = ()):
+        self.__values: t.List[float] = []
+        self.__tree: t.List[float] = [0]
+        self.build(values)
+
+    def build(self, values: t.Iterable[float]) -> None:
+        """ rebuild the tree in O(n) """
+        self.__values = list(values)
+        tree = [0] + self.__values  # 1-based
+        n = len(self.__values)
+        for i in range(1, n + 1):
+            j = i + (i & -i)
+            if j <= n:
+                tree[j] += tree[i]
+        self.__tree = tree
+
+    def __len__(self) -> int:
+        return len(self.__values)
+
+    def value(self, idx: int) -> float:
+        """ the value in idx """
+        return self.__values[idx]
+
+    def values(self) -> t.List[float]:
+        return self.__values
+
+    def setValue(self, idx: int, value: float) -> None:
+        """ set the value in idx """
+        delta = value - self.__values[idx]
+        if delta == 0: return
+        self.__values[idx] = value
+        i, n = idx + 1, len(self.__values)
+        while i <= n:
+            self.__tree[i] += delta
+            i += i & -i
+
+    def append(self, value: float) -> None:
+        """ append a value in O(log n) """
+        self.__values.append(value)
+        n = len(self.__values)
+        # tree[n] 保存 (n - lowbit(n), n] 的和
+        self.__tree.append(value + self.prefixSum(n - 1) - self.prefixSum(n - (n & -n)))
+
+    def splice(self, start: int, end: int, values: t.Iterable[float]) -> None:
+        """ replace values[start:end] by values, only the nodes after start are rebuilt, O(n - start + log n) """
+        self.__values[start:end] = values
+        n, tree = len(self.__values), self.__tree
+        del tree[start + 1:]
+        tree.extend(self.__values[start:])
+        # tree[:start + 1] 不变, prefixSum(start) 的节点是前缀中唯一跨过 start 的节点
+        i = start
+        while i > 0:
+            j = i + (i & -i)
+            if j <= n:
+                tree[j] += tree[i]
+            i -= i & -i
+        for i in range(start + 1, n + 1):
+            j = i + (i & -i)
+            if j <= n:
+                tree[j] += tree[i]
+
+    def prefixSum(self, idx: int) -> float:
+        """ the sum of values[:idx] """
+        s = 0
+        i = min(idx, len(self.__values))
+        while i > 0:
+            s += self.__tree[i]
+            i -= i & -i
+        return s
+
+    def total(self) -> float:
+        return self.prefixSum(len(self.__values))
+
+    def search(self, value: float) -> int:
+        """
+        the idx which satisfies prefixSum(idx) <= value < prefixSum(idx + 1), all the values must be non-negative
+        (return len(self) if value >= total)
+        """
+        pos, n = 0, len(self.__values)
+        step = 1 << n.bit_length()
+        while step:
+            nxt = pos + step
+            if nxt <= n and self.__tree[nxt] <= value:
+                pos = nxt
+                value -= self.__tree[nxt]
+            step >>= 1
+        return pos
@@ -0,0 +1,90 @@
+import typing as t
+from collections import OrderedDict
+
+from PyQt5.QtGui import QFont, QFontMetrics
+
+
+class FontMetricsCache():
+    """
+    the shared cache of QFontMetrics and advance widths, keyed by the fingerprint of font (QFont.key).
+    both are LRU caches with bounded size, the hits and misses of each cache are counted separately.
+    """
+    maxFonts = 128
+    maxWidths = 1 << 16
+
+    __metrics: t.Dict[str, QFontMetrics] = OrderedDict()
+    __widths: t.Dict[t.Tuple[str, str], int] = OrderedDict()  # (font key, char or run) -> advance
+    metricsHits = 0
+    metricsMisses = 0
+    widthHits = 0
+    widthMisses = 0
+
+    @staticmethod
+    def fingerprint(font: QFont) -> str:
+        return font.key()
+
+    @classmethod
+    def metrics(cls, font: QFont) -> QFontMetrics:
+        """ the QFontMetrics of font """
+        key = font.key()
+        fm = cls.__metrics.get(key, None)
+        if fm is not None:
+            cls.metricsHits += 1
+            cls.__metrics.move_to_end(key)
+            return fm
+        cls.metricsMisses += 1
+        return cls.__createMetrics(key, font)
+
+    @classmethod
+    def __createMetrics(cls, key: str, font: QFont) -> QFontMetrics:
+        fm = cls.__metrics[key] = QFontMetrics(font)
+        if len(cls.__metrics) > cls.maxFonts:
+            cls.__metrics.popitem(last=False)
+        return fm
+
+    @classmethod
+    def width(cls, font: QFont, text: str) -> int:
+        """ the advance width of a char or a run """
+        fontKey = font.key()
+        key = (fontKey, text)
+        w = cls.__widths.get(key, None)
+        if w is not None:
+            cls.widthHits += 1
+            cls.__widths.move_to_end(key)
+            return w
+        cls.widthMisses += 1
+        # 不计入 metrics 的命中统计, 一次 width 未命中只统计一次
+        fm = cls.__metrics.get(fontKey, None)
+        if fm is None:
+            fm = cls.__createMetrics(fontKey, font)
+        else:
+            cls.__metrics.move_to_end(fontKey)
+        w = cls.__widths[key] = fm.horizontalAdvance(text)
+        if len(cls.__widths) > cls.maxWidths:
+            cls.__widths.popitem(last=False)
+        return w
+
+    @classmethod
+    def height(cls, font: QFont) -> int:
+        return cls.metrics(font).height()
+
+    @classmethod
+    def ascent(cls, font: QFont) -> int:
+        return cls.metrics(font).ascent()
+
+    @classmethod
+    def descent(cls, font: QFont) -> int:
+        return cls.metrics(font).descent()
+
+    @classmethod
+    def cacheInfo(cls) -> t.Dict[str, t.Dict[str, int]]:
+        """ hits, misses and the size of the metrics cache and the widths cache, counted separately """
+        return {"metrics": {"hits": cls.metricsHits, "misses": cls.metricsMisses, "count": len(cls.__metrics)},
+                "widths": {"hits": cls.widthHits, "misses": cls.widthMisses, "count": len(cls.__widths)}}
+
+    @classmethod
+    def clear(cls):
+        """ clear the caches and counters, for example: the dpi of screen is changed """
+        cls.__metrics.clear()
+        cls.__widths.clear()
+        cls.metricsHits = cls.metricsMisses = cls.widthHits = cls.widthMisses = 0
@@ -0,0 +1,269 @@
+import os
+import sys
+import threading
+import typing as t
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from PyQt5.QtCore import QBuffer, QObject, QSize, QStandardPaths, Qt, pyqtSignal
+from PyQt5.QtGui import QImage, QImageReader, QPixmap
+
+from .diagnostics import getLogger
+from .disk_cache import DiskCache
+from .memory_cache import MemoryCache
+
+logger = getLogger(__name__)
+
+# 同一个缩略图只生成一次: key -> [lock, 使用 (持有或等待) 它的线程数], 没有线程使用时删除
+_thumbnailLocks: t.Dict[str, list] = {}
+_thumbnailLocksLock = threading.Lock()
+
+
+def thumbnailKey(path: str, width: int) -> t.Optional[str]:
+    """ the thumbnail depends on the path, the mtime and size of file and the width bucket """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return DiskCache.key(os.path.abspath(path), stat.st_mtime_ns, stat.st_size, width)
+
+
+def readThumbnail(path: str, width: int, cache: DiskCache) -> QImage:
+    """ the image in width (the width bucket), it is read from the cache or decoded and saved into the cache """
+    key = thumbnailKey(path, width)
+    if key is None: return QImage()
+    with _thumbnailLocksLock:
+        entry = _thumbnailLocks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            data = cache.get(key)
+            if data is not None:
+                image = QImage.fromData(data)
+                if not image.isNull(): return image
+
+            reader = QImageReader(path)
+            size = reader.size()
+            if not size.isValid() or size.width() <= width:
+                return reader.read()  # <-- 小图不需要缩略图
+            reader.setScaledSize(ImageLoader.scaledSize(size, width))
+            image = reader.read()
+            if not image.isNull():
+                buffer = QBuffer()
+                buffer.open(QBuffer.WriteOnly)
+                image.save(buffer, "PNG", ImageLoader.thumbnailQuality)
+                cache.put(key, bytes(buffer.data()))
+            return image
+    finally:
+        # 等待的线程使用同一个 lock, 它们会读取写入的缩略图; 所有线程结束后 (任何结果) 才删除 lock
+        with _thumbnailLocksLock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                _thumbnailLocks.pop(key, None)
+
+
+def prewarmThumbnail(path: str, width: int, cache: DiskCache):
+    """ make the thumbnail if it dose not exist and the image is larger than width """
+    key = thumbnailKey(path, width)
+    if key is None or key in cache: return
+    size = QImageReader(path).size()
+    if size.isValid() and size.width() > width:
+        readThumbnail(path, width, cache)
+
+
+def lowerThreadPriority():
+    """ the prewarming thread should not take the cpu from the gui thread (only works on linux) """
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+    except (AttributeError, OSError):
+        pass
+
+
+def readImage(path: str, size: QSize, cache: DiskCache = None) -> QImage:
+    """ decode the image in size (device pixels), it runs in the worker thread of ImageLoader """
+    if cache is None:
+        reader = QImageReader(path)
+        reader.setScaledSize(size)  # <-- 解码时缩放, 不需要完整分辨率的图片
+        return reader.read()
+    image = readThumbnail(path, ImageLoader.bucket(size.width()), cache)
+    if image.isNull() or image.size() == size:
+        return image
+    return image.scaled(size, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+
+
+class ImageLoader(QObject):
+    """
+    decode the local images in a thread pool, they are scaled to the width of view while decoding.
+    the pixmaps are saved in pixmapPool by (path, width, dpr, mtime), and imageReady is emitted (in gui thread) with
+    the owners which requested it. the size of image is read from its header, so the layout dose not wait for decoding.
+    the large images are scaled to the width bucket and saved in thumbnailCache (shared by sessions), and the
+    thumbnails of an opened document can be made in background by prewarm.
+    """
+    imageReady = pyqtSignal(str, list)  # path, owners
+    _finished = pyqtSignal(object)  # <-- 从线程池转到 gui 线程
+
+    maxWorkers = 2
+    asynchronous = True  # False: decode in the caller thread, for example: benchmark
+    pixmapPool = MemoryCache(maxBytes=256 << 20, cost=lambda pixmap: pixmap.width() * pixmap.height() * 4)
+    thumbnailDirectory: t.Optional[str] = None  # None: <GenericCacheLocation>/MarkdownEditor/thumbnails
+    thumbnailBytes = 256 << 20
+    useThumbnailCache = True
+    bucketSize = 256  # 缩略图的宽度向上取整到 bucketSize 的倍数
+    thumbnailQuality = 80  # the quality of png is the speed of compression, 80 is about 3 times faster than default
+    sizesBytes = 4 << 20  # the LRU budget of the sizes in header
+    prewarmedBytes = 4 << 20  # the LRU budget of the prewarmed (path, width)
+    failedBytes = 4 << 20  # the LRU budget of the keys whose image can not be decoded
+    __instance: "ImageLoader" = None
+
+    def __init__(self, parent: QObject = None):
+        super(ImageLoader, self).__init__(parent)
+        self.__executor: t.Optional[ThreadPoolExecutor] = None
+        self.__futures: t.Dict[tuple, Future] = {}
+        self.__owners: t.Dict[tuple, t.Set[t.Any]] = {}
+        # (path, mtime) -> the size in header, the cost of an entry is given by entryCost when it is put
+        self.__sizes = MemoryCache(maxBytes=self.sizesBytes, cost=lambda value: 0)
+        self.__failed = MemoryCache(maxBytes=self.failedBytes, cost=lambda value: 0)  # key -> True
+        self.__thumbnailCache: t.Optional[DiskCache] = None
+        self.__prewarmExecutor: t.Optional[ThreadPoolExecutor] = None
+        self.__prewarmed = MemoryCache(maxBytes=self.prewarmedBytes, cost=lambda value: 0)  # (path, width) -> True
+        self._finished.connect(self.__onFinished)
+
+    @classmethod
+    def instance(cls) -> "ImageLoader":
+        if cls.__instance is None:
+            cls.__instance = ImageLoader()
+        return cls.__instance
+
+    def executor(self) -> ThreadPoolExecutor:
+        if self.__executor is None:
+            self.__executor = ThreadPoolExecutor(max_workers=self.maxWorkers, thread_name_prefix="ImageLoader")
+        return self.__executor
+
+    def thumbnailCache(self) -> t.Optional[DiskCache]:
+        if not self.useThumbnailCache: return None
+        if self.__thumbnailCache is None:
+            directory = self.thumbnailDirectory or os.path.join(
+                QStandardPaths.writableLocation(QStandardPaths.GenericCacheLocation), "MarkdownEditor", "thumbnails")
+            self.__thumbnailCache = DiskCache(directory, suffix=".png", maxBytes=self.thumbnailBytes)
+        return self.__thumbnailCache
+
+    @classmethod
+    def bucket(cls, width: int) -> int:
+        return -(-width // cls.bucketSize) * cls.bucketSize
+
+    @staticmethod
+    def mtime(path: str) -> t.Optional[int]:
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def imageSize(self, path: str) -> t.Optional[QSize]:
+        """ the size of image in its header, None if the image dose not exist or can not be read """
+        mtime = self.mtime(path)
+        if mtime is None: return None
+        size = self.__sizes.get((path, mtime), None)
+        if size is None:
+            size = self.__sizes.put((path, mtime), QImageReader(path).size(), cost=self.entryCost(path))
+        return size if size.isValid() and not size.isEmpty() else None
+
+    @staticmethod
+    def entryCost(path: str) -> int:
+        """ the approximate bytes of an entry of sizes, prewarmed or failed: the path, the key tuple and the value """
+        return sys.getsizeof(path) + 128
+
+    @staticmethod
+    def scaledSize(size: QSize, width: int) -> QSize:
+        """ the size of image in the width (the aspect ratio is kept) """
+        return QSize(width, max(int(size.height() / size.width() * width), 1))
+
+    def key(self, path: str, width: int, dpr: float) -> tuple:
+        return path, width, dpr, self.mtime(path)
+
+    def request(self, path: str, width: int, dpr: float = 1, owner: t.Any = None) -> t.Optional[QPixmap]:
+        """
+        the image in width (logical pixels), if it is not decoded, None is returned and imageReady will be emitted for
+        owner
+        """
+        key = self.key(path, width, dpr)
+        pixmap = self.pixmapPool.get(key)
+        if pixmap is not None or key in self.__failed:
+            return pixmap
+        size = self.imageSize(path)
+        if size is None: return None
+        size = self.scaledSize(size, width) * dpr
+        if not self.asynchronous:
+            try:
+                image = readImage(path, size, self.thumbnailCache())
+            except Exception as e:
+                logger.warning("image load failed: %r, %s: %s", path, type(e).__name__, e)
+                image = QImage()  # <-- 与解码失败相同
+            return self.__store(key, image)
+        if owner is not None:
+            self.__owners.setdefault(key, set()).add(owner)
+        if key not in self.__futures:
+            future = self.__futures[key] = self.executor().submit(readImage, path, size, self.thumbnailCache())
+            future.add_done_callback(lambda f: f.cancelled() or self._finished.emit(key))
+        return None
+
+    def prewarm(self, paths: t.Iterable[str], width: int, dpr: float = 1):
+        """ make the thumbnails of images in width in background, they are not loaded into memory """
+        cache = self.thumbnailCache()
+        if cache is None: return
+        if self.__prewarmExecutor is None:
+            # 单独的线程, 不延迟正在显示的图片
+            self.__prewarmExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ImageLoader.prewarm",
+                                                        initializer=lowerThreadPriority)
+        width = self.bucket(int(width * dpr))
+        for path in paths:
+            if (path, width) in self.__prewarmed: continue
+            self.__prewarmed.put((path, width), True, cost=self.entryCost(path))
+            self.__prewarmExecutor.submit(prewarmThumbnail, path, width, cache)
+
+    def isFailed(self, path: str, width: int, dpr: float = 1) -> bool:
+        """ the header is readable but the image can not be decoded """
+        return self.key(path, width, dpr) in self.__failed
+
+    def cancel(self, owner: t.Any):
+        """ the owner dose not need the image, the request is canceled if no other owner needs it """
+        for key in [key for key, owners in self.__owners.items() if owner in owners]:
+            owners = self.__owners[key]
+            owners.discard(owner)
+            if len(owners) == 0:
+                self.__owners.pop(key)
+                if self.__futures[key].cancel():
+                    self.__futures.pop(key)
+
+    def pendingCount(self) -> int:
+        return len(self.__futures)
+
+    def __store(self, key: tuple, image: QImage) -> t.Optional[QPixmap]:
+        if image.isNull():
+            self.__failed.put(key, True, cost=self.entryCost(key[0]))
+            return None
+        pixmap = QPixmap.fromImage(image)  # <-- QPixmap 只能在 gui 线程创建
+        pixmap.setDevicePixelRatio(key[2])
+        return self.pixmapPool.put(key, pixmap)
+
+    def __onFinished(self, key: tuple):
+        future = self.__futures.pop(key, None)
+        if future is None: return
+        owners = list(self.__owners.pop(key, ()))
+        try:
+            image = future.result()
+        except Exception as e:
+            logger.warning("image load failed: %r, %s: %s", key[0], type(e).__name__, e)
+            image = QImage()  # <-- 与解码失败相同, owner 仍然需要重绘
+        self.__store(key, image)
+        self.imageReady.emit(key[0], owners)
+
+    def shutdown(self):
+        """ cancel the pending requests and stop the workers """
+        if self.__prewarmExecutor is not None:
+            self.__prewarmExecutor.shutdown(wait=False, cancel_futures=True)
+            self.__prewarmExecutor = None
+            self.__prewarmed.clear()
+        if self.__executor is None: return
+        self.__executor.shutdown(wait=False, cancel_futures=True)
+        self.__executor = None
+        self.__futures.clear()
+        self.__owners.clear()
@@ -0,0 +1,168 @@
+import collections
+import json
+import os
+import threading
+import time
+import typing as t
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+
+class Span():
+    """ a finished timing span, the times are microseconds of time.perf_counter """
+    __slots__ = ("name", "start", "duration", "astType", "blockIndex", "thread", "args")
+
+    def __init__(self, name: str, start: float, duration: float, astType: t.Optional[str] = None,
+                 blockIndex: t.Optional[int] = None, thread: int = 0, args: dict = None):
+        self.name = name
+        self.start = start
+        self.duration = duration
+        self.astType = astType
+        self.blockIndex = blockIndex  # the index in root, None: not a block, -1: not in root any more
+        self.thread = thread
+        self.args = args or {}
+
+    def toChromeEvent(self, pid: int) -> dict:
+        """ a complete event ("ph": "X") of chrome trace """
+        args = dict(self.args)
+        if self.astType is not None:
+            args["ast"] = self.astType
+        if self.blockIndex is not None:
+            args["block"] = self.blockIndex
+        return {"name": self.name if self.astType is None else f"{self.name} {self.astType}",
+                "cat": self.name.split(".")[0], "ph": "X", "ts": self.start, "dur": self.duration,
+                "pid": pid, "tid": self.thread, "args": args}
+
+    def __repr__(self) -> str:
+        return f"Span({self.name}, {self.astType}, {self.blockIndex}, {self.duration:.0f}us)"
+
+
+class _NullSpan():
+    """ the span of disabled instrumentation, it does nothing """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+class _SpanContext():
+    __slots__ = ("instrumentation", "name", "ast", "args", "start")
+
+    def __init__(self, instrumentation: "Instrumentation", name: str, ast, args: dict):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.ast = ast
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.instrumentation.record(self.name, self.start, time.perf_counter(), ast=self.ast, **self.args)
+        return False
+
+
+_nullSpan = _NullSpan()
+
+
+class Instrumentation(QObject):
+    """
+    opt-in timing spans of parse, layout, raster, merge (CachePaint.render), show/hide of blocks and paint.
+    the span of a block is tagged with the type of ast and the index of block in root.
+    the spans are kept in memory (the last maxSpans), spanFinished is emitted for each span (in the thread which
+    records it), and they can be exported as chrome trace (chrome://tracing, https://ui.perfetto.dev).
+    it is disabled by default, a disabled span costs a function call:
+
+        Instrumentation.setEnabled(True)
+        ...
+        Instrumentation.instance().saveChromeTrace("trace.json")
+    """
+    spanFinished = pyqtSignal(object)  # Span
+
+    enabled = False
+    maxSpans = 200000
+    __instance: "Instrumentation" = None
+
+    def __init__(self, parent: QObject = None):
+        super(Instrumentation, self).__init__(parent)
+        self.__spans: t.Deque[Span] = collections.deque(maxlen=self.maxSpans)
+
+    @classmethod
+    def instance(cls) -> "Instrumentation":
+        if cls.__instance is None:
+            cls.__instance = Instrumentation()
+        return cls.__instance
+
+    @classmethod
+    def setEnabled(cls, enabled: bool):
+        cls.enabled = enabled
+
+    @classmethod
+    def isEnabled(cls) -> bool:
+        return cls.enabled
+
+    def span(self, name: str, ast=None, **args) -> _SpanContext:
+        """ a context which records the span of name, ast is the block (or a child of block) which is processed """
+        return _SpanContext(self, name, ast, args)
+
+    def record(self, name: str, start: float, end: float, ast=None, **args) -> Span:
+        """ record a span, start and end are the seconds of time.perf_counter """
+        astType, blockIndex = None, None
+        if ast is not None:
+            astType, blockIndex = ast.type, self.blockIndex(ast)
+        span = Span(name=name, start=start * 1e6, duration=(end - start) * 1e6, astType=astType,
+                    blockIndex=blockIndex, thread=threading.get_ident(), args=args)
+        self.__spans.append(span)
+        self.spanFinished.emit(span)
+        return span
+
+    @staticmethod
+    def blockIndex(ast) -> int:
+        """ the index of the block of ast in root, -1 if it is not in root """
+        while getattr(getattr(ast, "parent", None), "parent", None) is not None:
+            ast = ast.parent  # <-- 子 ast 使用所在的 block
+        root = getattr(ast, "parent", None)
+        try:
+            return root.index(ast)
+        except (AttributeError, ValueError):
+            return -1
+
+    def spans(self) -> t.List[Span]:
+        return list(self.__spans)
+
+    def clear(self):
+        self.__spans.clear()
+
+    def summary(self) -> t.Dict[t.Tuple[str, t.Optional[str]], t.Tuple[int, float]]:
+        """ (name, ast type) -> (count, milliseconds), the slowest first """
+        result: t.Dict[t.Tuple[str, t.Optional[str]], t.List] = {}
+        for span in self.spans():
+            item = result.setdefault((span.name, span.astType), [0, 0])
+            item[0] += 1
+            item[1] += span.duration / 1000
+        return {key: (count, total) for key, (count, total) in sorted(result.items(), key=lambda item: -item[1][1])}
+
+    def toChromeTrace(self) -> dict:
+        pid = os.getpid()
+        events = [span.toChromeEvent(pid) for span in self.spans()]
+        threads = {span.thread for span in self.spans()}
+        main = threading.main_thread().ident
+        for thread in threads:
+            name = "gui" if thread == main else f"worker {thread}"
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": thread, "args": {"name": name}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def saveChromeTrace(self, path: str):
+        with open(path, "w", encoding="utf8") as f:
+            json.dump(self.toChromeTrace(), f)
+
+
+def span(name: str, ast=None, **args) -> t.Union[_SpanContext, _NullSpan]:
+    """ the span of the shared instrumentation, it does nothing if the instrumentation is disabled """
+    if not Instrumentation.enabled:
+        return _nullSpan
+    return Instrumentation.instance().span(name, ast, **args)
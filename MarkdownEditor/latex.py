@@ -0,0 +1,217 @@
+import io
+import multiprocessing
+import os
+import typing as t
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from PyQt5.QtCore import QObject, QStandardPaths, pyqtSignal
+
+from .diagnostics import getLogger
+from .disk_cache import DiskCache
+from .memory_cache import MemoryCache
+
+LatexFont = {"math_fontfamily": "stix", "size": 64, "weight": "bold"}
+LatexColor = None  # None: rc text.color
+logger = getLogger(__name__)
+
+
+def mathToImage(s, filename_or_obj, prop=None, dpi=None, format=None, *, color=None):
+    """
+    Given a math expression, renders it in a closely-clipped bounding
+    box to an image file.
+
+    Parameters
+    ----------
+    s : str
+        A math expression.  The math portion must be enclosed in dollar signs.
+    filename_or_obj : str or path-like or file-like
+        Where to write the image data.
+    prop : `.FontProperties`, optional
+        The size and style of the text.
+    dpi : float, optional
+        The output dpi.  If not set, the dpi is determined as for
+        `.Figure.savefig`.
+    format : str, optional
+        The output format, e.g., 'svg', 'pdf', 'ps' or 'png'.  If not set, the
+        format is determined as for `.Figure.savefig`.
+    color : str, optional
+        Foreground color, defaults to :rc:`text.color`.
+    """
+    from matplotlib import figure
+    from matplotlib.mathtext import MathTextParser
+
+    parser = MathTextParser('path')
+    width, height, depth, _, _ = parser.parse(s, dpi=72, prop=prop)
+    fig = figure.Figure(figsize=(width / 72.0, height / 72.0))
+    fig.text(0, depth / height, s, fontproperties=prop, color=color)
+    fig.savefig(filename_or_obj, dpi=dpi, format=format)
+
+    return depth
+
+
+def renderLatexSvg(latex: str) -> bytes:
+    """ render latex to svg by matplotlib, it runs in the worker process of LatexRenderer """
+    import matplotlib.font_manager as mfm
+
+    prop = mfm.FontProperties(**LatexFont)
+    bfo = io.BytesIO()
+    try:
+        mathToImage(rf"${latex}$", bfo, prop=prop, dpi=72, format="svg", color=LatexColor)
+    except Exception as e:
+        string = str(e)
+        for excetion in ["ParseSyntaxException:", "ParseFatalException", "ParseException"]:
+            if excetion in string:
+                bfo = io.BytesIO()
+                mathToImage(rf"Latex Error: {latex}", bfo, prop=prop, dpi=72, format="svg", color="r")
+                break
+        else:
+            raise e
+    return bfo.getvalue()
+
+
+class LatexRenderer(QObject):
+    """
+    render latex in a process pool, so matplotlib dose not block the gui thread.
+    the svg is saved in svgPool, and svgReady is emitted (in gui thread) with the owners which requested it.
+    the same latex is rendered once, and the request of owners which are not shown any more can be canceled.
+    the svg is also saved in diskCache (shared by sessions and processes), so matplotlib is not needed to reopen it.
+    (the workers are spawned, so the main script must be guarded by `if __name__ == "__main__"`,
+    otherwise the pool is broken and latex is rendered synchronously)
+    """
+    svgReady = pyqtSignal(str, list)  # latex, owners
+    _finished = pyqtSignal(str)  # <-- 从进程池的线程转到 gui 线程
+
+    maxWorkers = 2
+    asynchronous = True  # False: render in the caller thread, for example: benchmark
+    svgPool = MemoryCache(maxBytes=16 << 20, cost=lambda svg: svg.getbuffer().nbytes)  # latex -> svg
+    cacheDirectory: t.Optional[str] = None  # None: <GenericCacheLocation>/MarkdownEditor/latex
+    useDiskCache = True
+    __instance: "LatexRenderer" = None
+    __matplotlibVersion: t.Optional[str] = None
+
+    def __init__(self, parent: QObject = None):
+        super(LatexRenderer, self).__init__(parent)
+        self.__executor: t.Optional[ProcessPoolExecutor] = None
+        self.__futures: t.Dict[str, Future] = {}
+        self.__owners: t.Dict[str, t.Set[t.Any]] = {}
+        self.__failed: t.Set[str] = set()
+        self.__diskCache: t.Optional[DiskCache] = None
+        self._finished.connect(self.__onFinished)
+
+    @classmethod
+    def instance(cls) -> "LatexRenderer":
+        if cls.__instance is None:
+            cls.__instance = LatexRenderer()
+        return cls.__instance
+
+    def executor(self) -> ProcessPoolExecutor:
+        if self.__executor is None:
+            # fork 一个已经启动了 Qt 线程的进程是不安全的
+            self.__executor = ProcessPoolExecutor(max_workers=self.maxWorkers,
+                                                  mp_context=multiprocessing.get_context("spawn"))
+        return self.__executor
+
+    def diskCache(self) -> t.Optional[DiskCache]:
+        if not self.useDiskCache: return None
+        if self.__diskCache is None:
+            directory = self.cacheDirectory or os.path.join(
+                QStandardPaths.writableLocation(QStandardPaths.GenericCacheLocation), "MarkdownEditor", "latex")
+            self.__diskCache = DiskCache(directory, suffix=".svg")
+        return self.__diskCache
+
+    @classmethod
+    def cacheKey(cls, latex: str) -> str:
+        """ the svg depends on the formula, the font, the color and the version of matplotlib """
+        if cls.__matplotlibVersion is None:
+            from importlib import metadata  # <-- importlib.metadata 会导入 email, 只在第一次用到时导入
+            try:
+                cls.__matplotlibVersion = metadata.version("matplotlib")  # <-- 不需要 import matplotlib
+            except metadata.PackageNotFoundError:
+                cls.__matplotlibVersion = ""
+        return DiskCache.key(cls.__matplotlibVersion, LatexFont, LatexColor, latex)
+
+    def __loadFromDisk(self, latex: str) -> t.Optional[io.BytesIO]:
+        cache = self.diskCache()
+        data = None if cache is None else cache.get(self.cacheKey(latex))
+        if data is None: return None
+        return self.svgPool.put(latex, io.BytesIO(data))
+
+    def __store(self, latex: str, data: bytes) -> io.BytesIO:
+        cache = self.diskCache()
+        if cache is not None:
+            cache.put(self.cacheKey(latex), data)
+        return self.svgPool.put(latex, io.BytesIO(data))
+
+    def request(self, latex: str, owner: t.Any = None) -> t.Optional[io.BytesIO]:
+        """ the svg of latex, if it is not rendered, None is returned and svgReady will be emitted for owner """
+        svg = self.svgPool.get(latex, None)
+        if svg is not None or latex in self.__failed:
+            return svg
+        svg = self.__loadFromDisk(latex)
+        if svg is not None:
+            return svg
+        if not self.asynchronous:
+            return self.render(latex)
+        if owner is not None:
+            self.__owners.setdefault(latex, set()).add(owner)
+        if latex not in self.__futures:
+            try:
+                future = self.__futures[latex] = self.executor().submit(renderLatexSvg, latex)
+            except BrokenProcessPool:
+                self.__onBroken()
+                return self.render(latex)
+            future.add_done_callback(lambda f: f.cancelled() or self._finished.emit(latex))
+        return None
+
+    def render(self, latex: str) -> io.BytesIO:
+        """ render latex synchronously """
+        svg = self.svgPool.get(latex, None)
+        if svg is None:
+            svg = self.__loadFromDisk(latex)
+        if svg is None:
+            svg = self.__store(latex, renderLatexSvg(latex))
+        return svg
+
+    def cancel(self, owner: t.Any):
+        """ the owner dose not need the svg, the request is canceled if no other owner needs it """
+        for latex in [latex for latex, owners in self.__owners.items() if owner in owners]:
+            owners = self.__owners[latex]
+            owners.discard(owner)
+            if len(owners) == 0:
+                self.__owners.pop(latex)
+                if self.__futures[latex].cancel():
+                    self.__futures.pop(latex)
+
+    def isPending(self, latex: str) -> bool:
+        return latex in self.__futures
+
+    def pendingCount(self) -> int:
+        return len(self.__futures)
+
+    def __onFinished(self, latex: str):
+        future = self.__futures.pop(latex, None)
+        if future is None: return
+        owners = list(self.__owners.pop(latex, ()))
+        try:
+            self.__store(latex, future.result())
+        except BrokenProcessPool:
+            self.__onBroken()
+            self.render(latex)
+        except Exception as e:
+            logger.warning("latex render failed: %r, %s: %s", latex, type(e).__name__, e)
+            self.__failed.add(latex)
+        self.svgReady.emit(latex, owners)
+
+    def __onBroken(self):
+        logger.warning("the process pool of latex is broken, latex is rendered synchronously")
+        LatexRenderer.asynchronous = False
+        self.shutdown()
+
+    def shutdown(self):
+        """ cancel the pending requests and stop the workers """
+        if self.__executor is None: return
+        self.__executor.shutdown(wait=False, cancel_futures=True)
+        self.__executor = None
+        self.__futures.clear()
+        self.__owners.clear()
@@ -0,0 +1,107 @@
+import queue
+import re
+import typing as t
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from .instrumentation import span
+from .markdown_ast import MarkdownAstRoot, MarkdownASTBase
+
+_listMarkerRe = re.compile(r"^([-+*]|\d{1,9}[.)])(\s|$)")
+_codeFenceRe = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+_htmlBlockRe = re.compile(r"^ {0,3}(<!--|<\?|<!\[CDATA\[|<![A-Z]|<(script|pre|style|textarea)(?=[\s>]|$))", re.I)
+
+
+def _htmlCloser(opener: str) -> str:
+    """ the end condition of the html block (type 1 - 5 of commonmark), it may contain blank lines """
+    if opener == "<!--": return "-->"
+    if opener == "<?": return "?>"
+    if opener.upper() == "<![CDATA[": return "]]>"
+    if opener.startswith("<!"): return ">"
+    return "</" + opener[1:].lower() + ">"
+
+
+def blockCloser(line: str) -> t.Optional[t.Callable[[str], bool]]:
+    """
+    the end condition of the block (code fence, block math or html block) which is opened by line, it may contain
+    blank lines. None if line dose not open such a block or the block ends in line
+    """
+    fence = _codeFenceRe.match(line)
+    if fence:
+        mark = fence.group(1)
+        return lambda l, m=mark: l.strip().startswith(m) and set(l.strip()) == {m[0]}
+    if line.strip() == "$$":
+        return lambda l: l.strip() == "$$"
+    html = _htmlBlockRe.match(line)
+    if html:
+        end = _htmlCloser(html.group(1))
+        if end not in line[html.end():].lower():
+            return lambda l, e=end: e in l.lower()
+    return None
+
+
+def isBlockOpen(text: str) -> bool:
+    """ text ends in a code fence, block math or html block which is not closed """
+    closer: t.Optional[t.Callable[[str], bool]] = None
+    for line in text.splitlines(keepends=True):
+        if closer is not None:
+            if closer(line): closer = None
+            continue
+        closer = blockCloser(line)
+    return closer is not None
+
+
+def splitMarkdown(text: str, chunkSize: int, firstChunkSize: int = None) -> t.List[str]:
+    """
+    split the markdown source into chunks, each chunk can be parsed alone and gives the same blocks.
+    a chunk ends with a blank line which is not in a code fence / block math / html block, and the next line
+    is not the continuation of a list, block quote or indented code.
+    :param chunkSize: the min size of chunks
+    :param firstChunkSize: the min size of the first chunk, default is chunkSize
+    """
+    lines = text.splitlines(keepends=True)
+    chunks, start, size = [], 0, 0
+    limit = chunkSize if firstChunkSize is None else firstChunkSize
+    closer: t.Optional[t.Callable[[str], bool]] = None  # 代码块等的结束条件
+    for i, line in enumerate(lines):
+        size += len(line)
+        if closer is not None:
+            if closer(line): closer = None
+            continue
+        closer = blockCloser(line)
+        if closer is None and size >= limit and line.strip() == "" and i + 1 < len(lines):
+            nextLine = lines[i + 1]
+            if nextLine.strip() != "" and nextLine[0] not in " \t>" and not _listMarkerRe.match(nextLine):
+                chunks.append("".join(lines[start:i + 1]))
+                start, size, limit = i + 1, 0, chunkSize
+    chunks.append("".join(lines[start:]))
+    return chunks
+
+
+class MarkdownLoader(QThread):
+    """ parse the chunks of markdown in a worker thread, the blocks are published chunk by chunk """
+    chunkReady = pyqtSignal()
+
+    def __init__(self, root: MarkdownAstRoot, chunks: t.List[str], parent=None):
+        super(MarkdownLoader, self).__init__(parent)
+        self.__root = root
+        self.__chunks = chunks
+        self.__queue: "queue.Queue[t.Tuple[t.List[MarkdownASTBase], int]]" = queue.Queue()
+
+    def run(self) -> None:
+        parser = MarkdownAstRoot.createMarkdownParser()  # mistune 的解析器不在线程间共享
+        for chunk in self.__chunks:
+            if self.isInterruptionRequested(): return
+            with span("parse.chunk", chars=len(chunk)):
+                asts = self.__root.parse(parser(chunk))
+            self.__queue.put((asts, len(chunk)))
+            self.chunkReady.emit()
+
+    def takeChunks(self) -> t.List[t.Tuple[t.List[MarkdownASTBase], int]]:
+        """ take the parsed chunks: (blocks, the length of source) """
+        chunks = []
+        while True:
+            try:
+                chunks.append(self.__queue.get_nowait())
+            except queue.Empty:
+                return chunks
@@ -1,3 +1,5 @@
+import functools
+import sys
 import typing as t
 
 from PyQt5.QtCore import Qt
@@ -9,6 +11,9 @@ from ..style import MarkdownStyle
 
 class MarkdownASTBase():
     __node__ = {}
+    __dictNode__ = {}  # 保留 __dict__ 的节点类, 用于比较内存占用
+    __slotsEnabled = True
+    __slots__ = ("parent", "_markdown", "__weakref__")
 
     # propertys
     children: t.List["MarkdownASTBase"]
@@ -17,23 +22,72 @@ class MarkdownASTBase():
     # ----
     propertys = []
     attrs = []
+    # the default value of attrs, it is collected by registerAst
+    defaults: t.Dict[str, t.Any] = {}
+    # the repeated strings which are interned when parsing
+    internKeys = ("type", "style", "marker", "bullet", "align", "info")
 
     # html tag
     htmlTag: t.Union[str, t.Callable]
 
+    # toMarkdown 的缓存, None 表示需要重新生成
+    _markdown: t.Optional[str]
+
+    def __init__(self):
+        self.parent = None
+        self._markdown = None
+
     @classmethod
     def registerAst(cls, typeStr: str):
-        """登记一个节点"""
+        """登记一个节点, 节点类会按照 propertys 和 attrs 重新生成为 __slots__ 布局"""
 
         def wapper(nodeCls):
-            cls.__node__[typeStr] = nodeCls
-            return nodeCls
+            if "toMarkdown" in nodeCls.__dict__:
+                nodeCls.toMarkdown = cls.cacheMarkdown(nodeCls.__dict__["toMarkdown"])
+            nodeCls.defaults = {a: getattr(nodeCls, a) for a in nodeCls.attrs if hasattr(nodeCls, a)}
+            slotCls = cls.slotted(nodeCls)
+            cls.__dictNode__[typeStr] = nodeCls
+            cls.__node__[typeStr] = slotCls
+            return slotCls
 
         return wapper
 
+    @staticmethod
+    def slotted(nodeCls: t.Type["MarkdownASTBase"]) -> t.Type["MarkdownASTBase"]:
+        """ create the class with the same namespace, the fields of propertys and attrs are stored in __slots__ """
+        fields = tuple(f for f in dict.fromkeys(nodeCls.propertys + nodeCls.attrs)
+                       if f not in MarkdownASTBase.__slots__)
+        namespace = {k: v for k, v in nodeCls.__dict__.items() if k not in fields + ("__dict__", "__weakref__")}
+        namespace["__slots__"] = fields
+        return type(nodeCls)(nodeCls.__name__, nodeCls.__bases__, namespace)
+
+    @classmethod
+    def setSlotsEnabled(cls, enable: bool):
+        """ create the node with __slots__ layout (default) or __dict__ layout, the latter is only for measuring """
+        MarkdownASTBase.__slotsEnabled = enable
+
+    @classmethod
+    def isSlotsEnabled(cls) -> bool:
+        return MarkdownASTBase.__slotsEnabled
+
+    @staticmethod
+    def cacheMarkdown(func: t.Callable[["MarkdownASTBase"], str]) -> t.Callable[["MarkdownASTBase"], str]:
+        """ memoise toMarkdown, the cache is cleared by setDirty """
+
+        @functools.wraps(func)
+        def toMarkdown(self: "MarkdownASTBase") -> str:
+            markdown = self._markdown
+            if markdown is None:
+                markdown = self._markdown = func(self)
+            return markdown
+
+        return toMarkdown
+
     @classmethod
     def createAstFrom(cls, typing: str) -> 'MarkdownASTBase':
         assert typing in cls.__node__, f"the type <{typing}> is not in {[k for k in cls.__node__.keys()]}"
+        if not MarkdownASTBase.__slotsEnabled:
+            return cls.__dictNode__[typing]()
         return cls.__node__[typing]()
 
     @classmethod
@@ -57,6 +111,7 @@ class MarkdownASTBase():
             setattr(new_copy, a, getattr(self, a))
         # parent
         setattr(new_copy, "parent", self.parent)
+        new_copy._markdown = self._markdown
         return new_copy
 
     def parseFromAST(self, ast: dict):
@@ -71,17 +126,18 @@ class MarkdownASTBase():
                     children.append(sub_ast)
                 self.children = children
             else:
-                setattr(self, p, ast.pop(p))
+                setattr(self, p, self.__intern(p, ast.pop(p)))
 
         # attr
         if len(self.attrs) != 0:
             attrs = ast.pop("attrs", {})
             for a in self.attrs:
                 try:
-                    setattr(self, a, attrs.pop(a))
+                    setattr(self, a, self.__intern(a, attrs.pop(a)))
                 except KeyError as e:
-                    if not hasattr(self, a):
+                    if a not in self.defaults:
                         raise Exception(f"{type(self)}:属性<{a}>没有默认参数, 必须设置")
+                    setattr(self, a, self.defaults[a])
                 except Exception as e:
                     raise e
 
@@ -90,6 +146,19 @@ class MarkdownASTBase():
             assert "attrs" not in ast, f"{self} has attrs: {[(key, ast['attrs'][key]) for key in ast['attrs'].keys()]}"
 
         assert len(ast) == 0, f"{self} 解析未完成,{[key for key in ast.keys()]}"
+        self.setDirty()
+
+    def __intern(self, key: str, value: t.Any) -> t.Any:
+        """ intern the repeated strings, for example: type, marker, bullet """
+        if isinstance(value, str) and key in self.internKeys:
+            return sys.intern(value)
+        return value
+
+    def setDirty(self, child: "MarkdownASTBase" = None):
+        """ the markdown source of the ast (or its child) is changed, clear the cache of it and its parents """
+        self._markdown = None
+        if self.parent is not None:
+            self.parent.setDirty(child=self)
 
     def summary(self) -> t.List[str]:
         my_str = self.toStr()
@@ -155,9 +224,14 @@ class MarkdownASTBase():
         raise Exception
         return False
 
+    def index(self, ast: 'MarkdownASTBase') -> int:
+        """ the index of children """
+        return self.children.index(ast)
+
     def appChildren(self, child: 'MarkdownASTBase'):
         assert hasattr(self, "children"), "the ast node has not children"
         self.children.append(child)
+        self.setDirty()
 
     def render(self, ht: AbstructCachePaint, style: MarkdownStyle, cursor: AbstructCursor = None):
         raise NotImplementedError(self)
@@ -172,7 +246,7 @@ class MarkdownASTBase():
     def upAst(self):
         """ an ast in the up of the ast """
         assert self.parent is not None, "The ast is a root ast, and it dose not have up ast or down ast"
-        idx = self.parent.children.index(self)
+        idx = self.parent.index(self)
         if idx == 0:
             return None
         return self.parent.children[idx - 1]
@@ -180,7 +254,7 @@ class MarkdownASTBase():
     def downAst(self):
         """ an ast in the down of the ast """
         assert self.parent is not None, "The ast is a root ast, and it dose not have up ast or down ast"
-        idx = self.parent.children.index(self)
+        idx = self.parent.index(self)
         if idx + 1 >= len(self.parent.children):
             return None
         return self.parent.children[idx + 1]
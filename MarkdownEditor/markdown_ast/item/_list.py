@@ -1,10 +1,9 @@
 import typing as t
 
-from PyQt5.QtGui import QFontMetrics
-
 from ..base import MarkdownASTBase
 from ...abstruct import AbstructCursor, AbstructCachePaint, BlockLayer
 from ...abstruct import AbstructTextParagraph as ATP
+from ...font_metrics import FontMetricsCache
 from ...style import MarkdownStyle
 
 
@@ -74,7 +73,7 @@ class List(MarkdownASTBase):
             with ht.newSubParagraph() as sub_ph:
                 layer.addItem(sub_ph)
                 order_string = "    " * self.depth + (rf"{i + 1}. " if self.ordered else "- ")
-                sub_ph.setIndentation(indentation=QFontMetrics(font).width(" " * 3 * min(self.depth, 0) + f"{i + 1}."))
+                sub_ph.setIndentation(indentation=FontMetricsCache.width(font, " " * 3 * min(self.depth, 0) + f"{i + 1}."))
                 ht.renderContent(func=ATP.Render_SerialNumber, data=i + 1, ast=self)
                 ht.renderContent(func=ATP.Render_HideText, data=order_string, ast=self)
                 c.render(ht, style=style, cursor=cursor)
@@ -26,7 +26,7 @@ class BlockMath(MarkdownASTBase):
             ph.setBackgroundMargins(*style.hintBackgroundMargins(ast="block_math"))
             ph.setIndentation(indentation=style.hintIndentation(ast="block_math"))
             ph.setBackgroundColor(color=style.hintBackgroundColor(ast="block_math"))
-            ph.setBackgroundRadius(radius=style.hintBackgroundRadius(ast="block_math"))
+            ph.setBackgroundRadius(radius=style.hintBorderRadius(ast="block_math"))
             # $$\n
             # self.raw + \n
             # $$\n
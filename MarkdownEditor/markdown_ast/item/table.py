@@ -14,11 +14,7 @@ class Table(MarkdownASTBase):
     propertys = ["type", "children"]
 
     def toMarkdown(self) -> str:
-        raw = ''.join(c.toMarkdown() for c in self.children)
-        if raw == self.url:  # <url>
-            return rf'<' + f'{self.url}' + '>'
-        else:
-            return rf'[{raw}]({self.url})'
+        return ''.join(c.toMarkdown() for c in self.children)
 
     def render(self, ht: AbstructCachePaint, style: MarkdownStyle, cursor: AbstructCursor = None):
         isShowHide = False if cursor is None else cursor.isIn(ast=self)
@@ -42,10 +38,10 @@ class TableHead(MarkdownASTBase):
 
     def toMarkdown(self) -> str:
         raw = ' | '.join(c.toMarkdown() for c in self.children)
-        if raw == self.url:  # <url>
-            return rf'<' + f'{self.url}' + '>'
-        else:
-            return rf'[{raw}]({self.url})'
+        # 分隔行, 对齐方式 left / center / right
+        delimiters = ' | '.join({"left": ":---", "center": ":---:", "right": "---:"}.get(c.align, "---")
+                                for c in self.children)
+        return f'| {raw} |\n| {delimiters} |\n'
 
     def render(self, ht: AbstructCachePaint, style: MarkdownStyle, cursor: AbstructCursor = None):
         isShowHide = False if cursor is None else cursor.isIn(ast=self)
@@ -78,11 +74,7 @@ class TableBody(MarkdownASTBase):
     propertys = ["type", "children"]
 
     def toMarkdown(self) -> str:
-        raw = ''.join(c.toMarkdown() for c in self.children)
-        if raw == self.url:  # <url>
-            return rf'<' + f'{self.url}' + '>'
-        else:
-            return rf'[{raw}]({self.url})'
+        return ''.join(c.toMarkdown() for c in self.children)
 
     def render(self, ht: AbstructCachePaint, style: MarkdownStyle, cursor: AbstructCursor = None):
         isShowHide = False if cursor is None else cursor.isIn(ast=self)
@@ -109,11 +101,8 @@ class TableRow(MarkdownASTBase):
     propertys = ["type", "children"]
 
     def toMarkdown(self) -> str:
-        raw = ''.join(c.toMarkdown() for c in self.children)
-        if raw == self.url:  # <url>
-            return rf'<' + f'{self.url}' + '>'
-        else:
-            return rf'[{raw}]({self.url})'
+        raw = ' | '.join(c.toMarkdown() for c in self.children)
+        return f'| {raw} |\n'
 
     def render(self, ht: AbstructCachePaint, style: MarkdownStyle, cursor: AbstructCursor = None):
         isShowHide = False if cursor is None else cursor.isIn(ast=self)
@@ -1,27 +1,98 @@
 import typing as t
 
-import mistune
-from mistune.plugins.math import math
-from mistune.plugins.table import table
-
 from .base import MarkdownASTBase
-from ..style import MarkdownStyle
 from ..abstruct import AbstructCursor, AbstructCachePaint
+from ..fenwick import FenwickTree
+from ..instrumentation import span
+from ..style import MarkdownStyle
 
 
 class MarkdownAstRoot(MarkdownASTBase):
+    __markdownParser: t.Callable[[str], t.List[dict]] = None  # mistune.Markdown
+
+    @classmethod
+    def markdownParser(cls) -> t.Callable[[str], t.List[dict]]:
+        """ the mistune parser, it is created once and shared by all parses in the gui thread """
+        if MarkdownAstRoot.__markdownParser is None:
+            MarkdownAstRoot.__markdownParser = cls.createMarkdownParser()
+        return MarkdownAstRoot.__markdownParser
+
+    @classmethod
+    def createMarkdownParser(cls) -> t.Callable[[str], t.List[dict]]:
+        """ create a new mistune parser, a worker thread should use its own parser """
+        import mistune  # <-- 第一次解析时才导入 mistune 和插件
+        from mistune.plugins.math import math
+        from mistune.plugins.table import table
+        return mistune.create_markdown(renderer="ast", plugins=[math, table])
+
     def __init__(self):
+        super(MarkdownAstRoot, self).__init__()
         self._text: str = ""
+        self.children: t.List[MarkdownASTBase] = []
+        # block index: the index of children and a fenwick tree of the source length of children
+        self.__positions: t.Optional[t.Dict[MarkdownASTBase, int]] = None
+        self.__lengths: t.Optional[FenwickTree] = None
+        # the functions which are called after children[start:end] is replaced by count asts
+        self.__childrenChangedFuncs: t.List[t.Callable[[int, int, int], None]] = []
+
+    def connectChildrenChanged(self, func: t.Callable[[int, int, int], None]):
+        """ func(start, end, count) is called after children[start:end] is replaced by count asts """
+        self.__childrenChangedFuncs.append(func)
+
+    def disconnectChildrenChanged(self, func: t.Callable[[int, int, int], None]):
+        self.__childrenChangedFuncs.remove(func)
+
+    def __childrenChanged(self, start: int, end: int, count: int):
+        for func in self.__childrenChangedFuncs:
+            func(start, end, count)
 
     def setText(self, text: str):
         self._text = text
-
-        # 创建一个 Markdown 解析器
-        # markdown = mistune.create_markdown(renderer="ast")
-        markdown = mistune.create_markdown(renderer="ast", plugins=[math,table])
         # 解析 Markdown 并获取 AST
-        ast = markdown(text)
-        self.children = self.parse(ast)
+        with span("parse", chars=len(text)):
+            ast = self.markdownParser()(text)
+            old = len(self.children)
+            self.children = self.parse(ast)
+        self.__positions, self.__lengths = None, None
+        self.__childrenChanged(0, old, len(self.children))
+
+    def reparse(self, start: int, end: int, markdown: str) -> t.Tuple[t.List[MarkdownASTBase], int]:
+        """
+        incremental reparse, replace the source of children[start:end] by markdown
+        :param start: the first block which is edited
+        :param end: the end (exclusive) of the edited blocks
+        :param markdown: the new source of the edited blocks
+        :return: the new asts (unchanged blocks are kept by identity), the offset of markdown in the new asts
+        """
+        from ..loader import isBlockOpen  # <-- loader 依赖 markdown_ast
+        up, down = 1, 1  # 上下文 block 的数量
+        while True:
+            s, e = max(start - up, 0), min(end + down, len(self.children))
+            head = [c.toMarkdown() for c in self.children[s:start]]
+            tail = [c.toMarkdown() for c in self.children[end:e]]
+            text = "".join(head) + markdown + "".join(tail)
+            with span("reparse", blocks=e - s):
+                asts = self.parse(self.markdownParser()(text))
+            # 最外侧的上下文 block 解析结果不变, 说明边界稳定
+            # 否则 (例如: 打开了代码块) 继续扩大重新分析的范围
+            # 没有闭合的代码块 / 公式 / html 会吞掉窗口后面的 block, 即使最后的 block 没有变化
+            upStable = s == 0 or (len(asts) != 0 and asts[0].toMarkdown() == head[0])
+            downStable = e == len(self.children) or (
+                    len(asts) != 0 and asts[-1].toMarkdown() == tail[-1] and not isBlockOpen(text))
+            if upStable and downStable:
+                break
+            up, down = up if upStable else up * 2, down if downStable else down * 2
+
+        # 保留没有变化的 block, 这样 ast 对应的 ContentItem 可以继续使用
+        i = 0
+        while i < len(head) and i < len(asts) and asts[i].toMarkdown() == head[i]:
+            i += 1
+        j = 0
+        while j < len(tail) and j < len(asts) - i and asts[-1 - j].toMarkdown() == tail[-1 - j]:
+            j += 1
+        asts = asts[i:len(asts) - j]
+        self.swap(old=(s + i, e - j), new=asts)
+        return asts, sum(len(h) for h in head[i:])
 
     def parse(self, ast) -> t.List[MarkdownASTBase]:
         children = []
@@ -47,15 +118,46 @@ class MarkdownAstRoot(MarkdownASTBase):
     def swap(self, old: t.Union[MarkdownASTBase, t.Tuple[int, int]], new: t.Iterable[MarkdownASTBase]):
         """ 替换"""
         # set parent
+        new = list(new)
         for ast in new: ast.parent = self
 
         # start and end
         if isinstance(old, MarkdownASTBase):
-            idx = self.children.index(old)
+            idx = self.index(old)
             s, e = idx, idx
         elif isinstance(old, tuple) and len(old) == 2:
             s, e = old
-        self.children[s:e] = list(new)
+        self.__splice(s, e, new)
+
+    def __splice(self, s: int, e: int, new: t.List[MarkdownASTBase]):
+        """ children[s:e] = new, the block index is updated incrementally (only the blocks after s) """
+        positions, lengths = self.__positions, self.__lengths
+        if positions is not None:
+            for ast in self.children[s:e]: positions.pop(ast, None)
+        self.children[s:e] = new
+        if positions is not None:
+            if e - s == len(new):
+                # block 数量不变, 只更新新的 block
+                for i, ast in enumerate(new, s):
+                    positions[ast] = i
+                    lengths.setValue(i, len(ast.toMarkdown()))
+            else:
+                # 后面的 block 重新编号, 长度只重建 s 之后的部分
+                for i in range(s, len(self.children)):
+                    positions[self.children[i]] = i
+                lengths.splice(s, e, [len(ast.toMarkdown()) for ast in new])
+        self.__childrenChanged(s, e, len(new))
+
+    def append(self, asts: t.Iterable[MarkdownASTBase]):
+        """ append the asts to the end of children, the block index is updated incrementally """
+        start = len(self.children)
+        for ast in asts:
+            ast.parent = self
+            if self.__positions is not None:
+                self.__positions[ast] = len(self.children)
+                self.__lengths.append(len(ast.toMarkdown()))
+            self.children.append(ast)
+        self.__childrenChanged(start, start, len(self.children) - start)
 
     def insert(self, ast: t.Union[MarkdownASTBase, str], idx: int) -> MarkdownASTBase:
         """ 插入 """
@@ -67,7 +169,7 @@ class MarkdownAstRoot(MarkdownASTBase):
                 ast_dict = {"type": "paragraph", "children": [{"type": "text", "raw": ""}]}
             item.parseFromAST(ast_dict)
             item.parent = self
-            self.children.insert(idx, item)
+            self.__splice(idx, idx, [item])
         return item
 
     def summary(self):
@@ -80,8 +182,7 @@ class MarkdownAstRoot(MarkdownASTBase):
         html = "".join([c.toHtml() for c in self.children])
 
         # 解析 Markdown 并获取 HTML
-        md = mistune.create_markdown(renderer="html")
-        # html = md(self._text)
+        # html = mistune.create_markdown(renderer="html")(self._text)
         if html[-1] == "\n":
             html = html[:-1]
         return html
@@ -89,12 +190,75 @@ class MarkdownAstRoot(MarkdownASTBase):
     def toMarkdown(self) -> str:
         return "".join([c.toMarkdown() for c in self.children])
 
+    def setDirty(self, child: MarkdownASTBase = None):
+        """ the source of a child is changed, update the block index """
+        if child is not None and self.__positions is not None and child in self.__positions:
+            self.__lengths.setValue(self.__positions[child], len(child.toMarkdown()))
+
+    def __blockIndex(self) -> t.Tuple[t.Dict[MarkdownASTBase, int], FenwickTree]:
+        """ the block index, it is rebuilt lazily after the number of children changed """
+        if self.__positions is None:
+            self.__positions = {ast: i for i, ast in enumerate(self.children)}
+            self.__lengths = FenwickTree(len(ast.toMarkdown()) for ast in self.children)
+        return self.__positions, self.__lengths
+
     def index(self, ast: MarkdownASTBase) -> int:
-        """ the index of children """
-        return self.children.index(ast)
+        """ the index of children, O(1) """
+        idx = self.__blockIndex()[0].get(ast, None)
+        if idx is None:
+            raise ValueError(f"{ast} is not in children")
+        return idx
 
     def astOf(self, idx: int) -> MarkdownASTBase:
         """ the child ast of children in idx """
         return self.children[idx]
 
+    def offsetOf(self, ast: MarkdownASTBase) -> int:
+        """ the offset of the child ast in the markdown source, O(log n) """
+        return self.__blockIndex()[1].prefixSum(self.index(ast))
+
+    def astAt(self, offset: int) -> t.Tuple[MarkdownASTBase, int]:
+        """ the child ast and the pos in it of the offset in the markdown source, O(log n) """
+        lengths = self.__blockIndex()[1]
+        idx = min(lengths.search(max(offset, 0)), len(self.children) - 1)
+        return self.children[idx], offset - lengths.prefixSum(idx)
+
+    def length(self) -> int:
+        """ the length of the markdown source """
+        return self.__blockIndex()[1].total()
+
 # markdownAstRoot
+
+if __name__ == "__main__":
+    # python -m MarkdownEditor.markdown_ast.root: the blocks of reparse are the same as a full parse of the source
+    import random
+
+    def blocks(root: MarkdownAstRoot) -> t.List[t.Tuple[str, str]]:
+        return [(type(c).__name__, c.toMarkdown()) for c in root.children]
+
+    def check(text: str, start: int, end: int, markdown: str):
+        root = MarkdownAstRoot()
+        root.setText(text)
+        source = "".join(c.toMarkdown() for c in root.children[:start]) + markdown + \
+                 "".join(c.toMarkdown() for c in root.children[end:])
+        root.reparse(start, end, markdown)
+        full = MarkdownAstRoot()
+        full.setText(source)
+        assert blocks(root) == blocks(full), (text, start, end, markdown, blocks(root), blocks(full))
+
+    # 打开的公式块的结束符在窗口之外
+    check("$$\nt=t+1\n$$\n\npara one\n\npara two\n\n$$\nx\n$$\n\nend\n", 0, 1, "$$\nt=t+1\na$$\n")
+    pieces = ["para {}\n", "\n", "$$\nx={}\n$$\n", "```\ncode {}\n```\n", "<!--\nnote {}\n-->\n", "# title {}\n"]
+    tokens = ["$$\n", "a$$", "```\n", "<!--\n", "-->", "x", "\n", "\n\n"]
+    rnd = random.Random(0)
+    for n in range(500):
+        root = MarkdownAstRoot()
+        root.setText("".join(rnd.choice(pieces).format(i) for i in range(rnd.randint(1, 16))))
+        text = root.toMarkdown()  # <-- 从 block 的源码开始, 这样未编辑的 block 与 source 一致
+        root.setText(text)
+        start = rnd.randrange(len(root.children))
+        end = min(start + rnd.randint(1, 2), len(root.children))
+        markdown = "".join(c.toMarkdown() for c in root.children[start:end])
+        pos = rnd.randint(0, len(markdown))
+        check(text, start, end, markdown[:pos] + rnd.choice(tokens) + markdown[pos:])
+    print("ok")
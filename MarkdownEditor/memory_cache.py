@@ -0,0 +1,104 @@
+import typing as t
+import weakref
+from collections import OrderedDict
+
+
+class MemoryCache():
+    """
+    an LRU cache bounded by the approximate bytes of values (cost), the least recently used values are evicted
+    when the size exceeds maxBytes.
+    the value can be tagged with owners (for example: the root of document), dropOwner removes the values which are
+    only used by the owner. the owners are weak references.
+    """
+
+    def __init__(self, maxBytes: int, cost: t.Callable[[t.Any], int]):
+        self.__maxBytes = maxBytes
+        self.__cost = cost
+        self.__items: t.Dict[t.Hashable, t.Any] = OrderedDict()
+        self.__costs: t.Dict[t.Hashable, int] = {}
+        self.__owners: t.Dict[t.Hashable, weakref.WeakSet] = {}
+        self.__size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def maxBytes(self) -> int:
+        return self.__maxBytes
+
+    def setMaxBytes(self, maxBytes: int):
+        self.__maxBytes = maxBytes
+        self.__evict()
+
+    def size(self) -> int:
+        """ the approximate bytes of all values """
+        return self.__size
+
+    def __len__(self) -> int:
+        return len(self.__items)
+
+    def __contains__(self, key: t.Hashable) -> bool:
+        return key in self.__items
+
+    def get(self, key: t.Hashable, default: t.Any = None) -> t.Any:
+        if key not in self.__items:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.__items.move_to_end(key)
+        return self.__items[key]
+
+    def put(self, key: t.Hashable, value: t.Any, owner: t.Any = None, cost: int = None) -> t.Any:
+        """
+        add the value, the new value is never evicted by itself even if it is larger than maxBytes
+        :param cost: the bytes of value, it is estimated by the cost function of cache if it is None
+        """
+        self.pop(key)
+        cost = self.__cost(value) if cost is None else cost
+        self.__items[key] = value
+        self.__costs[key] = cost
+        self.__size += cost
+        if owner is not None:
+            self.addOwner(key, owner)
+        self.__evict(keep=key)
+        return value
+
+    def pop(self, key: t.Hashable, default: t.Any = None) -> t.Any:
+        if key not in self.__items: return default
+        self.__size -= self.__costs.pop(key)
+        self.__owners.pop(key, None)
+        return self.__items.pop(key)
+
+    def addOwner(self, key: t.Hashable, owner: t.Any):
+        """ tag the value with owner """
+        if key in self.__items:
+            self.__owners.setdefault(key, weakref.WeakSet()).add(owner)
+
+    def dropOwner(self, owner: t.Any) -> int:
+        """ remove the values which are only used by owner, return the number of removed values """
+        keys = []
+        for key, owners in self.__owners.items():
+            if owner in owners:
+                owners.discard(owner)
+                if len(owners) == 0:
+                    keys.append(key)
+        for key in keys:
+            self.pop(key)
+        return len(keys)
+
+    def clear(self):
+        self.__items.clear()
+        self.__costs.clear()
+        self.__owners.clear()
+        self.__size = 0
+
+    def cacheInfo(self) -> t.Dict[str, int]:
+        """ hits, misses, evictions, the number and the bytes of values """
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "count": len(self.__items), "bytes": self.__size, "maxBytes": self.__maxBytes}
+
+    def __evict(self, keep: t.Hashable = None):
+        for key in list(self.__items.keys()):
+            if self.__size <= self.__maxBytes: break
+            if key == keep: continue
+            self.pop(key)
+            self.evictions += 1
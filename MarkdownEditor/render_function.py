@@ -1,24 +1,31 @@
 import io
-import os
 import re
 import typing as t
 
-import matplotlib.font_manager as mfm
 from PyQt5.QtCore import QPointF
-from PyQt5.QtCore import Qt, QByteArray, QRectF, QSizeF
-from PyQt5.QtGui import QPainter, QFontMetrics, QImage, QColor
+from PyQt5.QtCore import Qt, QByteArray, QRectF, QSize, QSizeF
+from PyQt5.QtGui import QPainter, QColor, QPixmap
 from PyQt5.QtSvg import QSvgRenderer
-from matplotlib.mathtext import MathTextParser
 
 from .abstruct import BlockLayer
 from .component import TextParagraph
+from .font_metrics import FontMetricsCache
+from .image_loader import ImageLoader
+from .latex import LatexColor, LatexRenderer
 # from .cursor import MarkdownCursor
 from .markdown_ast import MarkdownASTBase
+from .memory_cache import MemoryCache
+from .text_engine import TextEngine
 
 
 class ImageRender():
-    latexPool = {}
-    imagePool = {}
+    """ the pools are LRU caches bounded by bytes, the values are tagged with the root of document which uses them """
+    latexPool = LatexRenderer.svgPool
+    imagePool = ImageLoader.pixmapPool
+    # 解析后的 svg 和不同尺寸的位图, 重新排版时直接绘制位图
+    latexRendererPool = MemoryCache(maxBytes=8 << 20, cost=lambda renderer: 0)  # latex -> QSvgRenderer
+    latexPixmapPool = MemoryCache(maxBytes=64 << 20, cost=lambda pixmap: pixmap.width() * pixmap.height() * 4)
+    __latexProbeHeight: t.Optional[float] = None  # the height of 'j', it is the baseline of inline latex
 
     @staticmethod
     def isURL(link):
@@ -26,68 +33,85 @@ class ImageRender():
         url_pattern = re.compile(r'^(http|https)://')
         return bool(url_pattern.match(link))
 
+    @staticmethod
+    def documentOf(ast: MarkdownASTBase) -> t.Any:
+        """ the root of ast """
+        while getattr(ast, "parent", None) is not None:
+            ast = ast.parent
+        return ast
+
+    @classmethod
+    def dropDocument(cls, root: t.Any):
+        """ the document is closed, drop the svgs and images which are only used by it """
+        cls.latexPool.dropOwner(root)
+        cls.imagePool.dropOwner(root)
+        cls.latexRendererPool.dropOwner(root)
+        cls.latexPixmapPool.dropOwner(root)
+
     @classmethod
-    def math_to_image(cls, s, filename_or_obj, prop=None, dpi=None, format=None, *, color=None):
-        """
-        Given a math expression, renders it in a closely-clipped bounding
-        box to an image file.
-
-        Parameters
-        ----------
-        s : str
-            A math expression.  The math portion must be enclosed in dollar signs.
-        filename_or_obj : str or path-like or file-like
-            Where to write the image data.
-        prop : `.FontProperties`, optional
-            The size and style of the text.
-        dpi : float, optional
-            The output dpi.  If not set, the dpi is determined as for
-            `.Figure.savefig`.
-        format : str, optional
-            The output format, e.g., 'svg', 'pdf', 'ps' or 'png'.  If not set, the
-            format is determined as for `.Figure.savefig`.
-        color : str, optional
-            Foreground color, defaults to :rc:`text.color`.
-        """
-        from matplotlib import figure
-
-        parser = MathTextParser('path')
-        width, height, depth, _, _ = parser.parse(s, dpi=72, prop=prop)
-        fig = figure.Figure(figsize=(width / 72.0, height / 72.0))
-        fig.text(0, depth / height, s, fontproperties=prop, color=color)
-        fig.savefig(filename_or_obj, dpi=dpi, format=format)
-
-        return depth
+    def cacheInfo(cls) -> t.Dict[str, t.Dict[str, int]]:
+        return {"latex": cls.latexPool.cacheInfo(), "image": cls.imagePool.cacheInfo(),
+                "latexRenderer": cls.latexRendererPool.cacheInfo(), "latexPixmap": cls.latexPixmapPool.cacheInfo()}
 
     @classmethod
     def renderLatexSvg(cls, latex: str) -> io.BytesIO:
-        if latex not in cls.latexPool:
-            prop = mfm.FontProperties(math_fontfamily='stix', size=64, weight='bold')
-            bfo = io.BytesIO()
-            try:
-                cls.math_to_image(rf"${latex}$", bfo, prop=prop, dpi=72, format="svg")
-            except Exception as e:
-                print(type(e))
-                string = str(e)
-                for excetion in ["ParseSyntaxException:", "ParseFatalException", "ParseException"]:
-                    if excetion in string:
-                        cls.math_to_image(rf"Latex Error: {latex}", bfo, prop=prop, dpi=72, format="svg", color="r")
-                        break
-                else:
-                    raise e
-            bfo.seek(0)  # 重置指针
-            cls.latexPool[latex] = bfo
-        return cls.latexPool[latex]
+        """ render latex synchronously """
+        return LatexRenderer.instance().render(latex)
+
+    @classmethod
+    def requestLatexSvg(cls, latex: str, owner: t.Any) -> t.Optional[io.BytesIO]:
+        """ the svg of latex, None if it is being rendered in the process pool (the owner is re-rendered after it) """
+        svg = LatexRenderer.instance().request(latex, owner=owner)
+        if svg is not None and owner is not None:
+            cls.latexPool.addOwner(latex, cls.documentOf(owner))
+        return svg
+
+    @classmethod
+    def latexSvgRenderer(cls, latex: str, svg: io.BytesIO, owner: t.Any = None) -> QSvgRenderer:
+        """ the parsed svg of latex """
+        renderer = cls.latexRendererPool.get(latex)
+        if renderer is None:
+            data = svg.getvalue()
+            renderer = cls.latexRendererPool.put(latex, QSvgRenderer(QByteArray(data)), cost=len(data) * 4)
+        if owner is not None:
+            cls.latexRendererPool.addOwner(latex, cls.documentOf(owner))
+        return renderer
+
+    @classmethod
+    def latexPixmap(cls, latex: str, renderer: QSvgRenderer, size: QSizeF, dpr: float,
+                    owner: t.Any = None) -> QPixmap:
+        """ the svg rasterised in size (logical pixels) """
+        key = (latex, round(size.height(), 2), dpr, LatexColor)
+        pixmap = cls.latexPixmapPool.get(key)
+        if pixmap is None:
+            pixmap = QPixmap(QSize(int(size.width() * dpr + 0.999), int(size.height() * dpr + 0.999)))
+            pixmap.setDevicePixelRatio(dpr)
+            pixmap.fill(QColor(0, 0, 0, 0))
+            painter = QPainter(pixmap)
+            renderer.render(painter, QRectF(QPointF(0, 0), size))
+            painter.end()
+            cls.latexPixmapPool.put(key, pixmap)
+        if owner is not None:
+            cls.latexPixmapPool.addOwner(key, cls.documentOf(owner))
+        return pixmap
 
     @classmethod
-    def renderImage(cls, url: str) -> QImage:
-        if url not in cls.imagePool:
-            # 如果不存在
-            if os.path.exists(url):
-                cls.imagePool[url] = QImage(url)
-            else:
-                cls.imagePool[url] = None
-        return cls.imagePool[url]
+    def latexProbeHeight(cls, owner: t.Any = None) -> t.Optional[float]:
+        """ the height of 'j', None if it is being rendered """
+        if cls.__latexProbeHeight is None:
+            j = cls.requestLatexSvg(latex='j', owner=owner)
+            if j is not None:
+                cls.__latexProbeHeight = cls.latexSvgRenderer('j', j).defaultSize().height()
+        return cls.__latexProbeHeight
+
+    @classmethod
+    def requestImage(cls, url: str, width: int, dpr: float, owner: t.Any) -> t.Optional[QPixmap]:
+        """ the image in width, None if it is being decoded in the thread pool (the owner is re-rendered after it) """
+        loader = ImageLoader.instance()
+        pixmap = loader.request(url, width=width, dpr=dpr, owner=owner)
+        if pixmap is not None and owner is not None:
+            cls.imagePool.addOwner(loader.key(url, width, dpr), cls.documentOf(owner))
+        return pixmap
 
 
 @TextParagraph.registerRenderFunction(TextParagraph.Render_BlankLine)
@@ -101,20 +125,19 @@ def renderBlankLine(tp: TextParagraph, data: t.Any, ast: MarkdownASTBase, painte
 @TextParagraph.registerRenderFunction(TextParagraph.Render_SoftBreak)
 def renderSoftBreak(tp: TextParagraph, data: t.Any, ast: MarkdownASTBase, painter: QPainter):
     """ render a softbreak (='\n')"""
-    fm = QFontMetrics(painter.font())
     tp.addCursorBase(tp.paintPoint() + QPointF(0, 0))
     # paint pos
     pos = QPointF(tp.margins().left() + tp.indentation(),
-                  tp.paintPoint().y() + fm.height() + tp.inPragraphReutrnSpace())
+                  tp.paintPoint().y() + FontMetricsCache.height(painter.font()) + tp.inPragraphReutrnSpace())
     tp.setPaintPoint(pos)
 
 
 @TextParagraph.registerRenderFunction(TextParagraph.Render_HardBreak)
 def renderHardBreak(tp: TextParagraph, data: t.Any, ast: MarkdownASTBase, painter: QPainter):
-    fm = QFontMetrics(painter.font())
     tp.addCursorBase(tp.paintPoint() + QPointF(0, 0))
     # paint pos
-    pos = QPointF(tp.margins().left(), tp.paintPoint().y() + fm.height() + tp.outPragraphReutrnSpace())
+    pos = QPointF(tp.margins().left(),
+                  tp.paintPoint().y() + FontMetricsCache.height(painter.font()) + tp.outPragraphReutrnSpace())
     tp.setPaintPoint(pos)
 
 
@@ -128,30 +151,20 @@ def renderText(tp: TextParagraph, data: t.Any, ast: MarkdownASTBase, painter: QP
     :param haveBreak: It is have break symbol in data
     :return:
     """
-    # 使用 QFontMetrics 计算文本的尺寸
-    fm, text = painter.fontMetrics(), data
-    rep = QPointF(0, tp.lineHeight() - fm.descent())
-    for char in text:
-
-        char_width = fm.width(char)  # 获取文本宽度,高度
-        tp.addCursorBase(tp.paintPoint() + QPointF(0, 0))
-        # return line
-        # 换行功能需要手动实现
-        if tp.paintPoint().x() + char_width > tp.viewWdith() - tp.margins().right() or char == "\n":
-            tp.setPaintPoint(QPointF(tp.margins().left() + tp.indentation(),
-                                     tp.paintPoint().y() + tp.lineHeight() + tp.inPragraphReutrnSpace()))
-        painter.drawText(tp.paintPoint() + rep, char)
-        # pos transfome
-        tp.setPaintPoint(tp.paintPoint() + QPointF(char_width, 0))
+    # 整段排版, 每一行的 glyph run 绘制一次
+    shaped = TextEngine.shape(text=data, font=painter.font(), device=painter.device(), start=tp.paintPoint(),
+                              lineStart=tp.margins().left() + tp.indentation(),
+                              right=tp.viewWdith() - tp.margins().right(),
+                              lineHeight=tp.lineHeight(), lineSpace=tp.inPragraphReutrnSpace())
+    tp.addCursorBase(shaped.cursorBases)
+    tp.addGlyphRuns(shaped.glyphRuns, pen=painter.pen())
+    tp.setPaintPoint(shaped.end)
 
 
 @TextParagraph.registerRenderFunction(TextParagraph.Render_HideText)
 def renderHideText(tp: TextParagraph, data: t.Any, ast: MarkdownASTBase, painter: QPainter):
     """" 绘制隐藏的文本 """
-    fm, text = QFontMetrics(painter.font()), data
-    t = QPointF(0, 0)
-    for char in text:
-        tp.addCursorBase(tp.paintPoint() + t)
+    tp.addCursorBase([tp.paintPoint()] * len(data))
 
 
 @TextParagraph.registerRenderFunction(TextParagraph.Render_SerialNumber)
@@ -160,29 +173,47 @@ def renderSerialNumber(tp: TextParagraph, data: t.Union[int, str], ast: Markdown
     # 在边距外绘制
     _p_pos = tp.paintPoint()
     if isinstance(data, int):
-        text = f"{data}."
-        fm = QFontMetrics(painter.font())
-        painter.drawText(tp.paintPoint() + QPointF(-fm.width(text), tp.lineHeight() - fm.descent()), text)
+        text, font = f"{data}.", painter.font()
+        painter.drawText(tp.paintPoint() + QPointF(-FontMetricsCache.width(font, text),
+                                                   tp.lineHeight() - FontMetricsCache.descent(font)), text)
+
+
+def renderPlaceholder(painter: QPainter, rect: QRectF):
+    """ the placeholder of latex or image which is being rendered """
+    painter.save()
+    painter.setPen(Qt.NoPen)
+    painter.setBrush(QColor(125, 125, 125, 40))
+    painter.drawRoundedRect(rect, 5, 5)
+    painter.restore()
 
 
 @TextParagraph.registerRenderFunction(TextParagraph.Render_BlockLatexImage)
 def renderBlockLatexImage(tp: TextParagraph, data: str, ast: MarkdownASTBase, painter: QPainter):
     """" 绘制latex """
-    svgRender = QSvgRenderer(QByteArray(ImageRender.renderLatexSvg(latex=data).getvalue()))
+    svg = ImageRender.requestLatexSvg(latex=data, owner=tp.ast())
 
     # 如果不是在边距上,另开一行渲染
     if tp.margins().left() != tp.paintPoint().x():
         tp.setPaintPoint(QPointF(float(tp.margins().left()),
                                  float(tp.paintPoint().y() + tp.lineHeight() + tp.inPragraphReutrnSpace())))
     # reszie
-    svgSize = svgRender.defaultSize()
+    if svg is None:  # <-- 正在渲染, 先绘制占位
+        width = tp.viewWdith() - tp.margins().left() - tp.margins().right()
+        svgRender, svgSize = None, QSizeF(min(FontMetricsCache.width(painter.font(), data), width), tp.lineHeight() * 2)
+    else:
+        svgRender = ImageRender.latexSvgRenderer(data, svg, owner=tp.ast())
+        svgSize = QSizeF(svgRender.defaultSize())
 
-    rect = QRectF(tp.paintPoint(), QSizeF(svgSize))
+    rect = QRectF(tp.paintPoint(), svgSize)
     # 居中
     rect.moveTo((tp.viewWdith() - tp.margins().left() - tp.margins().right() - rect.width()) / 2, tp.paintPoint().y())
 
     # 绘制 SVG
-    svgRender.render(painter, rect)
+    if svgRender is None:
+        renderPlaceholder(painter, rect)
+    else:
+        tp.addPixmap(rect.topLeft(), ImageRender.latexPixmap(
+            data, svgRender, svgSize, painter.device().devicePixelRatioF(), owner=tp.ast()))
     # transfome
     tp.setPaintPoint(QPointF(tp.margins().left(), rect.bottom()))
 
@@ -191,7 +222,6 @@ def renderBlockLatexImage(tp: TextParagraph, data: str, ast: MarkdownASTBase, pa
 def renderBlockLatexText(tp: TextParagraph, data: str, ast: MarkdownASTBase, painter: QPainter):
     """" 绘制latex 的文本"""
     # 在绘制 $$
-    _p_pos, fm = tp.paintPoint(), QFontMetrics(painter.font())
     renderText(tp=tp, data="$$", ast=ast, painter=painter)
     renderSoftBreak(tp=tp, data=data, ast=ast, painter=painter)
 
@@ -205,7 +235,9 @@ def renderBlockLatexText(tp: TextParagraph, data: str, ast: MarkdownASTBase, pai
 
 @TextParagraph.registerRenderFunction(TextParagraph.Render_Image)
 def renderImage(tp: TextParagraph, data: str, ast: MarkdownASTBase, painter: QPainter):
-    image: QImage = ImageRender.renderImage(url=data)
+    # 1. 图片的尺寸来自文件头, 排版不需要等待解码
+    loader = ImageLoader.instance()
+    size = loader.imageSize(data)
     # 如果不是在边距上,另开一行渲染
     if tp.margins().left() != tp.paintPoint().x():
         tp.setPaintPoint(QPointF(float(tp.margins().left()),
@@ -213,10 +245,13 @@ def renderImage(tp: TextParagraph, data: str, ast: MarkdownASTBase, painter: QPa
     width = tp.viewWdith() - tp.margins().left() - tp.margins().right()
     p = QPointF(tp.margins().left(), tp.paintPoint().y()).toPoint()
 
+    dpr = painter.device().devicePixelRatioF()
+    image = None if size is None else ImageRender.requestImage(data, width=int(width), dpr=dpr, owner=tp.ast())
+
     # the image is not exists
-    if image is None:
+    if size is None or loader.isFailed(data, int(width), dpr):
         text = "😡没有图片呀!"
-        fm = painter.fontMetrics()
+        fm = FontMetricsCache.metrics(painter.font())
         rect = fm.boundingRect(text)
         painter.setPen(Qt.NoPen)
         painter.setBrush(QColor(225, 0, 0, 75))
@@ -228,30 +263,40 @@ def renderImage(tp: TextParagraph, data: str, ast: MarkdownASTBase, painter: QPa
         painter.drawText(textP, text)
         nextP = QPointF(tp.margins().left(), tp.paintPoint().y() + img_size.height())
     else:
-        # reszie
-        image = image.scaled(int(width), int(image.height() / image.width() * width), Qt.KeepAspectRatio)
-        painter.drawImage(p, image)
-        nextP = QPointF(tp.margins().left(), tp.paintPoint().y() + image.height())
+        # 2. 正在解码, 先绘制占位
+        img_size = ImageLoader.scaledSize(size, int(width))
+        if image is None:
+            renderPlaceholder(painter, QRectF(p, QSizeF(img_size)))
+        else:
+            tp.addPixmap(p, image)
+        nextP = QPointF(tp.margins().left(), tp.paintPoint().y() + img_size.height())
     tp.setPaintPoint(nextP)
 
 
 @TextParagraph.registerRenderFunction(TextParagraph.Render_InlineLatexImage)
 def renderInLineLatexImage(tp: TextParagraph, data: str, ast: MarkdownASTBase, painter: QPainter):
     """" 绘制 Latex  """
-    svgRender = QSvgRenderer(QByteArray(ImageRender.renderLatexSvg(latex=data).getvalue()))
+    svg = ImageRender.requestLatexSvg(latex=data, owner=tp.ast())
     # 1. 判断当前的 svg是否需要超过基线
-    jRnder = QSvgRenderer(QByteArray(ImageRender.renderLatexSvg(latex='j').getvalue()))  # 基线判例
+    jHeight = ImageRender.latexProbeHeight(owner=tp.ast())  # 基线判例
 
     # 2.reszie
     # 2.1调整到size 和行一致
     # 3. 判断当前的 svg是否需要超过基线
-    if jRnder.defaultSize().height() == svgRender.defaultSize().height():
-        svgHight = painter.fontMetrics().height() - painter.fontMetrics().descent()
-    elif jRnder.defaultSize().height() > svgRender.defaultSize().height():
-        svgHight = painter.fontMetrics().ascent() - painter.fontMetrics().descent()
+    fm = FontMetricsCache.metrics(painter.font())
+    if svg is None:  # <-- 正在渲染, 先绘制占位
+        svgRender = None
+        svgSize = QSizeF(FontMetricsCache.width(painter.font(), data), fm.height() - fm.descent())
     else:
-        svgHight = painter.fontMetrics().height() - painter.fontMetrics().descent()
-    svgSize = svgRender.defaultSize() * svgHight / svgRender.defaultSize().height()
+        svgRender = ImageRender.latexSvgRenderer(data, svg, owner=tp.ast())
+        if jHeight is None: jHeight = svgRender.defaultSize().height()
+        if jHeight == svgRender.defaultSize().height():
+            svgHight = fm.height() - fm.descent()
+        elif jHeight > svgRender.defaultSize().height():
+            svgHight = fm.ascent() - fm.descent()
+        else:
+            svgHight = fm.height() - fm.descent()
+        svgSize = QSizeF(svgRender.defaultSize() * svgHight / svgRender.defaultSize().height())
 
     # 3.判断是否需要新开一行
     if tp.viewWdith() - tp.paintPoint().x() - tp.margins().right() < svgSize.width():
@@ -259,8 +304,12 @@ def renderInLineLatexImage(tp: TextParagraph, data: str, ast: MarkdownASTBase, p
                                  tp.paintPoint().y() + tp.lineHeight() + tp.inPragraphReutrnSpace()))
 
     # 绘制 SVG
-    rect = QRectF(tp.paintPoint() + QPointF(0, painter.fontMetrics().descent() * 2), QSizeF(svgSize))
-    svgRender.render(painter, rect)
+    rect = QRectF(tp.paintPoint() + QPointF(0, fm.descent() * 2), svgSize)
+    if svgRender is None:
+        renderPlaceholder(painter, rect)
+    else:
+        tp.addPixmap(rect.topLeft(), ImageRender.latexPixmap(
+            data, svgRender, svgSize, painter.device().devicePixelRatioF(), owner=tp.ast()))
     # transfome
     # 不计 cursor
     tp.setPaintPoint(tp.paintPoint() + QPointF(rect.width(), 0))
@@ -288,23 +337,17 @@ def renderParagraphLayer(tp: TextParagraph, data: BlockLayer, ast: MarkdownASTBa
     for i, w in zip(range(data.count()), width):
         item = data.itemAt(i)
         if isinstance(item, TextParagraph):
-            # 1. temp transform to other painter
-            ori_device = painter.device()
-            painter.end()
-
-            # 2. set render-param and render
+            # 1. set render-param and layout, the sub paragraph is rasterized with tp
             item.setViewWdith(width=w)
-            pixmap = item.render()
-            # 3. render in ori image
-            # 3.1 register
-            painter.begin(ori_device)
-            if pixmap.height() != 0:
-                painter.drawPixmap(tp.paintPoint(), pixmap)
+            height = item.layout()
+            # 2. register
+            if height != 0:
+                tp.addSubParagraph(tp.paintPoint(), item)
                 tp.addCursorBase(pos=[b + tp.paintPoint() for _, b in item.cursorBases()])
-                p = QPointF(pixmap.width() if data.orientation() == Qt.Horizontal else 0,
-                            pixmap.height() if data.orientation() == Qt.Vertical else 0)
-                ePos = QPointF(pixmap.width() + tp.paintPoint().x(),
-                               max(tp.paintPoint().y() + pixmap.height(), ePos.y()))
+                p = QPointF(item.width() if data.orientation() == Qt.Horizontal else 0,
+                            height if data.orientation() == Qt.Vertical else 0)
+                ePos = QPointF(item.width() + tp.paintPoint().x(),
+                               max(tp.paintPoint().y() + height, ePos.y()))
                 tp.setPaintPoint(pos=tp.paintPoint() + p)
 
 
@@ -1,36 +1,139 @@
+import json
+import os
+import re
 import typing as t
 
-import parse
+from PyQt5.QtCore import QStandardPaths
 from PyQt5.QtGui import QFont, QPen, QColor
-from functools import cache
 from . import utils
-
-nthChildTemplate = parse.compile("nth-child({})")
+from ..diagnostics import getLogger, lazy
+from ..disk_cache import DiskCache
+
+logger = getLogger(__name__)
+nthChildRe = re.compile(r"nth-child\((.*)\)")
+
+
+class StyleRecord():
+    """ the compiled style of (ast, pseudo), the values are ready-made and must not be modified. None: not set """
+    __slots__ = ("key", "fontSize", "fontFamily", "italic", "bold", "color", "borderWidth",
+                 "backgroundColor", "radius", "padding", "indentation")
+
+    def __init__(self, ast: str, key: str, rule: dict):
+        self.key = key  # the selector in css
+        self.fontSize: t.Optional[int] = rule.get("font-size", None)
+        self.fontFamily: t.Optional[str] = rule.get("font-family", None)
+        self.italic: t.Optional[bool] = None if "font-style" not in rule else rule["font-style"] == "italic"
+        self.bold: t.Optional[bool] = None if "font-weight" not in rule else rule["font-weight"] == "bold"
+        self.color: t.Optional[QColor] = None if "color" not in rule else QColor(*rule["color"])
+        self.borderWidth: t.Optional[int] = rule.get("border-width", None)
+        # 背景
+        if "background-color" in rule:
+            self.backgroundColor = QColor(*rule["background-color"])
+        else:
+            self.backgroundColor = QColor(16, 16, 16, 16) if ast == "block_math" else QColor(0, 0, 0, 0)
+        self.radius: float = rule.get("border-radius", 0)
+        if ast == "block_math":
+            self.padding: t.Tuple[int, int, int, int] = (25, 25, 25, 25)
+        else:
+            self.padding = tuple(rule.get("padding", (0, 0, 0, 0)))  # <-- json 中是 list
+        self.indentation: int = 15 if ast == "block_math" else 0
 
 
 class MarkdownStyle():
+    """
+    the css is compiled into a table of StyleRecord, (ast, pseudo) is mapped to a small integer (recordId) in the table.
+    the records of selectors in css are compiled in create, the others (for example: nth-child(n) of each row) are
+    compiled when they are used first.
+    the style of the same css is created once and shared by the editors (the style is read-only after create), and
+    the rules parsed by cssutils are saved in diskCache (json), so cssutils is not needed to create it again.
+    """
+    useDiskCache = True
+    cacheDirectory: t.Optional[str] = None  # None: <GenericCacheLocation>/MarkdownEditor/style
+    cacheVersion = 1  # <-- Parser 的输出改变时加一
+    __styles: t.Dict[str, "MarkdownStyle"] = {}  # hash of css -> style
+    __diskCache: t.Optional[DiskCache] = None
+
     @classmethod
     def create(cls, string: str) -> 'MarkdownStyle':
+        """ the compiled style of css, it is shared by all callers with the same css """
+        key = DiskCache.key(cls.cacheVersion, string)
+        style = cls.__styles.get(key, None)
+        if style is None:
+            style = MarkdownStyle(rule=cls.ruleDict(string, key))
+            style.compile()
+            cls.__styles[key] = style
+        return style
+
+    @classmethod
+    def ruleDict(cls, string: str, key: str) -> dict:
+        """ the rules of css, they are read from diskCache or parsed by cssutils and saved into diskCache """
+        cache = cls.diskCache()
+        data = None if cache is None else cache.get(key)
+        if data is not None:
+            try:
+                return json.loads(data)
+            except ValueError:
+                pass  # <-- 损坏的文件, 重新解析
         # 解析 CSS 内容
         from .parse import Parser
         rule_dict = Parser.toDict(string)
-        print(rule_dict)
-        return MarkdownStyle(rule=rule_dict)
-    @cache
+        logger.debug("stylesheet parsed, rules=%d\n%s", len(rule_dict), lazy(json.dumps, rule_dict, indent=1))
+        if cache is not None:
+            cache.put(key, json.dumps(rule_dict).encode("utf-8"))
+        return rule_dict
+
+    @classmethod
+    def diskCache(cls) -> t.Optional[DiskCache]:
+        if not cls.useDiskCache: return None
+        if cls.__diskCache is None:
+            directory = cls.cacheDirectory or os.path.join(
+                QStandardPaths.writableLocation(QStandardPaths.GenericCacheLocation), "MarkdownEditor", "style")
+            cls.__diskCache = DiskCache(directory, suffix=".json", maxBytes=4 << 20)
+        return cls.__diskCache
+
+    @classmethod
+    def clearCache(cls):
+        """ forget the created styles, the next create compiles the css again (the disk cache is kept) """
+        cls.__styles.clear()
+
+    def compile(self):
+        """ compile the selectors in css """
+        for key in self._rule.keys():
+            ast, _, pseudo = key.partition(":")
+            self.__ids[(ast, pseudo)] = self.__compile(ast=ast, key=key)
+
+    def __compile(self, ast: str, key: str) -> int:
+        # 不同的 pseudo 可能得到同一条规则, 例如: nth-child(1) 和 nth-child(3)
+        idx = self.__keyIds.get((ast, key), None)
+        if idx is None:
+            idx = self.__keyIds[(ast, key)] = len(self.__records)
+            self.__records.append(StyleRecord(ast=ast, key=key, rule=self._rule[key]))
+        return idx
+
+    def recordId(self, ast: str, pseudo: str = "") -> int:
+        """ the index of (ast, pseudo) in the table """
+        idx = self.__ids.get((ast, pseudo), None)
+        if idx is None:
+            idx = self.__ids[(ast, pseudo)] = self.__compile(ast=ast, key=self._autoToKey(ast=ast, pseudo=pseudo))
+        return idx
+
+    def record(self, ast: str, pseudo: str = "") -> StyleRecord:
+        idx = self.__ids.get((ast, pseudo), None)
+        return self.__records[self.recordId(ast, pseudo) if idx is None else idx]
+
+    def records(self) -> t.List[StyleRecord]:
+        return self.__records
+
     def _autoToKey(self, ast, pseudo) -> str:
         # 伪类装饰器
         if pseudo != "":
             # 层叠样式表
-            if "nth-child" in pseudo:
+            m = nthChildRe.fullmatch(pseudo)
+            if m is not None and m.group(1).strip().lstrip("+-").isdigit():
                 # 选择可能的 nth-child
-                partten = f"{ast}:nth-child"
-                keys = (k for k in self._rule.keys() if partten in k)
-                fr = int(nthChildTemplate.search(pseudo).fixed[0])
-                for k in keys:
-                    kr_ = nthChildTemplate.search(k).fixed[0]
-                    if utils.paserMatch_nth_child(source=kr_, target=fr):
-                        pseudo = f'nth-child({kr_})'
-                        break
+                index = int(m.group(1))
+                for nth, key in self.__nthChildren.get(ast, ()):
+                    if nth.match(index): return key
             ast = f"{ast}:{pseudo}"
 
         if ast not in self._rule:
@@ -39,6 +142,19 @@ class MarkdownStyle():
 
     def __init__(self, rule):
         self._rule = rule
+        self.__records: t.List[StyleRecord] = []
+        self.__ids: t.Dict[t.Tuple[str, str], int] = {}  # (ast, pseudo) -> index of record
+        self.__keyIds: t.Dict[t.Tuple[str, str], int] = {}  # (ast, selector) -> index of record
+        # ast -> [(An+B, selector)], nth-child 的选择器预编译
+        self.__nthChildren: t.Dict[str, t.List[t.Tuple[utils.NthChild, str]]] = {}
+        for key in rule.keys():
+            ast, _, pseudo = key.partition(":")
+            m = nthChildRe.fullmatch(pseudo)
+            if m is None: continue
+            try:
+                self.__nthChildren.setdefault(ast, []).append((utils.NthChild.parse(m.group(1)), key))
+            except ValueError:
+                pass  # <-- 无效的选择器不会匹配
 
     def inPragraphReutrnSpace(self):
         # 换行间隔
@@ -49,68 +165,39 @@ class MarkdownStyle():
         return 10
 
     def hintFont(self, font: QFont, ast: str, pseudo: str = "", **kwargs) -> QFont:
-        key = self._autoToKey(ast=ast, pseudo=pseudo)
-        sub_rule = self._rule[key]
-
-        if "font-size" in sub_rule:
-            font.setPixelSize(sub_rule["font-size"])
-        if 'font-family' in sub_rule:
-            font.setFamily(sub_rule["font-family"])
-        if 'font-style' in sub_rule:
-            font.setItalic(sub_rule["font-style"] == "italic")
-        if 'font-weight' in sub_rule:
-            font.setBold(sub_rule["font-weight"] == "bold")
+        record = self.record(ast, pseudo)
+        if record.fontSize is not None:
+            font.setPixelSize(record.fontSize)
+        if record.fontFamily is not None:
+            font.setFamily(record.fontFamily)
+        if record.italic is not None:
+            font.setItalic(record.italic)
+        if record.bold is not None:
+            font.setBold(record.bold)
         return font
 
     def hintPen(self, pen: QPen, ast: str, pseudo: str = "", **kwargs):
-        key = self._autoToKey(ast=ast, pseudo=pseudo)
-        sub_rule = self._rule[key]
-
-        if "color" in sub_rule:
-            pen.setColor(QColor(*sub_rule["color"]))
-        if "border-width" in sub_rule:
-            pen.setWidth(sub_rule["border-width"])
+        record = self.record(ast, pseudo)
+        if record.color is not None:
+            pen.setColor(record.color)
+        if record.borderWidth is not None:
+            pen.setWidth(record.borderWidth)
         return pen
 
     def hintIndentation(self, ast: str, **kwargs) -> int:
         """ 推荐缩进 """
-        if ast == "block_math":
-            indentation = 15
-        else:
-            indentation = 0
-        return indentation
+        return self.record(ast).indentation
 
     def hintBackgroundColor(self, ast: str, pseudo: str = "") -> QColor:
         """ 背景颜色 """
-        c = QColor(0, 0, 0, 0)
-        if ast == "block_math":
-            c = QColor(16, 16, 16, 16)
-
-        key = self._autoToKey(ast=ast, pseudo=pseudo)
-        sub_rule = self._rule[key]
-        if "background-color" in sub_rule:
-            c = QColor(*sub_rule["background-color"])
-
-        return c
+        return QColor(self.record(ast, pseudo).backgroundColor)
 
     def hintBorderRadius(self, ast: str, pseudo: str = "") -> float:
         """ 背景圆角半径 """
-        c = 0
-        key = self._autoToKey(ast=ast, pseudo=pseudo)
-        sub_rule = self._rule[key]
-        if "border-radius" in sub_rule:
-            c = sub_rule["border-radius"]
-        return c
+        return self.record(ast, pseudo).radius
 
     def hintBackgroundMargins(self, ast: str, pseudo: str = "") -> t.Tuple[int, int, int, int]:
-        if ast == "block_math":
-            return 25, 25, 25, 25
-        padding = (0, 0, 0, 0)
-        key = self._autoToKey(ast=ast, pseudo=pseudo)
-        sub_rule = self._rule[key]
-        if "padding" in sub_rule:
-            padding = sub_rule["padding"]
-        return padding
+        return self.record(ast, pseudo).padding
 
 
 if __name__ == "__main__":
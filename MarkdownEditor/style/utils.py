@@ -1,29 +1,45 @@
 import re
-import time
-
-from sympy import solve
-from sympy import symbols
-from sympy.parsing.sympy_parser import parse_expr
 from functools import cache
 
-_nSymbol = symbols("n")
+# 空白只允许出现在 B 的符号两侧
+_anPlusBRe = re.compile(r"^(?:(?P<a>[+-]?\d*)n(?:\s*(?P<sign>[+-])\s*(?P<b>\d+))?|(?P<only>[+-]?\d+))$", re.I)
+
+
+class NthChild():
+    """ the An+B of css nth-child, the index matches if index = A * n + B for an integer n >= 0 """
+    __slots__ = ("a", "b")
+
+    def __init__(self, a: int, b: int):
+        self.a = a
+        self.b = b
+
+    @staticmethod
+    @cache
+    def parse(string: str) -> "NthChild":
+        """ parse 'odd', 'even', 'B', 'An', 'An+B' (A may be omitted or negative), ValueError if it is invalid """
+        s = string.strip().lower()
+        if s == "odd": return NthChild(2, 1)
+        if s == "even": return NthChild(2, 0)
+        m = _anPlusBRe.match(s)
+        if m is None:
+            raise ValueError(f"invalid nth-child: {string!r}")
+        if m.group("only") is not None:
+            return NthChild(0, int(m.group("only")))
+        a = m.group("a")
+        a = {"": 1, "+": 1, "-": -1}.get(a, None) or int(a)
+        b = 0 if m.group("b") is None else int(m.group("b"))
+        return NthChild(a, -b if m.group("sign") == "-" else b)
+
+    def match(self, index: int) -> bool:
+        if self.a == 0:
+            return index == self.b
+        n, r = divmod(index - self.b, self.a)
+        return r == 0 and n >= 0
+
+    def __repr__(self) -> str:
+        return f"NthChild({self.a}n{self.b:+d})"
+
 
-@cache
 def paserMatch_nth_child(source: str, target: int) -> bool:
     """ 匹配 nth-child"""
-    st = time.time()
-    # 使用正则表达式替换数字和n的隐式乘法
-    # 正则表达式：r'(\d+)(n)' 匹配数字后跟着字母n
-    source = re.sub(r'(\d+)(n)', r'\1*\2', source)
-    source = re.sub(r'(n)(\d+)', r'\1*\2', source)
-
-    #  使用 parse_expr 解析替换后的表达式
-    expr = parse_expr(source + f"-{target}", evaluate=False)
-    # 求解方程
-    # 只要整数解
-    solutions = solve(expr, _nSymbol)
-
-    result = expr.subs(_nSymbol, int(solutions[0]))
-    # 查看是否有整数解
-    # print(1,time.time()-st)
-    return int(result) == 0
+    return NthChild.parse(source).match(target)
@@ -0,0 +1,105 @@
+import bisect
+import typing as t
+
+from PyQt5.QtCore import QPointF
+from PyQt5.QtGui import QFont, QGlyphRun, QPaintDevice, QTextLayout, QTextOption
+
+from .font_metrics import FontMetricsCache
+
+
+class ShapedText():
+    """ the result of TextEngine.shape: the glyph runs, a cursor base for each char and the end point """
+
+    def __init__(self, glyphRuns: t.List[QGlyphRun], cursorBases: t.List[QPointF], end: QPointF):
+        self.glyphRuns = glyphRuns
+        self.cursorBases = cursorBases
+        self.end = end
+
+
+class TextEngine():
+    """
+    shape a text run by QTextLayout, the lines are broken at word boundaries (or anywhere if a word is too long).
+    the coordinate of line is the same as TextParagraph: the top of row, and the rows are separated by lineSpace.
+    """
+    wrapMode = QTextOption.WrapAtWordBoundaryOrAnywhere
+    LineSeparator = "\u2028"
+
+    @classmethod
+    def shape(cls, text: str, font: QFont, device: QPaintDevice, start: QPointF, lineStart: float, right: float,
+              lineHeight: float, lineSpace: float) -> ShapedText:
+        """
+        :param start: the paint point, the first line starts from it
+        :param lineStart: the x of the other lines
+        :param right: the right edge of lines
+        :param lineHeight: the height of row
+        :param lineSpace: the space between two rows
+        """
+        if len(text) == 0: return ShapedText(glyphRuns=[], cursorBases=[], end=QPointF(start))
+        x, top = start.x(), start.y()
+        # the first word is moved to the next row if it dose not fit in the rest of row
+        word = text.split(None, 1)[0] if text[:1].strip() else ""
+        if x > lineStart and x + FontMetricsCache.width(font, word) > right:
+            top += lineHeight + lineSpace
+            x = lineStart
+
+        # '\n' is a hard line break in QTextLayout only as U+2028
+        layout = QTextLayout(text.replace("\n", cls.LineSeparator), font, device)
+        option = QTextOption()
+        option.setWrapMode(cls.wrapMode)
+        layout.setTextOption(option)
+        layout.setCacheEnabled(True)
+        baseline = lineHeight - FontMetricsCache.descent(font)  # <-- 与逐字绘制的基线一致
+        tops = []
+        layout.beginLayout()
+        while True:
+            line = layout.createLine()
+            if not line.isValid(): break
+            line.setLineWidth(max(right - x, 0))
+            line.setPosition(QPointF(x, top + baseline - line.ascent()))
+            tops.append(top)
+            top += lineHeight + lineSpace
+            x = lineStart
+        layout.endLayout()
+
+        # cursor bases in bulk, one for each char (code point of str)
+        offsets = cls.utf16Offsets(text)
+        cursorBases = []
+        for i, top in enumerate(tops):
+            line = layout.lineAt(i)
+            s = line.textStart()
+            if offsets is None:
+                cursorBases += [QPointF(line.cursorToX(p)[0], top) for p in range(s, s + line.textLength())]
+            else:  # <-- QTextLayout 的位置是 UTF-16, 跳过 low surrogate
+                e = bisect.bisect_left(offsets, s + line.textLength())
+                cursorBases += [QPointF(line.cursorToX(p)[0], top) for p in offsets[len(cursorBases):e]]
+        line = layout.lineAt(len(tops) - 1)
+        end = QPointF(line.cursorToX(line.textStart() + line.textLength())[0], tops[-1])
+        return ShapedText(glyphRuns=layout.glyphRuns(), cursorBases=cursorBases, end=end)
+
+    @staticmethod
+    def utf16Offsets(text: str) -> t.Optional[t.List[int]]:
+        """ the UTF-16 offset of each char, None if there is no char outside the BMP (the offset is the index) """
+        if text.isascii() or max(text) <= "\uffff":
+            return None
+        offsets, u = [], 0
+        for ch in text:
+            offsets.append(u)
+            u += 2 if ch > "\uffff" else 1
+        return offsets
+
+
+if __name__ == "__main__":
+    # python -m MarkdownEditor.text_engine: a cursor base for each char of str, the chars outside the BMP included
+    import sys
+    from PyQt5.QtGui import QImage
+    from PyQt5.QtWidgets import QApplication
+
+    app = QApplication(sys.argv)
+    image = QImage(400, 400, QImage.Format_ARGB32)
+    for text in ("0123456789", "0123\U0001F600567 9", "\U0001F600" * 40, "a\U00020000b\nc\U0001F600"):
+        shaped = TextEngine.shape(text=text, font=QFont(), device=image, start=QPointF(0, 0), lineStart=0,
+                                  right=200, lineHeight=20, lineSpace=5)
+        assert len(shaped.cursorBases + [shaped.end]) == len(text) + 1, (text, len(shaped.cursorBases))
+        xs = [p.x() + p.y() * 1000 for p in shaped.cursorBases + [shaped.end]]
+        assert xs == sorted(xs), (text, xs)  # <-- 没有错位的 base
+    print("ok")
@@ -0,0 +1 @@
+""" benchmarks of the markdown editor, run them from the root of the repository, e.g. python -m benchmark.memory """
@@ -0,0 +1,148 @@
+"""
+the cost of the diagnostics (the loggers of MarkdownEditor) when they are disabled and when they output debug messages
+
+    python -m benchmark.diagnostics [path] [--keys 200] [--repeat 3]
+
+for each level the document is opened (setMarkdown until it is loaded), the stylesheet is compiled from css (without
+the caches) and the keys are typed through keyPressEvent. the debug messages are written to a memory stream, so the
+cost is the building of messages and not the terminal. the formatted messages and the lazy arguments are counted,
+both of them must be 0 when the diagnostics are disabled (exit code 1 otherwise)
+"""
+import argparse
+import io
+import logging
+import sys
+import time
+import typing as t
+
+from .stress import STRESS, CSS, closeEdit, ms
+
+LEVELS = {"off": None, "debug": logging.DEBUG}
+
+
+class Counter():
+    """ count LogRecord.getMessage and the str/repr of lazy arguments """
+
+    def __init__(self):
+        from MarkdownEditor.diagnostics import lazy
+        self.messages = 0
+        self.lazy = 0
+        self.__patches = [(logging.LogRecord, "getMessage"), (lazy, "__str__"), (lazy, "__repr__")]
+        for cls, name in self.__patches:
+            setattr(cls, name, self.__wrap(getattr(cls, name), "messages" if cls is logging.LogRecord else "lazy"))
+
+    def __wrap(self, func: t.Callable, counter: str):
+        def wapper(*args, **kwargs):
+            setattr(self, counter, getattr(self, counter) + 1)
+            return func(*args, **kwargs)
+
+        wapper.original = func
+        return wapper
+
+    def reset(self):
+        self.messages = self.lazy = 0
+
+    def close(self):
+        for cls, name in self.__patches:
+            setattr(cls, name, getattr(cls, name).original)
+
+
+def measure(args: argparse.Namespace, text: str, css: str, counter: Counter) -> t.Dict[str, float]:
+    from PyQt5.QtCore import Qt, QEvent
+    from PyQt5.QtGui import QKeyEvent
+    from PyQt5.QtWidgets import QApplication
+    from MarkdownEditor import MarkdownEdit
+    from MarkdownEditor.style import MarkdownStyle
+
+    edit = MarkdownEdit()
+    edit.resize(args.width, args.height)
+    edit.show()
+    counter.reset()
+
+    # 1. 打开文档
+    st = time.perf_counter()
+    edit.setMarkdown(text)
+    edit.document().waitForLoaded()
+    openTime = time.perf_counter() - st
+    QApplication.processEvents()
+    edit.viewport().repaint()
+
+    # 2. 编译样式表 (不使用缓存)
+    MarkdownStyle.clearCache()
+    st = time.perf_counter()
+    MarkdownStyle.create(css)
+    styleTime = time.perf_counter() - st
+
+    # 3. 在中间的段落输入
+    root = edit.document().ast()
+    paragraphs = [ast for ast in root.children if ast.type == "paragraph"]
+    ast = paragraphs[len(paragraphs) // 2]
+    edit.verticalScrollBar().setValue(edit._container.heightIndex().y(root.index(ast)))
+    QApplication.processEvents()
+    edit.viewport().repaint()
+    edit.cursor().setAST(ast, 0)
+    keys = []
+    for i in range(args.keys):
+        char = "abcdefghijklmnopqrstuvwxyz "[i % 27]
+        key = Qt.Key_Space if char == " " else Qt.Key_A + ord(char) - ord("a")
+        event = QKeyEvent(QEvent.KeyPress, key, Qt.NoModifier, char)
+        st = time.perf_counter()
+        edit.keyPressEvent(event)
+        keys.append(time.perf_counter() - st)
+    QApplication.processEvents()
+    closeEdit(edit)
+    return {"open": ms(openTime), "style": ms(styleTime), "typing.total": ms(sum(keys)),
+            "messages": counter.messages, "lazy": counter.lazy}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="the cost of the diagnostics of the editor")
+    parser.add_argument("path", nargs="?", default=STRESS)
+    parser.add_argument("--keys", type=int, default=200, help="the number of typed keys")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--width", type=int, default=900)
+    parser.add_argument("--height", type=int, default=700)
+    args = parser.parse_args()
+
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    from MarkdownEditor.diagnostics import Diagnostics
+    from MarkdownEditor.image_loader import ImageLoader
+    from MarkdownEditor.latex import LatexRenderer
+    from MarkdownEditor.style import MarkdownStyle
+    LatexRenderer.asynchronous = ImageLoader.asynchronous = False
+    LatexRenderer.useDiskCache = ImageLoader.useThumbnailCache = MarkdownStyle.useDiskCache = False
+
+    with open(args.path, "r", encoding="utf8") as f:
+        text = f.read()
+    with open(CSS, "r", encoding="utf8") as f:
+        css = f.read()
+    counter = Counter()
+    results: t.Dict[str, t.Dict[str, float]] = {}
+    try:
+        measure(args, text, css, counter)  # <-- 预热, 第一次打开包括了字体, 图片和公式的加载
+        for name, level in LEVELS.items():
+            stream = io.StringIO()
+            if level is None:
+                Diagnostics.disable()
+            else:
+                Diagnostics.enable(level, stream=stream)
+            runs = [measure(args, text, css, counter) for _ in range(max(args.repeat, 1))]
+            Diagnostics.disable()
+            results[name] = {metric: min(run[metric] for run in runs) for metric in runs[0]}
+            results[name]["output"] = len(stream.getvalue()) // max(args.repeat, 1)
+    finally:
+        counter.close()
+
+    print(f"{'level':<8}{'open':>12}{'style':>12}{'typing':>12}{'messages':>10}{'lazy':>6}{'output':>12}")
+    for name, result in results.items():
+        print(f"{name:<8}{result['open']:>10.1f}ms{result['style']:>10.1f}ms{result['typing.total']:>10.1f}ms"
+              f"{result['messages']:>10}{result['lazy']:>6}{result['output']:>10}ch")
+    off = results["off"]
+    if off["messages"] or off["lazy"] or off["output"]:
+        print("FAILED: messages are built while the diagnostics are disabled")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+the import time of the package, it fails (exit code 1) if the budget is exceeded or a lazy module is imported
+
+    python -m benchmark.importtime [--budget 1000] [--own-budget 150] [--repeat 3] [--top 10]
+
+`python -X importtime -c "import MarkdownEditor"` is run in a new process, the fastest run of repeat is used
+"""
+import argparse
+import os
+import subprocess
+import sys
+import typing as t
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = "MarkdownEditor"
+# 这些模块只在第一次用到时导入 (latex, 样式表, 解析)
+LAZY = ("matplotlib", "sympy", "cssutils", "mistune", "parse", "importlib.metadata")
+
+
+def importTimes() -> t.Dict[str, t.Tuple[int, int]]:
+    """ module -> (self, cumulative) in microseconds """
+    env = dict(os.environ, QT_QPA_PLATFORM=os.environ.get("QT_QPA_PLATFORM", "offscreen"),
+               PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {PACKAGE}"],
+                             cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr)
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line: continue
+        selfTime, cumulative, name = line[len("import time:"):].split("|")
+        if not selfTime.strip().isdigit(): continue  # <-- 表头
+        times[name.strip()] = (int(selfTime), int(cumulative))
+    return times
+
+
+def isLazy(name: str) -> bool:
+    return any(name == module or name.startswith(module + ".") for module in LAZY)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="the import time budget of the package")
+    parser.add_argument("--budget", type=float, default=1000, help="the budget of `import MarkdownEditor` (ms)")
+    parser.add_argument("--own-budget", type=float, default=150, help="the budget of the modules of package (ms)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10, help="print the slowest top level packages")
+    args = parser.parse_args()
+
+    runs = [importTimes() for _ in range(max(args.repeat, 1))]
+    times = min(runs, key=lambda run: run[PACKAGE][1])
+    total = times[PACKAGE][1] / 1000
+    own = sum(selfTime for name, (selfTime, _) in times.items() if name.split(".")[0] == PACKAGE) / 1000
+
+    packages: t.Dict[str, int] = {}
+    for name, (selfTime, _) in times.items():
+        top = name.split(".")[0]
+        packages[top] = packages.get(top, 0) + selfTime
+    print(f"import {PACKAGE}: {total:.1f} ms (budget {args.budget:.0f} ms)")
+    print(f"modules of {PACKAGE}: {own:.1f} ms (budget {args.own_budget:.0f} ms)")
+    for top, selfTime in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {top:<24}{selfTime / 1000:8.1f} ms")
+
+    errors = []
+    if total > args.budget:
+        errors.append(f"import {PACKAGE} takes {total:.1f} ms > {args.budget:.0f} ms")
+    if own > args.own_budget:
+        errors.append(f"modules of {PACKAGE} take {own:.1f} ms > {args.own_budget:.0f} ms")
+    lazy = sorted(name for name in times if isLazy(name))
+    if lazy:
+        errors.append(f"lazy modules are imported: {', '.join(lazy)}")
+    for error in errors:
+        print(f"FAILED: {error}")
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
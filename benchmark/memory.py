@@ -0,0 +1,86 @@
+"""
+memory of the parsed ast, compare the __slots__ layout with the __dict__ layout
+
+    python -m benchmark.memory [path] [--layout slots|dict]
+
+each layout is measured in a new process, so the resident size is not polluted by the other one
+"""
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import tracemalloc
+
+STRESS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "stress.md")
+
+
+def residentSize() -> int:
+    """ the resident size of the process (bytes), -1 if it can not be measured """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return -1
+
+
+def countNodes(ast) -> int:
+    return 1 + sum(countNodes(c) for c in getattr(ast, "children", ()))
+
+
+def measure(path: str, layout: str) -> dict:
+    """ parse the file with the layout, return the size of the ast """
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    from MarkdownEditor.markdown_ast import MarkdownAstRoot, MarkdownASTBase
+
+    with open(path, "r", encoding="utf8") as f:
+        text = f.read()
+    MarkdownASTBase.setSlotsEnabled(layout == "slots")
+    MarkdownAstRoot.markdownParser()  # 解析器不计入
+    gc.collect()
+    rss = residentSize()
+    tracemalloc.start()
+    root = MarkdownAstRoot()
+    root.setText(text)
+    gc.collect()
+    traced, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"layout": layout,
+            "nodes": sum(countNodes(c) for c in root.children),
+            "traced": traced,
+            "rss": residentSize() - rss if rss >= 0 else -1}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="memory of the parsed ast")
+    parser.add_argument("path", nargs="?", default=STRESS)
+    parser.add_argument("--layout", choices=["slots", "dict"], default=None, help="measure one layout in this process")
+    args = parser.parse_args()
+
+    if args.layout is not None:
+        print(json.dumps(measure(args.path, args.layout)))
+        return
+
+    results = {}
+    for layout in ("dict", "slots"):
+        out = subprocess.run([sys.executable, "-m", "benchmark.memory", args.path, "--layout", layout],
+                             check=True, capture_output=True, text=True).stdout
+        results[layout] = json.loads(out.strip().splitlines()[-1])
+
+    mb = 1024 * 1024
+    print(f"{os.path.basename(args.path)}: {results['slots']['nodes']} nodes")
+    print(f"{'layout':<8}{'traced (MB)':>14}{'rss (MB)':>12}{'bytes/node':>12}")
+    for layout, r in results.items():
+        print(f"{layout:<8}{r['traced'] / mb:>14.2f}{r['rss'] / mb:>12.2f}{r['traced'] / r['nodes']:>12.1f}")
+    print(f"saved: {1 - results['slots']['traced'] / results['dict']['traced']:.1%} (traced)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+"""
+time the stages of the editor on a large document (stress.md), the results can be saved and compared with a baseline
+
+    python -m benchmark.stress [path] [--stages parse,layout,...] [--repeat 3] [--output result.json]
+    python -m benchmark.stress --baseline base.json [--tolerance 0.15]   # exit code 1 if a stage regresses
+    python -m benchmark.stress --input new.json --baseline base.json     # compare two saved results
+    python -m benchmark.stress --stages scroll --repeat 1 --trace trace.json  # the spans of chrome://tracing
+
+stages:
+    parse     MarkdownAstRoot.setText of the whole document
+    tokenize  the mistune parser only
+    ast       MarkdownAstRoot.parse (parseFromAST of blocks) of the tokens
+    layout    CachePaint.layoutAst of each block (what ContentItem.render_ does before painting)
+    raster    CachePaint.rasterize of each block (TextParagraph.rasterize and the merge of paragraphs)
+    scroll    scroll MarkdownEdit through the document page by page, a repaint for each page
+    typing    bursts of characters through the input method (MarkdownCursor.add) at several blocks
+    idle      the blinks of caret (the timeout of showCursorShaderTimer and the repaint) in the middle of document
+    select    drag the end of a selection (which starts pages above) down the viewport, a repaint for each step
+
+the latex and images are rendered in the caller thread without the disk caches, so the results do not depend on
+the worker processes or the caches of machine. the best of repeat is compared, all runs are saved.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import typing as t
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STRESS = os.path.join(ROOT, "stress.md")
+CSS = os.path.join(ROOT, "MarkdownEditor", "_rc", "github.css")
+
+STAGES: t.Dict[str, t.Callable[["Context"], t.Dict[str, float]]] = {}
+
+
+def stage(name: str):
+    """ register a stage, it returns {metric: milliseconds} """
+
+    def wapper(func: t.Callable):
+        STAGES[name] = func
+        return func
+
+    return wapper
+
+
+class Context():
+    """ the arguments and the shared objects of stages """
+
+    def __init__(self, args: argparse.Namespace, text: str):
+        self.args = args
+        self.text = text
+        self.byType: t.Dict[str, t.Dict[str, float]] = {}  # stage -> ast type -> milliseconds
+        self.__style = None
+
+    def style(self):
+        if self.__style is None:
+            from MarkdownEditor.style import MarkdownStyle
+            with open(CSS, "r", encoding="utf8") as f:
+                css = f.read()
+            self.__style = MarkdownStyle.create(css)
+        return self.__style
+
+    def root(self):
+        from MarkdownEditor.markdown_ast import MarkdownAstRoot
+        root = MarkdownAstRoot()
+        root.setText(self.text)
+        return root
+
+
+def ms(seconds: float) -> float:
+    return round(seconds * 1000, 3)
+
+
+def percentile(values: t.List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)] if values else 0
+
+
+@stage("parse")
+def parseStage(ctx: Context) -> t.Dict[str, float]:
+    from MarkdownEditor.markdown_ast import MarkdownAstRoot
+    root = MarkdownAstRoot()
+    st = time.perf_counter()
+    root.setText(ctx.text)
+    return {"parse": ms(time.perf_counter() - st)}
+
+
+@stage("tokenize")
+def tokenizeStage(ctx: Context) -> t.Dict[str, float]:
+    from MarkdownEditor.markdown_ast import MarkdownAstRoot
+    parser = MarkdownAstRoot.markdownParser()
+    st = time.perf_counter()
+    parser(ctx.text)
+    return {"tokenize": ms(time.perf_counter() - st)}
+
+
+@stage("ast")
+def astStage(ctx: Context) -> t.Dict[str, float]:
+    from MarkdownEditor.markdown_ast import MarkdownAstRoot
+    tokens = MarkdownAstRoot.markdownParser()(ctx.text)
+    root = MarkdownAstRoot()
+    st = time.perf_counter()
+    root.parse(tokens)
+    return {"ast": ms(time.perf_counter() - st)}
+
+
+@stage("layout")
+def layoutStage(ctx: Context) -> t.Dict[str, float]:
+    return paintBlocks(ctx, rasterize=False)
+
+
+@stage("raster")
+def rasterStage(ctx: Context) -> t.Dict[str, float]:
+    return paintBlocks(ctx, rasterize=True)
+
+
+def paintBlocks(ctx: Context, rasterize: bool) -> t.Dict[str, float]:
+    """ layout (and rasterize) each block, the time of blocks is summed by the type of ast """
+    from PyQt5.QtCore import QMargins
+    from MarkdownEditor.cache_paint import CachePaint
+    style = ctx.style()
+    root = ctx.root()
+    margins = QMargins(*style.hintBackgroundMargins(ast="root"))
+    cp = CachePaint(None)
+    name = "raster" if rasterize else "layout"
+    byType: t.Dict[str, float] = {}
+    total = 0
+    for ast in root.children:
+        st = time.perf_counter()
+        cp.layoutAst(ast=ast, width=ctx.args.width, margins=margins, style=style)
+        if rasterize:
+            st = time.perf_counter()  # <-- 只计算绘制的时间
+            cp.rasterize(ast)
+        cost = time.perf_counter() - st
+        byType[ast.type] = byType.get(ast.type, 0) + cost
+        total += cost
+    ctx.byType[name] = {key: ms(value) for key, value in sorted(byType.items(), key=lambda item: -item[1])}
+    return {name: ms(total)}
+
+
+def newEdit(ctx: Context):
+    """ a shown MarkdownEdit with the whole document loaded """
+    from PyQt5.QtWidgets import QApplication
+    from MarkdownEditor import MarkdownEdit
+    edit = MarkdownEdit()
+    edit.resize(ctx.args.width, ctx.args.height)
+    edit.show()
+    edit.setMarkdown(ctx.text)
+    edit.document().waitForLoaded()
+    QApplication.processEvents()
+    edit.viewport().repaint()
+    return edit
+
+
+def closeEdit(edit):
+    """ delete the editor now, otherwise it is deleted by the garbage collector (of the cycles of its slots) at any
+    time, maybe in a slot of its own timer """
+    from PyQt5.QtCore import QEvent
+    from PyQt5.QtWidgets import QApplication
+    edit.close()
+    edit.deleteLater()
+    QApplication.sendPostedEvents(None, QEvent.DeferredDelete)
+    gc.collect()
+
+
+@stage("scroll")
+def scrollStage(ctx: Context) -> t.Dict[str, float]:
+    from PyQt5.QtWidgets import QApplication
+    edit = newEdit(ctx)
+    bar = edit.verticalScrollBar()
+    frames = []
+    value = 0
+    while value < bar.maximum():
+        value = min(value + edit.viewport().height(), bar.maximum())
+        st = time.perf_counter()
+        bar.setValue(value)
+        edit.viewport().repaint()
+        frames.append(time.perf_counter() - st)
+        QApplication.processEvents()
+    closeEdit(edit)
+    return {"scroll.total": ms(sum(frames)), "scroll.p95": ms(percentile(frames, 0.95)),
+            "scroll.max": ms(max(frames, default=0))}
+
+
+@stage("typing")
+def typingStage(ctx: Context) -> t.Dict[str, float]:
+    from PyQt5.QtGui import QInputMethodEvent
+    from PyQt5.QtWidgets import QApplication
+    edit = newEdit(ctx)
+    root = edit.document().ast()
+    paragraphs = [ast for ast in root.children if ast.type == "paragraph"]
+    keys = []
+    for ratio in (0.1, 0.5, 0.9):
+        if not paragraphs: break
+        ast = paragraphs[int(len(paragraphs) * ratio)]
+        # 只有显示的 block 可以编辑, 先滚动到这个 block
+        edit.verticalScrollBar().setValue(edit._container.heightIndex().y(root.index(ast)))
+        QApplication.processEvents()
+        edit.viewport().repaint()
+        edit.cursor().setAST(ast, 0)
+        for char in ctx.args.burst:
+            event = QInputMethodEvent()
+            event.setCommitString(char)
+            st = time.perf_counter()
+            edit.inputMethodEvent(event)
+            edit.viewport().repaint()
+            keys.append(time.perf_counter() - st)
+            QApplication.processEvents()
+    closeEdit(edit)
+    return {"typing.mean": ms(sum(keys) / max(len(keys), 1)), "typing.p95": ms(percentile(keys, 0.95)),
+            "typing.max": ms(max(keys, default=0))}
+
+
+@stage("idle")
+def idleStage(ctx: Context) -> t.Dict[str, float]:
+    from PyQt5.QtWidgets import QApplication
+    edit = newEdit(ctx)
+    root = edit.document().ast()
+    ast = root.children[len(root.children) // 2]
+    edit.verticalScrollBar().setValue(edit._container.heightIndex().y(root.index(ast)))
+    QApplication.processEvents()
+    edit.viewport().repaint()
+    edit.cursor().setAST(ast, 0)
+    timer = edit.cursor().showCursorShaderTimer
+    timer.stop()  # <-- 手动触发闪烁
+    blinks = []
+    for _ in range(ctx.args.blinks):
+        st = time.perf_counter()
+        timer.timeout.emit()
+        QApplication.processEvents()  # <-- 绘制
+        blinks.append(time.perf_counter() - st)
+    closeEdit(edit)
+    return {"idle.blink": ms(sum(blinks) / max(len(blinks), 1)), "idle.max": ms(max(blinks, default=0))}
+
+
+@stage("select")
+def selectStage(ctx: Context) -> t.Dict[str, float]:
+    from PyQt5.QtCore import QPoint
+    from PyQt5.QtWidgets import QApplication
+    edit = newEdit(ctx)
+    root = edit.document().ast()
+    top = edit._container.heightIndex().y(int(len(root.children) * 0.3))
+    edit.verticalScrollBar().setValue(top)
+    QApplication.processEvents()
+    edit.viewport().repaint()
+    # 选区从上方几页开始
+    edit.cursor().setAST(root.children[int(len(root.children) * 0.2)], 0)
+    edit.cursor().setSelectMode(edit.cursor().SELECT_MODE_MUTIL)
+    top = edit.verticalScrollBar().value()
+    steps = []
+    for i in range(ctx.args.height // 20 - 2):
+        pos = QPoint(100 + i % 7 * 100, top + 20 + i * 20)
+        st = time.perf_counter()
+        edit._updateCusorSelectSection(pos)
+        edit.viewport().repaint()
+        steps.append(time.perf_counter() - st)
+        QApplication.processEvents()
+    st = time.perf_counter()
+    for _ in range(10):
+        edit.viewport().repaint()
+    repaint = (time.perf_counter() - st) / 10
+    closeEdit(edit)
+    return {"select.drag": ms(sum(steps) / max(len(steps), 1)), "select.max": ms(max(steps, default=0)),
+            "select.paint": ms(repaint)}
+
+
+def run(args: argparse.Namespace) -> dict:
+    from PyQt5.QtCore import PYQT_VERSION_STR, QT_VERSION_STR
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    from MarkdownEditor.image_loader import ImageLoader
+    from MarkdownEditor.latex import LatexRenderer
+    # 在当前线程渲染, 不使用磁盘缓存
+    LatexRenderer.asynchronous = ImageLoader.asynchronous = False
+    LatexRenderer.useDiskCache = ImageLoader.useThumbnailCache = False
+    if args.trace:
+        from MarkdownEditor.instrumentation import Instrumentation
+        Instrumentation.setEnabled(True)
+
+    with open(args.path, "r", encoding="utf8") as f:
+        text = f.read()
+    ctx = Context(args, text)
+    runs: t.Dict[str, t.List[float]] = {}
+    for name in args.stages:
+        for _ in range(args.repeat):
+            for metric, value in STAGES[name](ctx).items():
+                runs.setdefault(metric, []).append(value)
+        print(f"{name:<10}" + "  ".join(f"{metric} {min(runs[metric]):.1f} ms"
+                                         for metric in runs if metric.split(".")[0] == name), file=sys.stderr)
+    if args.trace:
+        Instrumentation.instance().saveChromeTrace(args.trace)
+    return {
+        "meta": {"file": os.path.basename(args.path), "bytes": len(text.encode("utf8")),
+                 "blocks": len(ctx.root().children), "width": args.width, "height": args.height,
+                 "repeat": args.repeat, "python": platform.python_version(), "qt": QT_VERSION_STR,
+                 "pyqt": PYQT_VERSION_STR, "platform": platform.platform(),
+                 "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "metrics": {metric: min(values) for metric, values in runs.items()},
+        "runs": runs,
+        "byType": ctx.byType,
+    }
+
+
+def compare(base: dict, new: dict, tolerance: float, minDelta: float) -> t.List[str]:
+    """ print the change of metrics, return the regressed metrics (slower than tolerance and minDelta ms) """
+    regressions = []
+    print(f"{'metric':<16}{'base':>12}{'new':>12}{'change':>10}")
+    for metric, value in new["metrics"].items():
+        if metric not in base["metrics"]: continue
+        old = base["metrics"][metric]
+        change = (value - old) / old if old else 0
+        regressed = value > old * (1 + tolerance) and value - old > minDelta
+        if regressed:
+            regressions.append(metric)
+        print(f"{metric:<16}{old:>10.1f}ms{value:>10.1f}ms{change:>+10.1%}{'  REGRESSED' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="time the stages of the editor on a large document")
+    parser.add_argument("path", nargs="?", default=STRESS)
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"comma separated: {','.join(STAGES)}")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--width", type=int, default=900)
+    parser.add_argument("--height", type=int, default=700)
+    parser.add_argument("--burst", default="typing speed ", help="the characters of a typing burst")
+    parser.add_argument("--blinks", type=int, default=50, help="the blinks of caret in the idle stage")
+    parser.add_argument("--output", help="save the result (json)")
+    parser.add_argument("--input", help="load the result (json) instead of running the stages")
+    parser.add_argument("--baseline", help="compare the result with the baseline (json)")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="the allowed slowdown, 0.15: 15%%")
+    parser.add_argument("--min-delta", type=float, default=1.0, help="the smaller slowdown (ms) is noise")
+    parser.add_argument("--trace", help="record the spans of Instrumentation and save them as chrome trace (json)")
+    args = parser.parse_args()
+    args.stages = [name.strip() for name in args.stages.split(",") if name.strip()]
+    unknown = [name for name in args.stages if name not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)}")
+
+    if args.input:
+        with open(args.input, "r", encoding="utf8") as f:
+            result = json.load(f)
+    else:
+        result = run(args)
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as f:
+            json.dump(result, f, indent=2)
+    if not args.baseline:
+        json.dump(result["metrics"], sys.stdout, indent=2)
+        print()
+        return
+    with open(args.baseline, "r", encoding="utf8") as f:
+        base = json.load(f)
+    regressions = compare(base, result, tolerance=args.tolerance, minDelta=args.min_delta)
+    if regressions:
+        print(f"FAILED: {', '.join(regressions)} regressed more than {args.tolerance:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+render a table with many rows, the style of each row is resolved by its nth-child selector
+
+    python -m benchmark.table [--rows 10000] [--width 800]
+"""
+import argparse
+import os
+import sys
+import time
+
+CSS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "MarkdownEditor", "_rc", "github.css")
+
+
+def tableMarkdown(rows: int) -> str:
+    lines = ["| name | value | note |", "| :-- | :--: | --: |"]
+    lines += [f"| row {i} | {i * 7 % 1000} | cell {i} |" for i in range(rows)]
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="render a table with many rows")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--width", type=int, default=800)
+    args = parser.parse_args()
+
+    st = time.perf_counter()
+    from PyQt5.QtCore import QMargins
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    from MarkdownEditor.cache_paint import CachePaint
+    from MarkdownEditor.markdown_ast import MarkdownAstRoot
+    from MarkdownEditor.style.core import MarkdownStyle
+    importTime = time.perf_counter() - st
+
+    with open(CSS, "r", encoding="utf8") as f:
+        css = f.read()
+    style = MarkdownStyle.create(css)
+    root = MarkdownAstRoot()
+    root.setText(tableMarkdown(args.rows))
+    table = root.children[0]
+
+    # 1. 只解析行的样式
+    st = time.perf_counter()
+    for idx in range(args.rows):
+        style.hintBackgroundColor(ast="table tr", pseudo=f"nth-child({idx})")
+    matchTime = time.perf_counter() - st
+
+    # 2. 排版整个表格, 表格太高时不绘制 (QPixmap 的高度不能超过 32767)
+    cp = CachePaint(None)
+    margins = QMargins(25, 0, 25, 0)
+    st = time.perf_counter()
+    height = cp.layoutAst(ast=table, width=args.width, margins=margins, style=style)
+    layoutTime = time.perf_counter() - st
+    rasterizeTime = None
+    if height <= 32767:
+        st = time.perf_counter()
+        cp.rasterize(table)
+        rasterizeTime = time.perf_counter() - st
+
+    print(f"rows: {args.rows}, height: {height}")
+    print(f"import: {importTime * 1000:.1f} ms")
+    print(f"nth-child: {matchTime * 1000:.1f} ms ({matchTime / args.rows * 1e6:.1f} us/row)")
+    print(f"layout: {layoutTime * 1000:.1f} ms ({layoutTime / args.rows * 1e6:.1f} us/row)")
+    if rasterizeTime is not None:
+        print(f"rasterize: {rasterizeTime * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()